@@ -0,0 +1,228 @@
+"""Flight log analytics
+
+Loads recorded sessions (see recorder.py) as NumPy record arrays and
+summarizes them with vectorized operations. Per-segment arrays and whole
+session summaries are cached on (path, size, mtime, record count), so repeated queries
+only reread segments that changed. Both caches evict least recently used
+entries: segments past SEGMENT_CACHE_BYTES, summaries past SUMMARY_CACHE_SIZE.
+"""
+import os, threading
+from collections import OrderedDict
+import numpy as np
+
+from recorder import (HEADER, RECORD, KIND_TELEM, KIND_CMD, KIND_ARM, KIND_DISARM,
+                      KIND_EMERGENCY, KIND_CONNECTION, CONNECTION_STATES,
+                      session_segments, read_segment)
+
+# Same layout as recorder.RECORD ("<BBHd5f")
+RECORD_DTYPE = np.dtype([("kind", "u1"), ("flags", "u1"), ("reserved", "<u2"),
+                         ("t", "<f8"), ("v", "<f4", (5,))])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+# Battery sag bins. Recorded CMD throttle is the PWM value written to the
+# flight controller (1000-2000 us), not the joystick's -1..1 stick position
+THROTTLE_BINS = np.linspace(1000, 2000, 11)
+SPECTRUM_RATE_HZ = 50.0
+SPECTRUM_PEAKS = 3
+SEGMENT_CACHE_BYTES = 64 * 1024 * 1024   # a full segment is 2 MB
+SUMMARY_CACHE_SIZE = 64
+
+# -------------------------
+# Loading
+# -------------------------
+_segment_cache = OrderedDict()   # path -> (fingerprint, records)
+_segment_cache_bytes = 0
+_summary_cache = OrderedDict()   # directory -> (fingerprint, summary)
+_cache_lock = threading.Lock()
+
+def _fingerprint(path):
+    # mmap writes don't reliably touch mtime, so the header's record count
+    # is part of the key for the segment still being written
+    st = os.stat(path)
+    with open(path, "rb") as f:
+        count = HEADER.unpack(f.read(HEADER.size))[4]
+    return st.st_size, st.st_mtime_ns, count
+
+def load_segment(path):
+    """Records of one segment file as a structured array (cached)"""
+    global _segment_cache_bytes
+    key = _fingerprint(path)
+    with _cache_lock:
+        cached = _segment_cache.get(path)
+        if cached and cached[0] == key:
+            _segment_cache.move_to_end(path)
+            return cached[1]
+    start, data = read_segment(path)
+    records = np.frombuffer(data, dtype=RECORD_DTYPE)
+    with _cache_lock:
+        _drop_segment(path)
+        _segment_cache[path] = (key, records)
+        _segment_cache_bytes += records.nbytes
+        while _segment_cache_bytes > SEGMENT_CACHE_BYTES and len(_segment_cache) > 1:
+            _drop_segment(next(iter(_segment_cache)))
+    return records
+
+def _drop_segment(path):
+    """Forget a cached segment; call under _cache_lock"""
+    global _segment_cache_bytes
+    cached = _segment_cache.pop(path, None)
+    if cached:
+        _segment_cache_bytes -= cached[1].nbytes
+
+def load_session(directory):
+    """All records of a session, in time order"""
+    parts = [load_segment(path) for path in session_segments(directory)]
+    if not parts:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.concatenate(parts)
+
+# -------------------------
+# Summaries
+# -------------------------
+def battery_sag(telem, cmds):
+    """Mean voltage drop below the idle voltage per commanded throttle bin"""
+    if len(telem) == 0 or len(cmds) == 0:
+        return []
+    voltage = telem["v"][:, 3].astype(np.float64)
+    # Throttle in effect at each sample: the last command sent before it
+    idx = np.searchsorted(cmds["t"], telem["t"], side="right") - 1
+    valid = idx >= 0
+    if not valid.any():
+        return []
+    voltage = voltage[valid]
+    throttle = cmds["v"][idx[valid], 2].astype(np.float64)
+
+    bins = np.clip(np.digitize(throttle, THROTTLE_BINS) - 1, 0, len(THROTTLE_BINS) - 2)
+    counts = np.bincount(bins, minlength=len(THROTTLE_BINS) - 1)
+    sums = np.bincount(bins, weights=voltage, minlength=len(THROTTLE_BINS) - 1)
+    mins = np.full(len(counts), np.inf)
+    np.minimum.at(mins, bins, voltage)
+    idle = np.percentile(voltage, 95)
+
+    result = []
+    for i in np.nonzero(counts)[0]:
+        mean = sums[i] / counts[i]
+        result.append({
+            "throttle_pwm": [int(THROTTLE_BINS[i]), int(THROTTLE_BINS[i + 1])],
+            "samples": int(counts[i]),
+            "mean_voltage": round(float(mean), 3),
+            "min_voltage": round(float(mins[i]), 3),
+            "sag": round(float(idle - mean), 3)
+        })
+    return result
+
+def oscillation_spectrum(t, values, rate_hz=SPECTRUM_RATE_HZ, peaks=SPECTRUM_PEAKS):
+    """Dominant frequencies of one attitude axis
+
+    Samples are resampled onto a uniform grid (TELEM arrives with jitter),
+    detrended and windowed before the FFT.
+    """
+    if len(t) < 16 or t[-1] - t[0] <= 0:
+        return None
+    grid = np.arange(t[0], t[-1], 1.0 / rate_hz)
+    if len(grid) < 16:
+        return None
+    signal = np.interp(grid, t, values)
+    signal = signal - np.polyval(np.polyfit(grid - grid[0], signal, 1), grid - grid[0])
+    spectrum = np.abs(np.fft.rfft(signal * np.hanning(len(signal)))) * 2 / len(signal)
+    freqs = np.fft.rfftfreq(len(signal), 1.0 / rate_hz)
+    spectrum[0] = 0.0
+
+    top = np.argsort(spectrum)[::-1][:peaks]
+    return {
+        "rms_deg": round(float(np.sqrt(np.mean(signal ** 2))), 3),
+        "peaks": [{"hz": round(float(freqs[i]), 3), "amplitude_deg": round(float(spectrum[i]), 3)}
+                  for i in top if spectrum[i] > 0]
+    }
+
+def connection_time(records, end):
+    """Seconds spent in each connection state, from the recorded transitions"""
+    changes = records[records["kind"] == KIND_CONNECTION]
+    totals = dict.fromkeys(CONNECTION_STATES, 0.0)
+    if len(changes) == 0:
+        return totals
+    durations = np.diff(np.append(changes["t"], max(end, changes["t"][-1])))
+    per_state = np.bincount(changes["flags"], weights=durations, minlength=len(CONNECTION_STATES))
+    for i, state in enumerate(CONNECTION_STATES):
+        totals[state] = round(float(per_state[i]), 3)
+    totals["transitions"] = int(len(changes))
+    return totals
+
+def summarize(records):
+    """Summary dict for a session's records"""
+    kinds = records["kind"]
+    telem = records[kinds == KIND_TELEM]
+    cmds = records[kinds == KIND_CMD]
+    start = float(records["t"][0]) if len(records) else None
+    end = float(records["t"][-1]) if len(records) else None
+    duration = end - start if len(records) else 0.0
+
+    summary = {
+        "records": int(len(records)),
+        "start": start,
+        "duration_s": round(duration, 3),
+        "counts": {
+            "telem": int(len(telem)),
+            "cmd": int(len(cmds)),
+            "arm": int(np.count_nonzero(kinds == KIND_ARM)),
+            "disarm": int(np.count_nonzero(kinds == KIND_DISARM)),
+            "emergency": int(np.count_nonzero(kinds == KIND_EMERGENCY))
+        },
+        "telem_hz": round(len(telem) / duration, 2) if duration else None,
+        "battery": None,
+        "battery_sag": battery_sag(telem, cmds),
+        "spectrum": {},
+        "connection_s": connection_time(records, end or 0.0)
+    }
+
+    if len(telem):
+        voltage = telem["v"][:, 3]
+        armed = (telem["flags"] & 1).astype(bool)
+        summary["battery"] = {
+            "start_voltage": round(float(voltage[0]), 3),
+            "end_voltage": round(float(voltage[-1]), 3),
+            "min_voltage": round(float(voltage.min()), 3),
+            "armed_s": round(float(np.sum(np.diff(telem["t"])[armed[:-1]])), 3)
+        }
+        t = telem["t"]
+        for axis, column in (("roll", 0), ("pitch", 1)):
+            summary["spectrum"][axis] = oscillation_spectrum(t, telem["v"][:, column].astype(np.float64))
+    return summary
+
+def session_summary(directory):
+    """Cached summary of a recorded session directory"""
+    key = tuple((path, *_fingerprint(path)) for path in session_segments(directory))
+    with _cache_lock:
+        cached = _summary_cache.get(directory)
+        if cached and cached[0] == key:
+            _summary_cache.move_to_end(directory)
+            return cached[1]
+    summary = summarize(load_session(directory))
+    with _cache_lock:
+        _summary_cache[directory] = (key, summary)
+        _summary_cache.move_to_end(directory)
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+        # Drop arrays of segments that no longer exist (rotated away)
+        live = {path for path, *_ in key}
+        for path in [p for p in _segment_cache
+                     if os.path.dirname(p) == directory and p not in live]:
+            _drop_segment(path)
+    return summary
+
+def list_sessions(log_dir):
+    """Recorded sessions with their on-disk size, newest first"""
+    if not os.path.isdir(log_dir):
+        return []
+    sessions = []
+    for name in sorted(os.listdir(log_dir), reverse=True):
+        directory = os.path.join(log_dir, name)
+        if not os.path.isdir(directory):
+            continue
+        segments = session_segments(directory)
+        sessions.append({
+            "id": name,
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(path) for path in segments)
+        })
+    return sessions
@@ -1,330 +1,261 @@
-from flask import Flask, Response, render_template, request, jsonify
-import io, os, json, time, threading, serial, platform
-import re
+from flask import Flask, Response, render_template, request, jsonify, send_file, g
+import os, re, json, time, platform
+from functools import wraps
+from concurrent.futures import TimeoutError as FutureTimeout
+from flight_plan import PlanCache, CompileError
+from simulator import simulate_plan
+from closed_loop import tune_profile
+from assets import AssetStore
+from jobs import QueueFull
+import video_record
+from metrics import (Histogram, MetricsText, RateTracker, SamplingProfiler, collect_fleet,
+                     collect_process)
+from fleet import (Fleet, Drone, ControlSession, load_config, LOG_DIR, VIDEO_DIR, PROFILE_DIR, CONTROL_RATE_HZ,
+                   CONTROL_MODES, CONTROL_MODE, ARM_TIMEOUT, PROGRAM_STEP_SECONDS)
+from video_stream import (Picamera2MJPEGSource, Picamera2StillSource, OpenCVSource, PlaceholderSource,
+                          LazySource)
+
+# Static files are served by the asset store below, not Flask's handler
+app = Flask(__name__, static_folder=None)
+
+# Flight log analytics (optional - needs numpy)
+try:
+    import analytics
+except ImportError as e:
+    print("[WARN] numpy not available, flight log analytics disabled:", e)
+    analytics = None
 
-app = Flask(__name__)
-armed = False
-autonomous_mode = False  # Flag for autonomous flight
+# WebSocket control channel (optional - falls back to HTTP /joystick)
+try:
+    from flask_sock import Sock
+    sock = Sock(app)
+except ImportError as e:
+    print("[WARN] flask-sock not available, WebSocket control disabled:", e)
+    sock = None
 
 # -------------------------
-# Arduino serial setup
+# Fleet setup
 # -------------------------
-try:
-    if os.name == "nt":
-        arduino = serial.Serial("COM4", 250000, timeout=1)
-    else:
-        arduino = serial.Serial("/dev/serial0", 250000, timeout=1)
-    time.sleep(2)
-    arduino.reset_input_buffer()
-    print("[OK] Arduino connected")
-except Exception as e:
-    print("[ERROR] Arduino connection failed:", e)
-    arduino = None
+# FILO_SERIAL sets the port of a single drone: a device, a pyserial URL, or
+# "sim" for the simulated flight controller (see simulator.py). FILO_FLEET
+# lists several drones instead (see fleet.load_config).
+SERIAL_PORT = os.environ.get("FILO_SERIAL") or ("COM4" if os.name == "nt" else "/dev/serial0")
+FLEET_CONFIG = load_config(os.environ.get("FILO_FLEET"), SERIAL_PORT)
 
 # -------------------------
 # Camera setup (Auto detect)
 # -------------------------
-use_picamera2 = False
-picam2 = None
-camera = None
-
-try:
+# Only the drone configured with camera "local" uses this host's camera.
+# Cameras are opened lazily by their video source (see LazySource), so
+# startup never waits on them.
+def open_local_camera():
+    """Video source for this host's camera: PiCamera2 if present, else OpenCV"""
     if "arm" in platform.machine().lower():
-        from picamera2 import Picamera2
-        from libcamera import Transform
-        picam2 = Picamera2()
-        config = picam2.create_video_configuration(
-            main={"size": (320, 240)},
-            transform=Transform(hflip=1, vflip=1)
-        )
-        picam2.configure(config)
-        picam2.start()
-        time.sleep(2)
-        use_picamera2 = True
-        print("[CAM] Using PiCamera2")
-except Exception as e:
-    print("[WARN] PiCamera2 not available:", e)
-    use_picamera2 = False
-
-if not use_picamera2:
-    try:
-        import cv2
-        camera = cv2.VideoCapture(0)
-        print("[CAM] Using OpenCV webcam")
-    except Exception as e:
-        print("[ERROR] OpenCV camera error:", e)
-        camera = None
+        try:
+            from picamera2 import Picamera2
+            from libcamera import Transform
+            picam2 = Picamera2()
+            config = picam2.create_video_configuration(
+                main={"size": (320, 240)},
+                transform=Transform(hflip=1, vflip=1)
+            )
+            picam2.configure(config)
+            picam2.start()
+            time.sleep(2)
+            try:
+                import picamera2.encoders
+                print("[CAM] Using PiCamera2")
+                return Picamera2MJPEGSource(picam2)
+            except ImportError:
+                print("[CAM] Using PiCamera2 (still capture)")
+                return Picamera2StillSource(picam2)
+        except Exception as e:
+            print("[WARN] PiCamera2 not available:", e)
+
+    print("[CAM] Using OpenCV webcam")
+    return open_opencv_camera(0)
+
+def open_opencv_camera(spec):
+    """OpenCV device index or stream URL (e.g. the drone's own FPV feed)"""
+    import cv2
+    camera = cv2.VideoCapture(spec)
+    if not camera.isOpened():
+        camera.release()
+        raise OSError(f"OpenCV camera {spec!r} could not be opened")
+    return OpenCVSource(camera)
+
+def make_video_source(spec):
+    """Video source for a drone's `camera` setting"""
+    if spec == "local":
+        return LazySource(open_local_camera)
+    if spec is not None:
+        return LazySource(lambda: open_opencv_camera(spec))
+    return PlaceholderSource()
+
+fleet = Fleet()
+for entry in FLEET_CONFIG:
+    fleet.add(Drone(entry["id"], entry["port"], entry["airframe"], make_video_source(entry["camera"])))
+fleet.start()
+print(f"[OK] Fleet of {len(fleet)}: {', '.join(drone.id for drone in fleet)} (connecting in background)")
+
+plan_cache = PlanCache()
 
 # -------------------------
-# Telemetry data storage
+# Static assets
 # -------------------------
-telemetry = {
-    "roll": 0.0,
-    "pitch": 0.0,
-    "yaw_rate": 0.0,
-    "battery_voltage": 0.0,
-    "battery_percent": 0,
-    "armed": False,
-    "altitude": 0.0,
-    "connection": "disconnected"
-}
-
-arm_response = None
-arm_response_lock = threading.Lock()
+# Pages link assets through asset_url(), which gives the fingerprinted URL
+# (see assets.py). Those never change, so browsers keep them for a year;
+# plain /static URLs still work but are revalidated with the ETag.
+ASSET_CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+ASSET_CACHE_REVALIDATE = "no-cache"
+
+assets = AssetStore(os.path.join(app.root_path, "static")).load()
+app.add_template_global(assets.url, "asset_url")
+
+def asset_response(name, cache_control):
+    asset = assets.get(name)
+    if asset is None:
+        return Response(status=404)
+    encoding, body = asset.select(request.headers.get('Accept-Encoding'))
+    headers = {'ETag': asset.etag(encoding), 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if headers['ETag'] in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    if body is None:
+        # Large, incompressible: let the server sendfile() it from disk
+        response = send_file(asset.path, mimetype=asset.mimetype, conditional=False, etag=False)
+        response.headers.update(headers)
+        return response
+    return Response(body, content_type=asset.mimetype, headers=headers)
+
+@app.route('/assets/<fingerprint>/<path:filename>')
+def fingerprinted_asset(fingerprint, filename):
+    asset = assets.get(filename)
+    # An outdated fingerprint still gets the current file, just not cached forever
+    current = asset is not None and asset.hash == fingerprint
+    return asset_response(filename, ASSET_CACHE_IMMUTABLE if current else ASSET_CACHE_REVALIDATE)
+
+@app.route('/static/<path:filename>', endpoint='static')
+def static_asset(filename):
+    return asset_response(filename, ASSET_CACHE_REVALIDATE)
 
 # -------------------------
-# Frame generator
+# Per-drone routes
 # -------------------------
-def generate_frames():
-    if use_picamera2 and picam2:
-        while True:
-            stream = io.BytesIO()
-            picam2.capture_file(stream, format="jpeg")
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + stream.getvalue() + b'\r\n')
-    elif camera:
-        import cv2
-        while True:
-            success, frame = camera.read()
-            if not success:
-                continue
-            ret, buffer = cv2.imencode('.jpg', frame)
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-    else:
-        from PIL import Image
-        img = Image.new("RGB", (320, 240), (100, 100, 100))
-        while True:
-            stream = io.BytesIO()
-            img.save(stream, format="JPEG")
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + stream.getvalue() + b'\r\n')
-
-# -------------------------
-# Autonomous flight command parser
-# -------------------------
-class DroneCommandExecutor:
-    def __init__(self, arduino_connection):
-        self.arduino = arduino_connection
-        self.running = False
-        
-    def parse_and_execute(self, python_code):
-        """Parse Python code and convert to Arduino commands"""
-        lines = python_code.strip().split('\n')
-        commands = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#') or line.startswith('import'):
-                continue
-                
-            # Parse filo commands
-            cmd = self.parse_command(line)
-            if cmd:
-                commands.append(cmd)
-        
-        return commands
-    
-    def parse_command(self, line):
-        """Convert Python filo command to Arduino serial command"""
-        
-        # Takeoff
-        if 'filo.takeoff()' in line:
-            return {'type': 'takeoff', 'delay': 3.0}
-        
-        # Land
-        elif 'filo.land()' in line:
-            return {'type': 'land', 'delay': 3.0}
-        
-        # Stop
-        elif 'filo.stop()' in line:
-            return {'type': 'hover', 'delay': 1.0}
-        
-        # Emergency
-        elif 'filo.emergency()' in line:
-            return {'type': 'emergency', 'delay': 0.0}
-        
-        # Move commands with distance
-        elif match := re.search(r'filo\.move_up\((\d+)\)', line):
-            dist = int(match.group(1))
-            duration = dist / 50.0  # Assume ~50cm/s speed
-            return {'type': 'move', 'pitch': 0, 'roll': 0, 'throttle': 1500, 'yaw': 0, 'duration': duration}
-        
-        elif match := re.search(r'filo\.move_down\((\d+)\)', line):
-            dist = int(match.group(1))
-            duration = dist / 50.0
-            return {'type': 'move', 'pitch': 0, 'roll': 0, 'throttle': 1300, 'yaw': 0, 'duration': duration}
-        
-        elif match := re.search(r'filo\.move_forward\((\d+)\)', line):
-            dist = int(match.group(1))
-            duration = dist / 50.0
-            return {'type': 'move', 'pitch': 15, 'roll': 0, 'throttle': 1400, 'yaw': 0, 'duration': duration}
-        
-        elif match := re.search(r'filo\.move_back\((\d+)\)', line):
-            dist = int(match.group(1))
-            duration = dist / 50.0
-            return {'type': 'move', 'pitch': -15, 'roll': 0, 'throttle': 1400, 'yaw': 0, 'duration': duration}
-        
-        elif match := re.search(r'filo\.move_left\((\d+)\)', line):
-            dist = int(match.group(1))
-            duration = dist / 50.0
-            return {'type': 'move', 'pitch': 0, 'roll': -15, 'throttle': 1400, 'yaw': 0, 'duration': duration}
-        
-        elif match := re.search(r'filo\.move_right\((\d+)\)', line):
-            dist = int(match.group(1))
-            duration = dist / 50.0
-            return {'type': 'move', 'pitch': 0, 'roll': 15, 'throttle': 1400, 'yaw': 0, 'duration': duration}
-        
-        # Rotate
-        elif match := re.search(r'filo\.rotate_clockwise\((\d+)\)', line):
-            angle = int(match.group(1))
-            duration = angle / 90.0  # Assume 90deg/s rotation
-            return {'type': 'move', 'pitch': 0, 'roll': 0, 'throttle': 1400, 'yaw': 20, 'duration': duration}
-        
-        elif match := re.search(r'filo\.rotate_counter_clockwise\((\d+)\)', line):
-            angle = int(match.group(1))
-            duration = angle / 90.0
-            return {'type': 'move', 'pitch': 0, 'roll': 0, 'throttle': 1400, 'yaw': -20, 'duration': duration}
-        
-        # Wait/Sleep
-        elif match := re.search(r'time\.sleep\((\d+(?:\.\d+)?)\)', line):
-            delay = float(match.group(1))
-            return {'type': 'wait', 'duration': delay}
-        
-        # LED commands (placeholder - you'd need to implement on Arduino)
-        elif 'filo.led_' in line:
-            return {'type': 'led', 'command': line, 'delay': 0.1}
-        
-        return None
-    
-    def execute_commands(self, commands):
-        """Execute command sequence on Arduino"""
-        self.running = True
-        
-        for i, cmd in enumerate(commands):
-            if not self.running:
-                print("[X] Command execution stopped")
-                break
-            
-            print(f"[CMD] Executing command {i+1}/{len(commands)}: {cmd['type']}")
-            
-            if cmd['type'] == 'takeoff':
-                # Arm motors first
-                if not armed:
-                    self.arduino.write(b"ARM\n")
-                    time.sleep(2)
-                
-                # Gradual throttle increase for takeoff
-                for throttle in range(1000, 1500, 50):
-                    command = f"CMD,0.00,0.00,{throttle:.0f},0.00\n"
-                    self.arduino.write(command.encode("utf-8"))
-                    time.sleep(0.1)
-                
-                time.sleep(cmd['delay'])
-            
-            elif cmd['type'] == 'land':
-                # Gradual throttle decrease for landing
-                for throttle in range(1400, 1000, -50):
-                    command = f"CMD,0.00,0.00,{throttle:.0f},0.00\n"
-                    self.arduino.write(command.encode("utf-8"))
-                    time.sleep(0.1)
-                
-                # Disarm
-                self.arduino.write(b"DISARM\n")
-                time.sleep(cmd['delay'])
-            
-            elif cmd['type'] == 'move':
-                # Send movement command
-                command = f"CMD,{cmd['roll']:.2f},{cmd['pitch']:.2f},{cmd['throttle']:.0f},{cmd['yaw']:.2f}\n"
-                
-                # Send command repeatedly during duration
-                steps = int(cmd['duration'] * 20)  # 20Hz update rate
-                for _ in range(max(1, steps)):
-                    self.arduino.write(command.encode("utf-8"))
-                    time.sleep(0.05)
-                
-                # Return to hover
-                hover_cmd = f"CMD,0.00,0.00,{cmd['throttle']:.0f},0.00\n"
-                self.arduino.write(hover_cmd.encode("utf-8"))
-            
-            elif cmd['type'] == 'hover':
-                command = f"CMD,0.00,0.00,1400,0.00\n"
-                self.arduino.write(command.encode("utf-8"))
-                time.sleep(cmd['delay'])
-            
-            elif cmd['type'] == 'emergency':
-                self.arduino.write(b"DISARM\n")
-                self.running = False
-                break
-            
-            elif cmd['type'] == 'wait':
-                time.sleep(cmd['duration'])
-            
-            elif cmd['type'] == 'led':
-                # LED commands would go here
-                print(f"[LED] LED: {cmd['command']}")
-                time.sleep(cmd['delay'])
-        
-        self.running = False
-        print("[OK] Command sequence completed")
-
-executor = DroneCommandExecutor(arduino) if arduino else None
+def drone_route(rule, **options):
+    """Register a view on /drones/<drone_id><rule>, and on <rule> for the default drone
+
+    The view is called with the Drone as its first argument.
+    """
+    def decorator(view):
+        @wraps(view)
+        def dispatch(drone_id=None, **kwargs):
+            drone = fleet.get(drone_id)
+            if drone is None:
+                return jsonify({"status": "error", "message": f"Unknown drone: {drone_id}"}), 404
+            return view(drone, **kwargs)
+
+        app.add_url_rule(rule, view.__name__, dispatch, **options)
+        app.add_url_rule('/drones/<drone_id>' + rule.rstrip('/'), view.__name__, dispatch, **options)
+        return dispatch
+    return decorator
+
+def drone_base(drone):
+    """URL prefix the pages use for this drone's API"""
+    return f"/drones/{drone.id}"
 
 # -------------------------
 # NEW: Blockly program execution endpoint
 # -------------------------
-@app.route('/run', methods=['POST'])
-def run_program():
-    global autonomous_mode
-    
-    if not arduino:
-        return jsonify({
-            "status": "error",
-            "message": "Arduino not connected"
-        }), 500
-    
+@drone_route('/run', methods=['POST'])
+def run_program(drone):
     try:
         data = request.get_json()
         python_code = data.get('code', '')
-        
+        dry_run = bool(data.get('dry_run', False))
+        mode = data.get('mode', CONTROL_MODE)
+
+        if mode not in CONTROL_MODES:
+            return jsonify({
+                "status": "error",
+                "message": f"Unknown mode: {mode}"
+            }), 400
+
+        if not drone.link and not dry_run:
+            return jsonify({
+                "status": "error",
+                "message": "Arduino not connected"
+            }), 500
+
         if not python_code:
             return jsonify({
                 "status": "error",
                 "message": "No code provided"
             }), 400
-        
+
         print("\n" + "="*50)
-        print("[AUTO] AUTONOMOUS FLIGHT PROGRAM RECEIVED")
+        print(f"[AUTO] AUTONOMOUS FLIGHT PROGRAM RECEIVED ({drone.id})")
         print("="*50)
         print(python_code)
         print("="*50 + "\n")
-        
-        # Parse commands
-        commands = executor.parse_and_execute(python_code)
-        
+
+        # Compile (or reuse) the flight plan
+        try:
+            plan_id, commands, cached = plan_cache.get(python_code)
+        except CompileError as e:
+            print(f"[ERROR] Compile error: {e}")
+            return jsonify({
+                "status": "error",
+                "message": str(e),
+                "line": e.line
+            }), 400
+
         if not commands:
             return jsonify({
                 "status": "error",
-                "message": "No valid commands found in program"
+                "message": "No valid commands found in program",
+                "warnings": list(commands.warnings)
             }), 400
-        
-        print(f"[INFO] Parsed {len(commands)} commands")
-        
-        # Execute in background thread
-        autonomous_mode = True
-        thread = threading.Thread(
-            target=executor.execute_commands,
-            args=(commands,),
-            daemon=True
-        )
-        thread.start()
-        
+
+        print(f"[INFO] {'Cached' if cached else 'Compiled'} plan {plan_id[:12]}: {len(commands)} steps")
+        for warning in commands.warnings:
+            print(f"[WARN] {warning}")
+
+        # Dry run: fly the plan on the simulator, faster than real time
+        if dry_run:
+            return jsonify({
+                "status": "success",
+                "message": f"Simulated {len(commands)} commands",
+                "commands": len(commands),
+                "plan_id": plan_id[:12],
+                "cached": cached,
+                "warnings": list(commands.warnings),
+                "simulation": simulate_plan(commands, CONTROL_RATE_HZ)
+            })
+
+        # Queue it; the drone's job worker flies one program at a time
+        events_since = drone.events.program_seq
+        try:
+            job = drone.jobs.submit(commands, mode, plan_id[:12], preempt=bool(data.get('preempt', False)))
+        except QueueFull as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 429
+
         return jsonify({
             "status": "success",
-            "message": f"Executing {len(commands)} commands",
-            "commands": len(commands)
+            "message": f"Job {job.id}: {len(commands)} commands submitted",
+            "commands": len(commands),
+            "plan_id": plan_id[:12],
+            "cached": cached,
+            "warnings": list(commands.warnings),
+            "mode": mode,
+            "job": job.to_dict(),
+            "events_since": events_since
         })
-        
+
     except Exception as e:
         print(f"[ERROR] Error executing program: {e}")
         return jsonify({
@@ -332,19 +263,41 @@ def run_program():
             "message": str(e)
         }), 500
 
-@app.route('/stop_program', methods=['POST'])
-def stop_program():
+@drone_route('/jobs', methods=['GET'])
+def list_jobs(drone):
+    """Active, queued and recently finished programs"""
+    return jsonify(drone.jobs.snapshot())
+
+@drone_route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(drone, job_id):
+    job = drone.jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@drone_route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(drone, job_id):
+    """Drop a queued job, or stop the running one within one control tick"""
+    job = drone.jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify({"status": "success", "job": job.to_dict()})
+
+@drone_route('/jobs/<int:job_id>/preempt', methods=['POST'])
+def preempt_job(drone, job_id):
+    """Run a queued job next, stopping the active one"""
+    job = drone.jobs.preempt(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    if job.status != "queued":
+        return jsonify({"status": "error", "message": f"Job {job_id} is {job.status}"}), 409
+    return jsonify({"status": "success", "job": job.to_dict()})
+
+@drone_route('/stop_program', methods=['POST'])
+def stop_program(drone):
     """Emergency stop for autonomous flight"""
-    global autonomous_mode
-    
-    if executor:
-        executor.running = False
-    
-    autonomous_mode = False
-    
-    if arduino:
-        arduino.write(b"DISARM\n")
-    
+    drone.stop_program()
+
     return jsonify({
         "status": "success",
         "message": "Program stopped"
@@ -353,255 +306,362 @@ def stop_program():
 # -------------------------
 # Flask routes
 # -------------------------
-@app.route('/')
-def index():
-    return render_template('index.html')
+@drone_route('/')
+def index(drone):
+    return render_template('index.html', drone_base=drone_base(drone))
 
-@app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(),
+@drone_route('/video_feed')
+def video_feed(drone):
+    return Response(drone.video.frames(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
-@app.route('/filo')
-def filo():
-    return render_template('filo.html')
+@drone_route('/filo')
+def filo(drone):
+    trace = LATENCY_TRACE or request.args.get('trace') == '1'
+    return render_template('filo.html', drone_base=drone_base(drone), latency_trace=trace)
+
+@app.route('/drones', methods=['GET'])
+def list_drones():
+    return jsonify(fleet.summary())
+
+@app.route('/drones/disarm', methods=['POST'])
+def disarm_fleet():
+    """Stop all programs and disarm every drone"""
+    return jsonify({"status": "ok", "drones": fleet.disarm_all()})
 
 # -------------------------
-# Joystick state cache
+# Manual control
 # -------------------------
-joystick_state = {
-    "roll": 0.0,
-    "pitch": 0.0,
-    "yaw": 0.0,
-    "throttle": -1.0
-}
+TELEMETRY_PUSH_INTERVAL = 0.1  # seconds between WebSocket telemetry pushes
 
-last_command_time = time.time()
+def telemetry_message(snapshot):
+    """Control-channel telemetry push for one snapshot"""
+    return '{"t": "telem", "telemetry": ' + snapshot.json.decode("utf-8") + '}'
 
-@app.route('/joystick', methods=['POST'])
-def joystick():
-    global joystick_state, armed, last_command_time, autonomous_mode
-    
-    # Don't accept manual control during autonomous flight
-    if autonomous_mode:
-        return jsonify({
-            "status": "error",
-            "message": "Autonomous mode active"
-        }), 403
-    
-    try:
-        if not armed:
-            return jsonify({"status": "error", "message": "Motors are disarmed"}), 403
+@drone_route('/joystick', methods=['POST'])
+def joystick(drone):
+    error = drone.manual_control_error()
+    if error:
+        return jsonify({"status": "error", "message": error}), 403
 
+    try:
+        received = time.perf_counter()
         data = request.get_json(force=True)
-        last_command_time = time.time()
+        trace = drone.begin_trace(data, "http", received)
+        sent = drone.apply_joystick_input(data, trace)
 
-        for key in data:
-            if key in joystick_state:
-                joystick_state[key] = float(data[key])
+        return Response(drone.joystick_reply(sent, trace), mimetype='application/json')
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        roll = joystick_state["roll"] * 45
-        pitch = joystick_state["pitch"] * 45
-        yaw = joystick_state["yaw"] * 45
-        # Map joystick throttle (-1.0 to +1.0) to PWM (1000 to 2000)
-        # When joystick released: throttle = -1.0 → PWM = 1000 (minimum)
-        # When joystick pushed up: throttle = +1.0 → PWM = 2000 (maximum)
-        throttle_input = joystick_state["throttle"]
-        throttle = 1000 + ((throttle_input + 1) * 500)
+def control_socket(ws, drone_id=None):
+    """Persistent control channel: stick input in, telemetry pushed out"""
+    drone = fleet.get(drone_id)
+    if drone is None:
+        ws.close()
+        return
+    session = ControlSession()
+    last_push = 0.0
+    drone.control_connected()
 
-        if arduino:
-            command = f"CMD,{roll:.2f},{pitch:.2f},{throttle:.0f},{yaw:.2f}\n"
-            arduino.write(command.encode("utf-8"))
+    try:
+        while True:
+            message = ws.receive(timeout=TELEMETRY_PUSH_INTERVAL)
 
-        return jsonify({
-            "status": "ok",
-            "sent": {
-                "roll": roll,
-                "pitch": pitch,
-                "yaw": yaw,
-                "throttle": throttle
-            },
-            "telemetry": telemetry
-        })
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+            if message is not None:
+                reply = drone.control_message(session, message)
+                if reply:
+                    ws.send(json.dumps(reply))
 
-@app.route('/arm', methods=['POST'])
-def arm():
-    global armed, arm_response, autonomous_mode
-    
-    if autonomous_mode:
-        return jsonify({
-            "status": "error",
-            "message": "Cannot arm during autonomous flight"
-        }), 403
-    
-    if joystick_state["throttle"] > -0.9:
-        return jsonify({
-            "status": "error",
-            "message": "⚠️ Throttle must be at MINIMUM before arming!"
-        }), 400
-    
-    if arduino:
-        with arm_response_lock:
-            arm_response = None
-        
-        arduino.write(b"ARM\n")
-        start_time = time.time()
-        
-        while (time.time() - start_time) < 3.0:
-            with arm_response_lock:
-                if arm_response == "success":
-                    armed = True
-                    telemetry["armed"] = True
-                    return jsonify({
-                        "status": "ok",
-                        "message": "🟢 Motors ARMED - BE CAREFUL!"
-                    })
-                elif arm_response == "failed":
-                    return jsonify({
-                        "status": "error",
-                        "message": "❌ Pre-arm checks FAILED!"
-                    }), 400
-            time.sleep(0.5)
-        
-        return jsonify({
-            "status": "error",
-            "message": "⚠️ No response from flight controller"
-        }), 500
-    else:
-        return jsonify({
-            "status": "error",
-            "message": "❌ Arduino not connected"
-        }), 500
+            now = time.time()
+            if now - last_push >= TELEMETRY_PUSH_INTERVAL:
+                ws.send(telemetry_message(drone.telemetry.current))
+                last_push = now
+    finally:
+        drone.control_disconnected()
 
-@app.route('/disarm', methods=['POST'])
-def disarm():
-    global armed, autonomous_mode
-    armed = False
-    autonomous_mode = False
-    telemetry["armed"] = False
-    
-    if arduino:
-        arduino.write(b"DISARM\n")
-    
-    return jsonify({
-        "status": "ok",
-        "message": "🔴 Motors DISARMED"
-    })
+if sock:
+    sock.route('/ws', endpoint='control_socket')(control_socket)
+    sock.route('/drones/<drone_id>/ws', endpoint='drone_control_socket')(control_socket)
+
+# -------------------------
+# Arm / disarm
+# -------------------------
+@drone_route('/arm', methods=['POST'])
+def arm(drone):
+    refused = drone.arm_precheck()
+    if refused:
+        return jsonify(refused[0]), refused[1]
+
+    try:
+        result = drone.start_arm().result(timeout=ARM_TIMEOUT)
+    except FutureTimeout:
+        result = None
+    payload, status = drone.finish_arm(result)
+    return jsonify(payload), status
+
+@drone_route('/disarm', methods=['POST'])
+def disarm(drone):
+    return jsonify(drone.disarm_now())
+
+# -------------------------
+# Telemetry and status
+# -------------------------
+@drone_route('/events', methods=['GET'])
+def event_stream(drone):
+    """Server-Sent Events: telemetry on change, program-state transitions
+
+    Optional ?max_hz=N caps the telemetry frame rate for this client and
+    ?since=ID replays program events after that id.
+    """
+    max_hz = request.args.get('max_hz', type=float)
+    if max_hz is not None and max_hz <= 0:
+        max_hz = None
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    return Response(drone.events.stream(max_hz, drone.telemetry.current, since),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@drone_route('/telemetry', methods=['GET'])
+def get_telemetry(drone):
+    """Current snapshot; If-None-Match with its ETag gets 304 until it changes"""
+    snapshot = drone.telemetry.current
+    headers = {'ETag': snapshot.etag, 'Cache-Control': 'no-cache'}
+    if snapshot.etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    return Response(snapshot.json, mimetype='application/json', headers=headers)
+
+@drone_route('/status', methods=['GET'])
+def get_status(drone):
+    return jsonify(drone.status_payload())
 
-@app.route('/telemetry', methods=['GET'])
-def get_telemetry():
-    return jsonify(telemetry)
+# -------------------------
+# Latency tracing
+# -------------------------
+# Pages opened with ?trace=1 (or every page, with FILO_LATENCY_TRACE=1) tag
+# their stick inputs for tracing; see tracing.py for the stages.
+LATENCY_TRACE = os.environ.get("FILO_LATENCY_TRACE") == "1"
+
+@drone_route('/trace', methods=['GET'])
+def get_trace(drone):
+    """Per-stage stick-to-motor latency percentiles"""
+    return jsonify(drone.tracer.stats())
+
+@drone_route('/trace/export', methods=['GET'])
+def export_trace(drone):
+    """Recent traced inputs, as JSON or ?format=csv"""
+    traces = drone.tracer.export()
+    if request.args.get('format') == 'csv':
+        columns = ["client", "id", "transport", "parse_ms", "handle_ms", "writer_queue_ms",
+                   "fc_ack_ms", "round_trip_ms"]
+        lines = [",".join(columns)]
+        lines += [",".join("" if t[c] is None else str(t[c]) for c in columns) for t in traces]
+        return Response("\n".join(lines) + "\n", mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename="trace-{drone.id}.csv"'})
+    return jsonify({"drone": drone.id, "stats": drone.tracer.stats(), "traces": traces})
 
-@app.route('/status', methods=['GET'])
-def get_status():
-    if arduino:
-        arduino.write(b"STATUS\n")
+# -------------------------
+# Flight logs
+# -------------------------
+SESSION_ID_RE = re.compile(r"^[\w\-]+$")
+
+@drone_route('/logs', methods=['GET'])
+def list_logs(drone):
+    """All recorded sessions; `current` is this drone's"""
+    if not analytics:
+        return jsonify({"status": "error", "message": "Analytics unavailable (numpy not installed)"}), 501
     return jsonify({
-        "armed": armed,
-        "autonomous": autonomous_mode,
-        "telemetry": telemetry,
-        "connection": "connected" if arduino else "disconnected"
+        "current": drone.recorder.session if drone.recorder else None,
+        "sessions": analytics.list_sessions(LOG_DIR)
     })
 
+@drone_route('/logs/<session_id>/summary', methods=['GET'])
+def log_summary(drone, session_id):
+    """Battery sag, attitude spectra and connection-state time for one session"""
+    if not analytics:
+        return jsonify({"status": "error", "message": "Analytics unavailable (numpy not installed)"}), 501
+    directory = os.path.join(LOG_DIR, session_id)
+    if not SESSION_ID_RE.match(session_id) or not os.path.isdir(directory):
+        return jsonify({"status": "error", "message": "Unknown session"}), 404
+    try:
+        summary = analytics.session_summary(directory)
+    except (OSError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify(dict(summary, id=session_id))
+
 # -------------------------
-# Background thread to read serial data
+# Metrics and profiling
 # -------------------------
-def read_from_arduino():
-    global telemetry, armed, arm_response
-    if not arduino:
-        return
-    
-    buffer = ""
-    
-    while True:
-        try:
-            if arduino.in_waiting:
-                raw_data = arduino.read(arduino.in_waiting)
-                decoded = raw_data.decode("utf-8", errors="ignore")
-                buffer += decoded
-                
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    line = line.strip()
-                    
-                    if not line:
-                        continue
-                    
-                    if line.startswith("TELEM,"):
-                        try:
-                            parts = line.split(',')
-                            if len(parts) >= 8:
-                                roll_str = parts[1].strip()
-                                pitch_str = parts[2].strip()
-                                yaw_str = parts[3].strip()
-                                volt_str = parts[5].strip()
-                                bat_str = parts[6].strip()
-                                
-                                if all(c in '0123456789.-' for c in roll_str):
-                                    telemetry["roll"] = float(roll_str)
-                                if all(c in '0123456789.-' for c in pitch_str):
-                                    telemetry["pitch"] = float(pitch_str)
-                                if all(c in '0123456789.-' for c in yaw_str):
-                                    telemetry["yaw_rate"] = float(yaw_str)
-                                if all(c in '0123456789.-' for c in volt_str):
-                                    telemetry["battery_voltage"] = float(volt_str)
-                                if all(c in '0123456789' for c in bat_str):
-                                    telemetry["battery_percent"] = int(float(bat_str))
-                                
-                                telemetry["armed"] = parts[7].strip() == "1"
-                                telemetry["connection"] = "connected"
-                        except (ValueError, IndexError) as e:
-                            print(f"[WARN] Telemetry parse error: {e}")
-                            
-                    elif line.startswith("ACK,"):
-                        telemetry["connection"] = "connected"
-                    
-                    elif "Motors ARMED" in line:
-                        print(f"[OK] {line}")
-                        with arm_response_lock:
-                            arm_response = "success"
-                    
-                    elif "Pre-arm checks FAILED" in line or ("❌" in line and "arm" in line.lower()):
-                        print(f"[ERROR] {line}")
-                        with arm_response_lock:
-                            arm_response = "failed"
-                    
-                    elif line.startswith("🚨") or line.startswith("EMERGENCY"):
-                        print(f"[WARN] {line}")
-                        armed = False
-                        autonomous_mode = False
-                        telemetry["armed"] = False
-                    
-                    else:
-                        if len(line) > 0 and not line.startswith('\x00'):
-                            print(f"[DATA] {line}")
-                        
-        except Exception as e:
-            print(f"[WARN] Serial read error: {e}")
-            telemetry["connection"] = "error"
-            buffer = ""
-            time.sleep(1)
-            
-        time.sleep(0.02)
+# Latency histograms for the hot routes, keyed by the bare route so the
+# default-drone and /drones/<id> forms land in one series. asgi_app.py
+# times its native versions of these routes into the same histogram.
+ROUTE_LATENCY = Histogram("filo_http_request_seconds", "Request latency of the control routes",
+                          labels=("route",))
+TIMED_ENDPOINTS = {
+    "joystick": "/joystick",
+    "run_program": "/run",
+    "arm": "/arm",
+    "get_telemetry": "/telemetry"
+}
 
-if arduino:
-    thread = threading.Thread(target=read_from_arduino, daemon=True)
-    thread.start()
+# The profiler is opt-in: FILO_PROFILER=1 enables /debug/profile
+PROFILER_ENABLED = os.environ.get("FILO_PROFILER") == "1"
+PROFILE_MAX_SECONDS = 60
+
+metric_rates = RateTracker()
+profiler = SamplingProfiler()
+
+@app.before_request
+def start_timer():
+    if request.endpoint in TIMED_ENDPOINTS:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        ROUTE_LATENCY.observe(time.perf_counter() - started, TIMED_ENDPOINTS[request.endpoint])
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition"""
+    metrics = MetricsText()
+    collect_fleet(metrics, fleet, metric_rates)
+    collect_process(metrics)
+    metrics.gauge("filo_plan_cache_size", "Compiled flight plans cached", plan_cache.stats()["size"])
+    out = []
+    ROUTE_LATENCY.render(out)
+    PROGRAM_STEP_SECONDS.render(out)
+    metrics.render(out)
+    return Response("\n".join(out) + "\n", mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile', methods=['GET'])
+def get_profile():
+    """Sample every thread for ?seconds=N and return collapsed stacks for a flamegraph"""
+    if not PROFILER_ENABLED:
+        return jsonify({"status": "error", "message": "Profiler disabled (set FILO_PROFILER=1)"}), 404
+    seconds = request.args.get('seconds', 10, type=float)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"status": "error", "message": f"seconds must be in (0, {PROFILE_MAX_SECONDS}]"}), 400
+    profile = profiler.profile(seconds)
+    if profile is None:
+        return jsonify({"status": "error", "message": "A profile is already running"}), 409
+    return Response(profile, mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename="filo-{int(time.time())}.folded"'})
 
 # -------------------------
-# Connection watchdog
+# Flight video
+# -------------------------
+SEGMENT_NAME_RE = re.compile(r"^\d{4}\.(h264|mjpeg)$")
+
+@drone_route('/recording/start', methods=['POST'])
+def start_recording(drone):
+    """Start recording now (recordings also start on arm and stop on disarm)"""
+    if not drone.video_recorder:
+        return jsonify({"status": "error", "message": "No camera on this drone"}), 409
+    if not drone.start_video_recording():
+        return jsonify({"status": "error", "message": "Already recording"}), 409
+    return jsonify({"status": "ok"})
+
+@drone_route('/recording/stop', methods=['POST'])
+def stop_recording(drone):
+    return jsonify({"status": "ok", "recording": drone.stop_video_recording()})
+
+@app.route('/recordings', methods=['GET'])
+def list_recordings():
+    return jsonify({"recordings": video_record.list_recordings(VIDEO_DIR)})
+
+def load_recording(session_id):
+    """(directory, meta, index records) of a recording, or an error response"""
+    directory = os.path.join(VIDEO_DIR, session_id)
+    if not SESSION_ID_RE.match(session_id) or not os.path.isdir(directory):
+        return None, (jsonify({"status": "error", "message": "Unknown recording"}), 404)
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        return (directory, meta, video_record.read_index(directory)), None
+    except (OSError, ValueError) as e:
+        return None, (jsonify({"status": "error", "message": str(e)}), 500)
+
+@app.route('/recordings/<session_id>/seek', methods=['GET'])
+def seek_recording(session_id):
+    """First frame where ?field= is ?above= / ?below= a value (optionally ?after= a time)"""
+    recording, error = load_recording(session_id)
+    if error:
+        return error
+    directory, meta, records = recording
+    field = request.args.get('field', 'roll')
+    above = request.args.get('above', type=float)
+    below = request.args.get('below', type=float)
+    if field not in video_record.SEEK_FIELDS or (above is None and below is None):
+        return jsonify({"status": "error",
+                        "message": f"Need field in {video_record.SEEK_FIELDS} and above= or below="}), 400
+    i = video_record.seek(records, field, above, below, request.args.get('after', type=float))
+    if i is None:
+        return jsonify({"status": "error", "message": "No matching frame"}), 404
+    return jsonify(dict(video_record.frame_info(directory, records, i), codec=meta["codec"]))
+
+@app.route('/recordings/<session_id>/frame', methods=['GET'])
+def recording_frame(session_id):
+    """The frame at ?t= (unix time) of an MJPEG recording, as a JPEG"""
+    recording, error = load_recording(session_id)
+    if error:
+        return error
+    directory, meta, records = recording
+    t = request.args.get('t', type=float)
+    if t is None or not records:
+        return jsonify({"status": "error", "message": "Need t= and a non-empty recording"}), 400
+    if meta["codec"] != "mjpeg":
+        return jsonify({"status": "error", "message": "H.264 recordings need a decoder; use /seek and the segment"}), 409
+    try:
+        jpeg = video_record.read_frame(directory, meta["codec"], records[video_record.frame_at(records, t)])
+    except OSError:
+        return jsonify({"status": "error", "message": "Segment no longer on disk"}), 410
+    return Response(jpeg, mimetype='image/jpeg')
+
+@app.route('/recordings/<session_id>/segments/<name>', methods=['GET'])
+def recording_segment(session_id, name):
+    path = os.path.join(VIDEO_DIR, session_id, name)
+    if not SESSION_ID_RE.match(session_id) or not SEGMENT_NAME_RE.match(name) or not os.path.isfile(path):
+        return jsonify({"status": "error", "message": "Unknown segment"}), 404
+    mimetype = 'video/h264' if name.endswith('.h264') else 'video/x-motion-jpeg'
+    return send_file(path, mimetype=mimetype, conditional=True)
+
 # -------------------------
-def connection_watchdog():
-    global last_command_time, armed, telemetry, autonomous_mode
-    while True:
-        time.sleep(0.5)
-        if armed and not autonomous_mode and (time.time() - last_command_time > 2):
-            telemetry["connection"] = "warning"
-
-watchdog_thread = threading.Thread(target=connection_watchdog, daemon=True)
-watchdog_thread.start()
+# Calibration
+# -------------------------
+@drone_route('/calibration', methods=['GET'])
+def get_calibration(drone):
+    return jsonify({
+        "mode": CONTROL_MODE,
+        "airframe": drone.airframe,
+        "profile": drone.tracker.profile.to_dict(),
+        "last_step": drone.executor.controller.last_result
+    })
+
+@drone_route('/calibration/tune', methods=['POST'])
+def tune_calibration(drone):
+    """Fit the airframe profile from a recorded session (default: this drone's)"""
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session') or (drone.recorder.session if drone.recorder else None)
+    if not session_id or not SESSION_ID_RE.match(session_id) \
+            or not os.path.isdir(os.path.join(LOG_DIR, session_id)):
+        return jsonify({"status": "error", "message": "Unknown session"}), 404
+
+    try:
+        profile, report = tune_profile(os.path.join(LOG_DIR, session_id), drone.tracker.profile)
+        profile.save(PROFILE_DIR)
+    except (OSError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    # Every drone of this airframe shares the profile
+    for other in fleet:
+        if other.airframe == drone.airframe:
+            other.tracker.profile = profile
+    print(f"[OK] Calibration profile '{drone.airframe}' tuned from {session_id}: {report}")
+    return jsonify({"status": "ok", "profile": profile.to_dict(), "fit": report})
 
 # -------------------------
 # Run Flask app
@@ -0,0 +1,233 @@
+"""Asyncio (ASGI) serving mode for the drone control server
+
+Streams (/video_feed, /events, /ws) and the /arm handshake run as coroutines,
+so open viewers never hold a worker thread and joystick input is not queued
+behind them. Every other route is served by the Flask app from app.py
+through a WSGI bridge; both share the same fleet. As in app.py, each route
+exists as /drones/<id>/... and, for the default drone, without the prefix.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+    python asgi_app.py
+"""
+import json, time, asyncio
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as server
+
+flask_app = WsgiToAsgi(server.app)
+
+# -------------------------
+# ASGI helpers
+# -------------------------
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def send_json(send, payload, status=200, headers=()):
+    """Send a JSON response; `payload` may already be encoded bytes"""
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()), *headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def send_stream(receive, send, chunks, content_type, headers=()):
+    """Send an async generator as a streaming body until the client leaves"""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", content_type), (b"cache-control", b"no-cache"), *headers]
+    })
+
+    async def pump():
+        async for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(watch_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await chunks.aclose()
+
+def query_param(scope, name, cast):
+    values = parse_qs(scope.get("query_string", b"").decode()).get(name)
+    try:
+        return cast(values[0]) if values else None
+    except ValueError:
+        return None
+
+def header(scope, name):
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+# -------------------------
+# Native async routes
+# -------------------------
+def resolve(path):
+    """(drone or None, route path) for /drones/<id>/... or a bare path"""
+    if path.startswith("/drones/"):
+        drone_id, _, rest = path[len("/drones/"):].partition("/")
+        return server.fleet.get(drone_id), "/" + rest
+    return server.fleet.default, path
+
+async def video_feed(drone, scope, receive, send):
+    await send_stream(receive, send, drone.video.async_frames(),
+                      b"multipart/x-mixed-replace; boundary=frame")
+
+async def event_stream(drone, scope, receive, send):
+    max_hz = query_param(scope, "max_hz", float)
+    if max_hz is not None and max_hz <= 0:
+        max_hz = None
+    since = header(scope, b"last-event-id")
+    since = int(since) if since and since.isdigit() else query_param(scope, "since", int)
+    await send_stream(receive, send, drone.events.async_stream(max_hz, drone.telemetry.current, since),
+                      b"text/event-stream", [(b"x-accel-buffering", b"no")])
+
+async def arm(drone, scope, receive, send):
+    refused = drone.arm_precheck()
+    if refused:
+        await send_json(send, *refused)
+        return
+
+    # Resolved by the serial reader thread; no polling
+    future = asyncio.wrap_future(drone.start_arm())
+    try:
+        result = await asyncio.wait_for(future, server.ARM_TIMEOUT)
+    except asyncio.TimeoutError:
+        result = None
+    await send_json(send, *drone.finish_arm(result))
+
+async def joystick(drone, scope, receive, send):
+    error = drone.manual_control_error()
+    body = await read_body(receive)
+    if error:
+        await send_json(send, {"status": "error", "message": error}, 403)
+        return
+
+    try:
+        received = time.perf_counter()
+        data = json.loads(body)
+        trace = drone.begin_trace(data, "http", received)
+        sent = drone.apply_joystick_input(data, trace)
+        await send_json(send, drone.joystick_reply(sent, trace))
+    except Exception as e:
+        await send_json(send, {"status": "error", "message": str(e)}, 500)
+
+async def telemetry(drone, scope, receive, send):
+    snapshot = drone.telemetry.current
+    headers = [(b"etag", snapshot.etag.encode()), (b"cache-control", b"no-cache")]
+    if snapshot.etag in (header(scope, b"if-none-match") or ""):
+        await send({"type": "http.response.start", "status": 304, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await send_json(send, snapshot.json, headers=headers)
+
+async def control_socket(drone, scope, receive, send):
+    """Same protocol as the Flask /ws route (see Drone.control_message)"""
+    if (await receive())["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+    session = server.ControlSession()
+    drone.control_connected()
+
+    async def push_telemetry():
+        while True:
+            await send({"type": "websocket.send",
+                        "text": server.telemetry_message(drone.telemetry.current)})
+            await asyncio.sleep(server.TELEMETRY_PUSH_INTERVAL)
+
+    pusher = asyncio.ensure_future(push_telemetry())
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            text = message.get("text")
+            if text is None and message.get("bytes") is not None:
+                text = message["bytes"].decode("utf-8", errors="ignore")
+            if text is None:
+                continue
+            reply = drone.control_message(session, text)
+            if reply:
+                await send({"type": "websocket.send", "text": json.dumps(reply)})
+    finally:
+        pusher.cancel()
+        await asyncio.gather(pusher, return_exceptions=True)
+        drone.control_disconnected()
+
+ROUTES = {
+    ("GET", "/video_feed"): video_feed,
+    ("GET", "/events"): event_stream,
+    ("GET", "/telemetry"): telemetry,
+    ("POST", "/arm"): arm,
+    ("POST", "/joystick"): joystick,
+}
+
+# Same /metrics latency series as the Flask versions of these routes
+TIMED_ROUTES = set(server.TIMED_ENDPOINTS.values())
+
+async def app(scope, receive, send):
+    if scope["type"] == "websocket":
+        drone, path = resolve(scope["path"])
+        if drone and path == "/ws":
+            await control_socket(drone, scope, receive, send)
+        else:
+            await send({"type": "websocket.close", "code": 1000})
+        return
+
+    if scope["type"] == "http":
+        drone, path = resolve(scope["path"])
+        handler = ROUTES.get((scope["method"], path))
+        if handler:
+            if drone is None:
+                await send_json(send, {"status": "error", "message": "Unknown drone"}, 404)
+            elif path in TIMED_ROUTES:
+                with server.ROUTE_LATENCY.time(path):
+                    await handler(drone, scope, receive, send)
+            else:
+                await handler(drone, scope, receive, send)
+            return
+
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    await flask_app(scope, receive, send)
+
+# -------------------------
+# Run ASGI server
+# -------------------------
+if __name__ == '__main__':
+    import uvicorn
+
+    print("\n" + "="*50)
+    print("DRONE CONTROL SERVER (async)")
+    print("="*50)
+    print("Manual Control: http://<ip>:5000/filo")
+    print("Blockly Programming: http://<ip>:5000")
+    print("="*50 + "\n")
+
+    uvicorn.run(app, host='0.0.0.0', port=5000, log_level="warning")
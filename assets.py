@@ -0,0 +1,165 @@
+"""Static assets: fingerprinted URLs and precompressed variants
+
+Every file under static/ is hashed at startup and gets a URL with its
+content hash in it (/assets/<hash>/<path>), so it can be cached forever;
+a new build changes the URL. Stylesheets have their url(...) references
+rewritten to fingerprinted URLs first, so their hash covers the fonts and
+images they pull in.
+
+Compressible files get gzip (and brotli, if installed) variants, built on
+a background thread so startup doesn't wait on them; until a file's
+variants are ready it is served uncompressed. Everything is kept in memory
+except large files that don't compress, which are sent from disk.
+"""
+import os, re, gzip, hashlib, mimetypes, threading
+
+try:
+    import brotli
+except ImportError as e:
+    print("[WARN] brotli not available, static assets are gzip only:", e)
+    brotli = None
+
+mimetypes.add_type("font/woff2", ".woff2")
+mimetypes.add_type("font/ttf", ".ttf")
+mimetypes.add_type("image/x-icon", ".cur")
+mimetypes.add_type("image/svg+xml", ".svg")
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml",
+                      "image/x-icon", "font/ttf", "audio/wav", "audio/x-wav")
+MIN_COMPRESS_SIZE = 512          # below this the headers cost more than we save
+MIN_COMPRESS_SAVING = 0.1        # keep a variant only if it is at least 10% smaller
+MAX_MEMORY_SIZE = 512 * 1024     # larger uncompressed files are sent from disk
+HASH_LENGTH = 12
+
+CSS_URL_RE = re.compile(r"url\((['\"]?)([^)'\"]+)\1\)")
+
+class Asset:
+    """One static file with its fingerprint and encoded variants"""
+
+    def __init__(self, name, path, data):
+        self.name = name
+        self.path = path
+        self.size = len(data)
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if self.mimetype.startswith("text/") or self.mimetype == "application/javascript":
+            self.mimetype += "; charset=utf-8"
+        self.hash = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        self.data = data if self.size <= MAX_MEMORY_SIZE or self.compressible else None
+        self.variants = {}  # encoding -> bytes, filled in by AssetStore.compress
+
+    @property
+    def compressible(self):
+        return self.size >= MIN_COMPRESS_SIZE and self.mimetype.startswith(COMPRESSIBLE_TYPES)
+
+    @property
+    def url(self):
+        return f"/assets/{self.hash}/{self.name}"
+
+    def etag(self, encoding=None):
+        return f'"{self.hash}-{encoding}"' if encoding else f'"{self.hash}"'
+
+    def compress(self):
+        encoded = {"gzip": gzip.compress(self.data, compresslevel=9, mtime=0)}
+        if brotli:
+            encoded["br"] = brotli.compress(self.data, quality=11)
+        self.variants = {encoding: body for encoding, body in encoded.items()
+                         if len(body) <= self.size * (1 - MIN_COMPRESS_SAVING)}
+        if self.size > MAX_MEMORY_SIZE and not self.variants:
+            self.data = None  # doesn't compress after all; send it from disk
+
+    def select(self, accept_encoding):
+        """(encoding, body) for a request's Accept-Encoding; body None means send `path`"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding, self.variants[encoding]
+        return None, self.data
+
+def parse_accept_encoding(header):
+    """{coding: q} from an Accept-Encoding header"""
+    accepted = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+class AssetStore:
+    """Fingerprinted, precompressed copies of a static directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.assets = {}
+        self.compressed = threading.Event()
+
+    def load(self):
+        """Hash every file (stylesheets last, after rewriting), then compress in the background"""
+        stylesheets = []
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                if name.endswith(".css"):
+                    stylesheets.append((name, path))
+                    continue
+                with open(path, "rb") as f:
+                    self.assets[name] = Asset(name, path, f.read())
+        for name, path in stylesheets:
+            with open(path, "rb") as f:
+                self.assets[name] = Asset(name, path, self._rewrite_css(name, f.read()))
+
+        threading.Thread(target=self._compress_all, daemon=True).start()
+        print(f"[OK] {len(self.assets)} static assets fingerprinted")
+        return self
+
+    def _rewrite_css(self, name, data):
+        """Point url(...) references at fingerprinted URLs"""
+        base = os.path.dirname(name)
+
+        def replace(match):
+            target = match.group(2)
+            if target.startswith(("data:", "http:", "https:", "//", "/")):
+                return match.group(0)
+            path, sep, suffix = target.partition("?")
+            if not sep:
+                path, sep, suffix = target.partition("#")
+            asset = self.assets.get(os.path.normpath(os.path.join(base, path)).replace(os.sep, "/"))
+            if asset is None:
+                return match.group(0)
+            return f"url({asset.url}{sep}{suffix})"
+
+        return CSS_URL_RE.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+    def _compress_all(self):
+        saved = 0
+        for asset in list(self.assets.values()):
+            if asset.compressible:
+                asset.compress()
+                if asset.variants:
+                    saved += asset.size - min(len(body) for body in asset.variants.values())
+        self.compressed.set()
+        print(f"[OK] Static assets compressed ({saved // 1024} KiB saved)")
+
+    def get(self, name):
+        return self.assets.get(name)
+
+    def url(self, name):
+        """Fingerprinted URL for a static file, or its plain /static URL if unknown"""
+        asset = self.assets.get(name)
+        return asset.url if asset else "/static/" + name
+
+    def stats(self):
+        return {
+            "files": len(self.assets),
+            "bytes": sum(asset.size for asset in self.assets.values()),
+            "compressed": self.compressed.is_set(),
+            "variants": sum(len(asset.variants) for asset in self.assets.values())
+        }
@@ -0,0 +1,290 @@
+"""Benchmarks for the control server's hot paths
+
+Runs against the simulated flight controller and a synthetic camera, so it
+needs no hardware:
+
+    python bench.py                      # all benchmarks, table output
+    python bench.py --only telem_parse   # one benchmark
+    python bench.py --json results.json  # also write machine-readable results
+
+Each result reports p50/p99 latency, throughput and CPU use over the run.
+"""
+import os, io, sys, json, time, random, platform, argparse, subprocess
+
+os.environ.setdefault("FILO_SERIAL", "sim://?telem_hz=100")
+
+# -------------------------
+# Measurement helpers
+# -------------------------
+def summarize(samples, wall, cpu, **extra):
+    samples = sorted(samples)
+    count = len(samples)
+    result = {
+        "iterations": count,
+        "p50_us": round(samples[count // 2] * 1e6, 2) if count else None,
+        "p99_us": round(samples[min(count - 1, int(count * 0.99))] * 1e6, 2) if count else None,
+        "ops_per_sec": round(count / wall, 1) if wall else None,
+        "cpu_percent": round(cpu / wall * 100, 1) if wall else None
+    }
+    result.update(extra)
+    return result
+
+def measure(fn, iterations, warmup=None):
+    """Time `fn()` per call; returns the summary dict"""
+    for _ in range(warmup if warmup is not None else max(1, iterations // 10)):
+        fn()
+    samples = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return summarize(samples, wall, cpu)
+
+# -------------------------
+# Synthetic inputs
+# -------------------------
+def telem_lines(count, seed=1):
+    rnd = random.Random(seed)
+    return [
+        (f"TELEM,{rnd.uniform(-30, 30):.2f},{rnd.uniform(-30, 30):.2f},{rnd.uniform(-90, 90):.2f},"
+         f"{rnd.uniform(0, 200):.1f},{rnd.uniform(7, 8.4):.2f},{rnd.randint(0, 100)},{rnd.randint(0, 1)}\n").encode()
+        for _ in range(count)
+    ]
+
+def blockly_program(blocks, seed=2):
+    """Large Blockly-style program mixing moves, loops and waits
+
+    Moves are short so even 1000 blocks stay under flight_plan.MAX_PLAN_SECONDS.
+    """
+    rnd = random.Random(seed)
+    moves = ["move_forward", "move_back", "move_left", "move_right", "move_up", "move_down",
+             "rotate_clockwise", "rotate_counter_clockwise"]
+    lines = ["import filo", "import time", "", "filo.takeoff()"]
+    for i in range(blocks):
+        if i % 10 == 0:
+            lines.append("for count in range(2):")
+            lines.append(f"  filo.{rnd.choice(moves)}({rnd.randint(5, 30)})")
+        elif i % 7 == 0:
+            lines.append(f"time.sleep({rnd.randint(1, 20) / 10})")
+        else:
+            lines.append(f"filo.{rnd.choice(moves)}({rnd.randint(5, 30)} + {rnd.randint(0, 10)})")
+    lines.append("filo.land()")
+    return "\n".join(lines) + "\n"
+
+class SyntheticCamera:
+    """Pull source producing varied JPEG-sized frames without a sensor"""
+    push = False
+    max_fps = None
+
+    def __init__(self, size=(320, 240), frames=8):
+        try:
+            from PIL import Image
+            rnd = random.Random(3)
+            self.frames = []
+            for _ in range(frames):
+                img = Image.effect_noise(size, rnd.uniform(20, 80)).convert("RGB")
+                stream = io.BytesIO()
+                img.save(stream, format="JPEG", quality=80)
+                self.frames.append(stream.getvalue())
+        except ImportError:
+            self.frames = [os.urandom(12000) for _ in range(frames)]
+        self.index = 0
+
+    def capture(self, quality):
+        self.index = (self.index + 1) % len(self.frames)
+        return self.frames[self.index]
+
+# -------------------------
+# Benchmarks
+# -------------------------
+def bench_telem_parse(quick):
+    """read_from_arduino path: framing + TELEM parse + telemetry update"""
+    from serial_link import SerialReader
+
+    lines = telem_lines(2000)
+    chunk = b"".join(lines)
+    reader = SerialReader(None, lambda values: None, lambda line: None)
+    rounds = 20 if quick else 200
+
+    def feed():
+        for line in reader.framer.feed(chunk):
+            reader.handle(line)
+
+    result = measure(feed, rounds)
+    # Per-line figures are more useful than per-chunk ones
+    per_line = len(lines)
+    result["lines_per_sec"] = round(result["ops_per_sec"] * per_line, 1)
+    result["p50_us_per_line"] = round(result["p50_us"] / per_line, 3)
+    result["p99_us_per_line"] = round(result["p99_us"] / per_line, 3)
+    result["parse_failures"] = reader.parse_failures
+    return result
+
+def bench_telem_frames(quick):
+    """Same samples as telem_parse as binary TELEM frames (negotiated link)"""
+    from serial_link import SerialReader
+    from binary_protocol import encode_telem
+
+    rnd = random.Random(1)
+    count = 2000
+    chunk = b"".join(
+        encode_telem(i, rnd.uniform(-30, 30), rnd.uniform(-30, 30), rnd.uniform(-90, 90),
+                     rnd.uniform(7, 8.4), rnd.randint(0, 100), rnd.randint(0, 1))
+        for i in range(count)
+    )
+    reader = SerialReader(None, lambda values: None, lambda line: None, negotiate=True)
+    reader.framer.binary = True
+    rounds = 20 if quick else 200
+
+    def feed():
+        for item in reader.framer.feed(chunk):
+            reader.handle_frame(*item)
+
+    result = measure(feed, rounds)
+    result["frames_per_sec"] = round(result["ops_per_sec"] * count, 1)
+    result["p50_us_per_frame"] = round(result["p50_us"] / count, 3)
+    result["p99_us_per_frame"] = round(result["p99_us"] / count, 3)
+    result["bytes_per_frame"] = len(chunk) // count
+    result["crc_errors"] = reader.framer.crc_errors
+    return result
+
+def bench_compile(quick):
+    """Blockly program compile (cache miss) and cached lookup"""
+    from flight_plan import compile_program, PlanCache
+
+    source = blockly_program(200 if quick else 800)
+    cold = measure(lambda: compile_program(source), 10 if quick else 50)
+    cache = PlanCache()
+    cache.get(source)
+    warm = measure(lambda: cache.get(source), 1000 if quick else 10000)
+    cold["steps"] = len(compile_program(source))
+    cold["source_lines"] = source.count("\n")
+    cold["cached_p50_us"] = warm["p50_us"]
+    cold["cached_p99_us"] = warm["p99_us"]
+    return cold
+
+def bench_joystick(quick):
+    """POST /joystick through Flask against the simulated flight controller"""
+    import app as server
+
+    drone = server.fleet.default
+    if not drone.wait_ready(10):
+        raise RuntimeError(f"serial link not ready: {drone.init['last_error']}")
+    drone.armed = True
+    drone.autonomous_mode = False
+    client = server.app.test_client()
+    rnd = random.Random(4)
+    bodies = [json.dumps({"roll": rnd.uniform(-1, 1), "pitch": rnd.uniform(-1, 1),
+                          "yaw": rnd.uniform(-1, 1), "throttle": rnd.uniform(-1, 1)})
+              for _ in range(64)]
+    state = {"i": 0}
+
+    def post():
+        state["i"] += 1
+        response = client.post('/joystick', data=bodies[state["i"] % len(bodies)],
+                               content_type='application/json')
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    result = measure(post, 300 if quick else 3000)
+    drone.armed = False
+    result["serial_coalesced"] = drone.writer.stats()["coalesced"]
+    return result
+
+def bench_mjpeg(quick):
+    """generate_frames path: one synthetic camera, one draining client"""
+    from video_stream import FrameBroadcaster
+
+    video = FrameBroadcaster(SyntheticCamera(), fps=1000, idle_timeout=0.5)
+    duration = 1.0 if quick else 5.0
+    frames = video.frames()
+    next(frames)  # warm up: starts the capture thread
+
+    samples = []
+    sizes = 0
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    while time.perf_counter() - wall_start < duration:
+        t0 = time.perf_counter()
+        part = next(frames)
+        samples.append(time.perf_counter() - t0)
+        sizes += len(part)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    frames.close()
+
+    return summarize(samples, wall, cpu,
+                     fps=round(len(samples) / wall, 1),
+                     bytes_per_frame=round(sizes / max(1, len(samples))))
+
+BENCHMARKS = {
+    "telem_parse": bench_telem_parse,
+    "telem_frames": bench_telem_frames,
+    "compile": bench_compile,
+    "joystick": bench_joystick,
+    "mjpeg": bench_mjpeg,
+}
+
+# -------------------------
+# Runner
+# -------------------------
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the drone control server")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS),
+                        help="run only this benchmark (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.only or list(BENCHMARKS):
+        print(f"[BENCH] {name} ...", flush=True)
+        try:
+            results[name] = BENCHMARKS[name](args.quick)
+        except Exception as e:
+            print(f"[ERROR] {name} failed: {e}")
+            results[name] = {"error": str(e)}
+
+    report = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "quick": args.quick,
+        "results": results
+    }
+
+    print("\n" + "=" * 78)
+    print(f"{'benchmark':<14}{'p50 us':>12}{'p99 us':>12}{'ops/s':>14}{'cpu %':>9}")
+    print("=" * 78)
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<14}  ERROR: {result['error']}")
+            continue
+        print(f"{name:<14}{result['p50_us']:>12}{result['p99_us']:>12}"
+              f"{result['ops_per_sec']:>14}{result['cpu_percent']:>9}")
+        extras = {k: v for k, v in result.items()
+                  if k not in ("iterations", "p50_us", "p99_us", "ops_per_sec", "cpu_percent")}
+        if extras:
+            print(" " * 14 + ", ".join(f"{k}={v}" for k, v in extras.items()))
+    print("=" * 78)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[OK] Results written to {args.json}")
+
+    return 1 if any("error" in r for r in results.values()) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
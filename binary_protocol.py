@@ -0,0 +1,174 @@
+"""Compact binary frames for CMD and TELEM, negotiated over the text protocol
+
+The text protocol spends ~30 bytes on a CMD line and ~35 on a TELEM line,
+and a corrupted digit parses as a different number. Version 1 frames carry
+the same values in 15 (CMD) and 17 (TELEM) bytes with a sequence number
+and a CRC:
+
+    A5 5A | type u8 | seq u8 | length u8 | payload | crc u16 (little-endian)
+
+The CRC is CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF, as
+binascii.crc_hqx) over type, seq, length and payload. All fields are
+little-endian; angles and rates travel as signed hundredths, exactly the
+precision of the text lines.
+
+    CMD   (0x01)  roll i16, pitch i16, throttle u16 (PWM), yaw i16
+    TELEM (0x02)  roll i16, pitch i16, yaw_rate i16, voltage u16 (mV),
+                  battery percent u8, flags u8 (bit0 armed)
+
+Handshake: once the link is up the server sends "PROTO,1". Firmware that
+speaks version 1 answers "PROTO,1,OK" and from its next byte sends TELEM
+as frames and accepts CMD frames. Anything else (old firmware ignores the
+line) and both sides stay on text. Text lines keep working in both
+directions either way - ARM, DISARM, STATUS, ACK and messages are never
+framed. Each side numbers its own frames; the receiver counts the gaps.
+"""
+import struct, binascii
+
+PROTOCOL_VERSION = 1
+HANDSHAKE = f"PROTO,{PROTOCOL_VERSION}\n".encode("ascii")
+HANDSHAKE_OK = f"PROTO,{PROTOCOL_VERSION},OK"
+
+SYNC = b"\xa5\x5a"
+HEADER = struct.Struct("<2sBBB")   # sync, type, seq, payload length
+CRC = struct.Struct("<H")
+MAX_PAYLOAD = 64
+
+FRAME_CMD = 0x01
+FRAME_TELEM = 0x02
+
+CMD = struct.Struct("<hhHh")
+TELEM = struct.Struct("<hhhHBB")
+FLAG_ARMED = 1
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+def _hundredths(value):
+    return max(-32768, min(32767, round(value * 100)))
+
+def _unsigned(value):
+    return max(0, min(65535, round(value)))
+
+# -------------------------
+# Encoding
+# -------------------------
+def encode_frame(frame_type, seq, payload):
+    body = bytes((frame_type, seq & 0xFF, len(payload))) + payload
+    return SYNC + body + CRC.pack(crc16(body))
+
+def encode_cmd(seq, roll, pitch, throttle, yaw):
+    return encode_frame(FRAME_CMD, seq, CMD.pack(_hundredths(roll), _hundredths(pitch),
+                                                 _unsigned(throttle), _hundredths(yaw)))
+
+def encode_telem(seq, roll, pitch, yaw_rate, voltage, percent, armed):
+    return encode_frame(FRAME_TELEM, seq, TELEM.pack(_hundredths(roll), _hundredths(pitch),
+                                                     _hundredths(yaw_rate), _unsigned(voltage * 1000),
+                                                     max(0, min(255, int(percent))),
+                                                     FLAG_ARMED if armed else 0))
+
+def decode_cmd(payload):
+    """(roll, pitch, throttle, yaw) from a CMD payload"""
+    roll, pitch, throttle, yaw = CMD.unpack(payload)
+    return roll / 100, pitch / 100, float(throttle), yaw / 100
+
+def decode_telem(payload):
+    """(roll, pitch, yaw_rate, voltage, percent, armed), as serial_link.parse_telem"""
+    roll, pitch, yaw_rate, millivolts, percent, flags = TELEM.unpack(payload)
+    return roll / 100, pitch / 100, yaw_rate / 100, millivolts / 1000, percent, bool(flags & FLAG_ARMED)
+
+class FrameEncoder:
+    """Turns the CMD lines queued for one link into numbered frames
+
+    Used by the serial writer once the firmware accepted the binary protocol,
+    so every producer of CMD lines (joystick, programs, closed loop) is
+    covered; other lines pass through as text.
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self.frames = 0
+
+    def encode_line(self, data):
+        if not data.startswith(b"CMD,"):
+            return data
+        parts = data.split(b",")
+        try:
+            frame = encode_cmd(self.seq, float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4]))
+        except (IndexError, ValueError):
+            return data
+        self.seq = (self.seq + 1) & 0xFF
+        self.frames += 1
+        return frame
+
+# -------------------------
+# Decoding
+# -------------------------
+class FrameDecoder:
+    """Split a byte stream into text lines and, once `binary` is set, frames
+
+    `feed()` yields stripped lines as bytes and frames as (type, seq,
+    payload) tuples. It is a generator, so setting `binary` while handling
+    an item (the handshake answer) applies to the bytes right after it.
+    A frame whose header or CRC is bad is skipped one byte at a time until
+    the next sync; bytes in front of a sync that don't end a line are noise.
+    """
+
+    def __init__(self, binary=False, max_line=1024):
+        self.buffer = bytearray()
+        self.binary = binary
+        self.max_line = max_line
+        self.frames = 0
+        self.crc_errors = 0
+        self.noise_bytes = 0
+
+    def feed(self, data):
+        self.buffer += data
+        buffer = self.buffer
+        start = 0
+        try:
+            while True:
+                end = buffer.find(b"\n", start)
+                sync = buffer.find(SYNC, start) if self.binary else -1
+                if sync < 0 or 0 <= end < sync:
+                    if end < 0:
+                        break
+                    line = bytes(buffer[start:end]).strip()
+                    start = end + 1
+                    if line:
+                        yield line
+                    continue
+
+                if sync > start:
+                    self.noise_bytes += sync - start
+                    start = sync
+                if len(buffer) - sync < HEADER.size:
+                    break
+                _, frame_type, seq, length = HEADER.unpack_from(buffer, sync)
+                if length > MAX_PAYLOAD:
+                    self.crc_errors += 1
+                    start = sync + 1
+                    continue
+                end = sync + HEADER.size + length
+                if len(buffer) < end + CRC.size:
+                    break
+                if CRC.unpack_from(buffer, end)[0] != crc16(buffer[sync + 2:end]):
+                    self.crc_errors += 1
+                    start = sync + 1
+                    continue
+                start = end + CRC.size
+                self.frames += 1
+                yield frame_type, seq, bytes(buffer[sync + HEADER.size:end])
+        finally:
+            if start:
+                del buffer[:start]
+            if len(buffer) > self.max_line:
+                # Garbage without newlines or sync (baud mismatch, noise) - resync
+                self.noise_bytes += len(buffer)
+                buffer.clear()
+
+    def reset(self):
+        self.buffer.clear()
+
+    def stats(self):
+        return {"frames": self.frames, "crc_errors": self.crc_errors, "noise_bytes": self.noise_bytes}
@@ -0,0 +1,278 @@
+"""Closed-loop flight plan execution and per-airframe calibration
+
+Open-loop plans turn distances and angles into fixed durations. In closed
+loop the executor integrates the TELEM stream instead - yaw_rate for
+heading, roll/pitch through a simple drag model for horizontal travel - and
+ends each rotation or move when the measured amount is reached. How the
+airframe responds is described by a CalibrationProfile, stored per airframe
+as JSON and tunable from recorded flights (see recorder.py).
+"""
+import os, json, math, time, threading
+from serial_link import PRIORITY_COMMAND
+from recorder import KIND_TELEM, KIND_CMD, iter_records
+
+# -------------------------
+# Calibration profiles
+# -------------------------
+class CalibrationProfile:
+    """How one airframe responds to CMD setpoints
+
+    yaw_gain        deg/s of yaw rate per CMD yaw unit
+    yaw_lag_s       time constant of the yaw rate settling after release;
+                    rotations are released this much early to absorb coasting
+    tilt_gain       measured tilt / commanded tilt
+    tilt_lag_s      time constant of the attitude levelling after release
+    speed_per_tilt  steady horizontal speed (cm/s) per tan(tilt)
+    velocity_tau_s  time constant of horizontal speed following tilt
+    climb_speed     cm/s for move_up
+    descend_speed   cm/s for move_down
+    """
+
+    DEFAULTS = {
+        "yaw_gain": 4.5,
+        "yaw_lag_s": 0.1,
+        "tilt_gain": 1.0,
+        "tilt_lag_s": 0.15,
+        "speed_per_tilt": 186.6,    # 50 cm/s at 15 degrees
+        "velocity_tau_s": 0.2,
+        "climb_speed": 50.0,
+        "descend_speed": 50.0,
+    }
+
+    def __init__(self, name="default", **values):
+        self.name = name
+        self.tuned = values.pop("tuned", None)
+        for key, default in self.DEFAULTS.items():
+            setattr(self, key, float(values.get(key, default)))
+
+    def to_dict(self):
+        data = {"name": self.name, "tuned": self.tuned}
+        data.update({key: getattr(self, key) for key in self.DEFAULTS})
+        return data
+
+    @classmethod
+    def load(cls, directory, name):
+        """Profile `<directory>/<name>.json`, or the defaults if there is none"""
+        path = os.path.join(directory, f"{name}.json")
+        if not os.path.exists(path):
+            return cls(name)
+        with open(path) as f:
+            data = json.load(f)
+        data.pop("name", None)
+        return cls(name, **data)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{self.name}.json"), "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    # Expected step times
+    def speed(self, roll, pitch):
+        tilt = math.radians(math.hypot(roll, pitch) * self.tilt_gain)
+        return self.speed_per_tilt * math.tan(tilt)
+
+    def duration(self, step):
+        """Expected time for a move step on this airframe"""
+        if 'angle' in step:
+            return abs(step['angle']) / (self.yaw_gain * abs(step['yaw']))
+        if step['roll'] or step['pitch']:
+            return step['distance'] / self.speed(step['roll'], step['pitch'])
+        if 'distance' in step:
+            rate = self.climb_speed if step['throttle'] > 1400 else self.descend_speed
+            return step['distance'] / rate
+        return step['duration']
+
+    def timeout(self, step):
+        """Give up on a closed-loop step after twice its expected time"""
+        return 2.0 * self.duration(step) + 1.0
+
+# -------------------------
+# Auto-tuning from flight logs
+# -------------------------
+SETTLE_S = 0.5          # ignore samples this soon after a setpoint change
+STOPPED = (1.0, 1.0, 2.0)   # deg (roll, pitch) and deg/s (yaw) considered settled
+MAX_COAST_S = 2.0
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else None
+
+def tune_profile(directory, profile):
+    """Fit yaw_gain, tilt_gain and the release lags from a recorded session
+
+    Gains come from samples where a setpoint has been held long enough to
+    settle; lags from how much a channel keeps integrating after its
+    setpoint returns to zero, divided by its value at release. Returns
+    (new profile, fit report). Horizontal and vertical speeds are not
+    observable from TELEM (no position), so they are kept as set.
+    """
+    yaw_gains, tilt_gains, yaw_lags, tilt_lags = [], [], [], []
+    setpoint = None
+    changed_at = 0.0
+    coasts = {}             # channel -> [value at release, release time, integral, last time]
+
+    for kind, flags, t, values in iter_records(directory):
+        if kind == KIND_CMD:
+            roll, pitch, throttle, yaw = values[:4]
+            current = (roll, pitch, yaw)
+            if current != setpoint:
+                for channel in range(3):
+                    if setpoint and setpoint[channel] and not current[channel]:
+                        coasts[channel] = [None, t, 0.0, t]
+                setpoint = current
+                changed_at = t
+            continue
+        if kind != KIND_TELEM or setpoint is None or not flags & 1:
+            continue
+        measured = values[:3]
+
+        for channel, coast in list(coasts.items()):
+            value = measured[channel]
+            if coast[0] is None:
+                coast[0] = value
+            coast[2] += value * (t - coast[3])
+            coast[3] = t
+            if abs(value) < STOPPED[channel] or t - coast[1] > MAX_COAST_S:
+                if abs(coast[0]) >= STOPPED[channel] * 5:
+                    (yaw_lags if channel == 2 else tilt_lags).append(coast[2] / coast[0])
+                del coasts[channel]
+
+        if t - changed_at < SETTLE_S:
+            continue
+        roll, pitch, yaw = setpoint
+        if yaw:
+            yaw_gains.append(measured[2] / yaw)
+        for commanded, actual in ((roll, measured[0]), (pitch, measured[1])):
+            if abs(commanded) >= 5:
+                tilt_gains.append(actual / commanded)
+
+    fitted = profile.to_dict()
+    fitted.pop("name")
+    report = {"yaw_samples": len(yaw_gains), "tilt_samples": len(tilt_gains),
+              "yaw_stops": len(yaw_lags), "tilt_stops": len(tilt_lags)}
+    for key, samples in (("yaw_gain", yaw_gains), ("tilt_gain", tilt_gains),
+                         ("yaw_lag_s", yaw_lags), ("tilt_lag_s", tilt_lags)):
+        value = _median(samples)
+        if value is not None and value > 0:
+            fitted[key] = round(value, 4)
+    fitted["tuned"] = {"session": os.path.basename(directory), "time": time.time(), **report}
+    return CalibrationProfile(profile.name, **fitted), report
+
+# -------------------------
+# Telemetry integration
+# -------------------------
+class MotionTracker:
+    """Integrate heading and body-frame travel from every TELEM sample"""
+
+    MAX_GAP = 0.5   # s; longer gaps (link dropouts) are not integrated
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.cond = threading.Condition()
+        self.heading = 0.0      # deg, unwrapped
+        self.forward = 0.0      # cm along the pitch axis
+        self.right = 0.0        # cm along the roll axis
+        self.v_forward = 0.0
+        self.v_right = 0.0
+        self.yaw_rate = 0.0
+        self.last = None
+        self.samples = 0
+
+    def feed(self, roll, pitch, yaw_rate):
+        """Called by the serial reader for each TELEM sample"""
+        now = time.monotonic()
+        p = self.profile
+        with self.cond:
+            if self.last is not None and now - self.last < self.MAX_GAP:
+                dt = now - self.last
+                self.heading += (yaw_rate + self.yaw_rate) / 2 * dt
+                a = 1.0 - math.exp(-dt / p.velocity_tau_s)
+                self.v_forward += (p.speed_per_tilt * math.tan(math.radians(pitch)) - self.v_forward) * a
+                self.v_right += (p.speed_per_tilt * math.tan(math.radians(roll)) - self.v_right) * a
+                self.forward += self.v_forward * dt
+                self.right += self.v_right * dt
+            self.last = now
+            self.yaw_rate = yaw_rate
+            self.samples += 1
+            self.cond.notify_all()
+
+    def wait(self, timeout):
+        """Wait for the next sample (or `timeout`)"""
+        with self.cond:
+            self.cond.wait(timeout)
+
+    def position(self):
+        with self.cond:
+            return self.heading, self.forward, self.right
+
+# -------------------------
+# Closed-loop gates
+# -------------------------
+class ClosedLoopController:
+    """'rotate' and 'move' gates for TimelineScheduler
+
+    Each gate streams its setpoint at the control rate itself and returns
+    once the tracker reports the target reached, so the scheduler resumes
+    the timeline from the moment the step actually finished.
+    """
+
+    def __init__(self, link, tracker, rate_hz=50):
+        self.link = link
+        self.tracker = tracker
+        self.period = 1.0 / rate_hz
+        self.last_result = None
+
+    def gates(self):
+        return {"rotate": self.rotate, "move": self.move}
+
+    def _hold(self, data, done, timeout, cancelled):
+        start = time.monotonic()
+        next_send = start
+        while not cancelled.is_set():
+            if done():
+                return True, time.monotonic() - start
+            now = time.monotonic()
+            if now - start > timeout:
+                break
+            if now >= next_send:
+                self.link.send(data, PRIORITY_COMMAND, key="cmd")
+                next_send = now + self.period
+            self.tracker.wait(max(0.0, min(self.period, next_send - time.monotonic())))
+        return False, time.monotonic() - start
+
+    def rotate(self, angle, yaw, timeout, cancelled):
+        tracker = self.tracker
+        lag = tracker.profile.yaw_lag_s
+        start, _, _ = tracker.position()
+        data = f"CMD,0.00,0.00,1400,{yaw:.2f}\n".encode("utf-8")
+
+        def done():
+            turned = abs(tracker.heading - start)
+            # Release early by what the airframe keeps turning after yaw stops
+            return turned + abs(tracker.yaw_rate) * lag >= abs(angle)
+
+        reached, elapsed = self._hold(data, done, timeout, cancelled)
+        self.last_result = {"type": "rotate", "target": angle, "reached": reached,
+                            "measured": round(tracker.heading - start, 1), "elapsed_s": round(elapsed, 3)}
+        return reached
+
+    def move(self, roll, pitch, throttle, distance, timeout, cancelled):
+        tracker = self.tracker
+        coast_s = tracker.profile.velocity_tau_s + tracker.profile.tilt_lag_s
+        _, forward0, right0 = tracker.position()
+        norm = math.hypot(roll, pitch)
+        ux, uy = pitch / norm, roll / norm
+        data = f"CMD,{roll:.2f},{pitch:.2f},{throttle:.0f},0.00\n".encode("utf-8")
+
+        def travelled():
+            return (tracker.forward - forward0) * ux + (tracker.right - right0) * uy
+
+        def done():
+            speed = tracker.v_forward * ux + tracker.v_right * uy
+            # Stop early by the distance covered while attitude and speed decay
+            return travelled() + max(0.0, speed) * coast_s >= distance
+
+        reached, elapsed = self._hold(data, done, timeout, cancelled)
+        self.last_result = {"type": "move", "target": distance, "reached": reached,
+                            "measured": round(travelled(), 1), "elapsed_s": round(elapsed, 3)}
+        return reached
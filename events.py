@@ -0,0 +1,192 @@
+import json, time, asyncio, threading
+from collections import deque
+
+# -------------------------
+# Async wake-ups from worker threads
+# -------------------------
+class AsyncWaiters:
+    """Let publisher threads wake coroutines waiting on asyncio events"""
+
+    def __init__(self):
+        self.waiters = set()
+        self.lock = threading.Lock()
+
+    def add(self):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            self.waiters.add(waiter)
+        return waiter
+
+    def discard(self, waiter):
+        with self.lock:
+            self.waiters.discard(waiter)
+
+    def notify(self):
+        if not self.waiters:
+            return
+        with self.lock:
+            waiters = list(self.waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    async def wait(self, waiter, timeout):
+        """Wait for a notify(); return False on timeout"""
+        event = waiter[1]
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            event.clear()
+
+# -------------------------
+# Push event hub (Server-Sent Events)
+# -------------------------
+class StreamCursor:
+    """What one streaming client has already been sent"""
+
+    def __init__(self, telemetry_version, program_seq, max_hz):
+        self.telemetry_version = telemetry_version
+        self.program_seq = program_seq
+        self.min_interval = 1.0 / max_hz if max_hz else 0.0
+        self.last_sent = 0.0
+        self.last_output = time.monotonic()
+
+class EventHub:
+    """Fan telemetry and program-state changes out to streaming clients
+
+    Telemetry is a latest-value channel: each publish replaces the previous
+    frame, reuses the snapshot's cached JSON for every client, and a client that reads
+    slower than it is published simply gets the newest frame. Program events
+    are a short log so each client sees every transition in order. Clients
+    can be threads (`stream`) or asyncio tasks (`async_stream`).
+    """
+
+    HEARTBEAT = 15.0
+
+    def __init__(self, history=64):
+        self.cond = threading.Condition()
+        self.async_waiters = AsyncWaiters()
+        self.telemetry_version = 0
+        self.telemetry_frame = None
+        self.program_seq = 0
+        self.program_events = deque(maxlen=history)
+        self.clients = 0
+
+    def publish_telemetry(self, snapshot):
+        """Record a telemetry change (a snapshot.TelemetrySnapshot)"""
+        if not self.clients:
+            return
+        frame = snapshot.json
+        with self.cond:
+            self.telemetry_version += 1
+            self.telemetry_frame = frame
+            self.cond.notify_all()
+        self.async_waiters.notify()
+
+    def publish_program(self, state, **fields):
+        """Record a program-state transition (started, step, completed, ...)"""
+        fields["state"] = state
+        fields["time"] = time.time()
+        with self.cond:
+            self.program_seq += 1
+            self.program_events.append((self.program_seq, json.dumps(fields)))
+            self.cond.notify_all()
+        self.async_waiters.notify()
+
+    def _open(self, max_hz, since):
+        with self.cond:
+            self.clients += 1
+            seen_program = self.program_seq if since is None else min(since, self.program_seq)
+            return StreamCursor(self.telemetry_version, seen_program, max_hz)
+
+    def _close(self):
+        with self.cond:
+            self.clients -= 1
+
+    def _changed(self, cursor):
+        return (self.telemetry_version != cursor.telemetry_version
+                or self.program_seq != cursor.program_seq)
+
+    def _intro(self, cursor, telemetry):
+        chunk = b"retry: 2000\n\n"
+        if telemetry is not None:
+            # Current state straight away, before the next change
+            chunk += b"event: telemetry\ndata: " + telemetry.json + b"\n\n"
+            cursor.last_sent = time.monotonic()
+        return chunk
+
+    def _pending(self, cursor):
+        """Collect what `cursor` has not seen yet; returns (chunk or None, wait_s)"""
+        now = time.monotonic()
+        with self.cond:
+            program = [e for e in self.program_events if e[0] > cursor.program_seq]
+            cursor.program_seq = self.program_seq
+            frame = None
+            throttled = False
+            if self.telemetry_version != cursor.telemetry_version:
+                if now - cursor.last_sent >= cursor.min_interval:
+                    frame = self.telemetry_frame
+                    cursor.telemetry_version = self.telemetry_version
+                    cursor.last_sent = now
+                else:
+                    throttled = True
+
+        chunks = [f"id: {seq}\nevent: program\ndata: {data}\n\n".encode("utf-8") for seq, data in program]
+        if frame is not None:
+            chunks.append(b"event: telemetry\ndata: " + frame + b"\n\n")
+
+        if chunks:
+            cursor.last_output = now
+            return b"".join(chunks), 0.0
+        if now - cursor.last_output >= self.HEARTBEAT:
+            cursor.last_output = now
+            return b": ping\n\n", 0.0
+        if throttled:
+            # Rate limited - wait out the rest of this client's interval
+            return None, max(0.0, cursor.min_interval - (now - cursor.last_sent))
+        return None, 0.0
+
+    def stream(self, max_hz=None, telemetry=None, since=None):
+        """SSE generator for one client
+
+        `telemetry` is the snapshot sent on connect; `max_hz` limits
+        telemetry frames; `since` replays program events after that id
+        (still in history) so a client attaching just after starting a
+        program doesn't miss its first transitions.
+        """
+        cursor = self._open(max_hz, since)
+        try:
+            yield self._intro(cursor, telemetry)
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self._changed(cursor), timeout=self.HEARTBEAT)
+                chunk, delay = self._pending(cursor)
+                if chunk:
+                    yield chunk
+                elif delay:
+                    time.sleep(delay)
+        finally:
+            self._close()
+
+    async def async_stream(self, max_hz=None, telemetry=None, since=None):
+        """Same as `stream` for an asyncio server; holds no thread while idle"""
+        cursor = self._open(max_hz, since)
+        waiter = self.async_waiters.add()
+        try:
+            yield self._intro(cursor, telemetry)
+            while True:
+                if not self._changed(cursor):
+                    await self.async_waiters.wait(waiter, self.HEARTBEAT)
+                chunk, delay = self._pending(cursor)
+                if chunk:
+                    yield chunk
+                elif delay:
+                    await asyncio.sleep(delay)
+        finally:
+            self.async_waiters.discard(waiter)
+            self._close()
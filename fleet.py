@@ -0,0 +1,797 @@
+"""Fleet registry: one Drone per flight controller link
+
+Everything app.py used to keep as module state for its single drone - the
+serial link with its reader and writer, telemetry, arm handshake, joystick
+state, executor, flight recorder and video - lives on a Drone, so one server
+process can fly a classroom of them. The drones are listed in FILO_FLEET
+(see load_config).
+
+Links scale without a polling loop each: device ports share one selector
+thread (serial_link.SerialMux), writers sleep on their queue until a line
+is sent, and one watchdog thread checks the whole fleet.
+
+Nothing here blocks at import: each link is opened by a background thread
+that retries with exponential backoff, and reopens the port the same way
+when it drops. Progress is kept in Drone.init for /status.
+"""
+import os, re, json, time, threading
+from concurrent.futures import Future
+from events import EventHub
+from snapshot import TelemetryState
+from flight_plan import build_timeline, TimelineScheduler
+from closed_loop import CalibrationProfile, MotionTracker, ClosedLoopController
+from recorder import FlightRecorder, prune_sessions, session_bytes
+from metrics import Histogram, STEP_BUCKETS
+from tracing import LatencyTracer
+from jobs import JobQueue
+from binary_protocol import FrameEncoder, HANDSHAKE, HANDSHAKE_OK
+from serial_link import (open_transport, SerialMux, SerialReader, SerialWriter, PRIORITY_EMERGENCY,
+                         PRIORITY_CONTROL, PRIORITY_STATUS)
+from video_stream import FrameBroadcaster, PlaceholderSource
+from video_record import VideoRecorder
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RECORD_FLIGHTS = True
+LOG_DIR = os.path.join(BASE_DIR, "logs")
+# Oldest flight-log sessions are deleted at startup to stay under this
+# (each session preallocates up to 16 MB)
+LOG_QUOTA_BYTES = int(os.environ.get("FILO_LOG_QUOTA_MB", "512")) * 1024 * 1024
+
+# All writes go through one thread per link that owns the port
+SERIAL_MAX_BYTES_PER_SEC = 20000   # ~80% of 250000 baud
+
+# "auto" offers the binary CMD/TELEM frames (see binary_protocol.py) when a
+# link comes up and stays on text if the firmware doesn't answer; "text" never asks
+SERIAL_PROTOCOL = os.environ.get("FILO_SERIAL_PROTOCOL", "auto")
+PROTOCOL_TIMEOUT = 0.5
+
+VIDEO_TARGET_FPS = 15      # upper bound, lowered per client when it lags
+VIDEO_JPEG_QUALITY = 80    # upper bound for adaptive quality
+
+# Marker / blob detection worker (see vision.py); needs numpy and OpenCV
+VISION_ENABLED = os.environ.get("FILO_VISION", "0") == "1"
+VISION_FPS = 10
+VISION_BLOB_COLOR = "red"
+
+# Flight video: recorded from arming to disarming (see video_record.py).
+# Opt-in: H.264 at 2 Mbit/s is ~15 MB per minute armed, MJPEG about twice
+# that. Older recordings are deleted when a new one starts so videos/ stays
+# under FILO_VIDEO_QUOTA_MB. POST /recording/start works either way.
+RECORD_VIDEO = os.environ.get("FILO_RECORD_VIDEO", "0") == "1"
+VIDEO_DIR = os.path.join(BASE_DIR, "videos")
+VIDEO_QUOTA_BYTES = int(os.environ.get("FILO_VIDEO_QUOTA_MB", "2048")) * 1024 * 1024
+VIDEO_SEGMENT_SECONDS = 10.0
+
+CONTROL_RATE_HZ = 50  # setpoint rate while a move step is running
+
+# Closed loop: rotations and horizontal moves end on integrated telemetry
+# using the airframe's calibration profile (see closed_loop.py). Opt-in:
+# tune_profile() fits the yaw and tilt response but not the horizontal and
+# vertical speeds, so move distances rest on defaults that haven't been
+# checked against measured travel. Programs can still ask for it per run.
+CONTROL_MODES = ("closed_loop", "open_loop")
+CONTROL_MODE = os.environ.get("FILO_CONTROL_MODE", "open_loop")
+AIRFRAME = os.environ.get("FILO_AIRFRAME", "default")
+PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+
+ARM_TIMEOUT = 3.0            # seconds to wait for the flight controller's answer
+ARDUINO_RESET_DELAY = 2.0    # the Arduino resets when the port opens
+RECONNECT_MIN_DELAY = 1.0    # backoff between attempts to open the link
+RECONNECT_MAX_DELAY = 30.0
+COMMAND_TIMEOUT = 2.0        # armed with no stick input this long -> "warning"
+WATCHDOG_INTERVAL = 0.5
+
+# Wall time of each executed program step, by step type (see /metrics)
+PROGRAM_STEP_SECONDS = Histogram("filo_program_step_seconds", "Wall time of autonomous program steps",
+                                 labels=("drone", "type"), buckets=STEP_BUCKETS)
+
+# Onboard vision stage (optional - needs numpy; OpenCV is loaded by the worker)
+try:
+    import vision as vision_stage
+except ImportError as e:
+    print("[WARN] numpy not available, vision stage disabled:", e)
+    vision_stage = None
+
+# -------------------------
+# Configuration
+# -------------------------
+DRONE_ID_RE = re.compile(r"^[\w\-]+$")
+
+def load_config(spec, default_port):
+    """Drone entries from a FILO_FLEET spec
+
+    `spec` is either the path of a JSON file holding a list of
+    {"id", "port", "airframe", "camera"} objects, or a comma separated list
+    of `id=port` (or bare `port`, numbered from 1) entries. Without a spec
+    the fleet is one drone "1" on `default_port`. `camera` is "local" (the
+    camera attached to this host), an OpenCV device index or stream URL, or
+    null; it defaults to "local" for the first drone only.
+    """
+    if not spec:
+        entries = [{"port": default_port}]
+    elif spec.endswith(".json"):
+        with open(spec) as f:
+            entries = json.load(f)
+    else:
+        entries = []
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            drone_id, sep, port = item.partition("=")
+            if sep and DRONE_ID_RE.match(drone_id):
+                entries.append({"id": drone_id, "port": port})
+            else:
+                entries.append({"port": item})
+
+    config = []
+    for i, entry in enumerate(entries):
+        drone_id = str(entry.get("id", i + 1))
+        if not DRONE_ID_RE.match(drone_id):
+            raise ValueError(f"Invalid drone id: {drone_id!r}")
+        if any(c["id"] == drone_id for c in config):
+            raise ValueError(f"Duplicate drone id: {drone_id!r}")
+        config.append({
+            "id": drone_id,
+            "port": entry["port"],
+            "airframe": entry.get("airframe", AIRFRAME),
+            "camera": entry.get("camera", "local" if i == 0 else None)
+        })
+    return config
+
+# -------------------------
+# Autonomous flight command executor
+# -------------------------
+class DroneCommandExecutor:
+    def __init__(self, drone, rate_hz=CONTROL_RATE_HZ):
+        self.drone = drone
+        self.link = drone.writer
+        self.rate_hz = rate_hz
+        self.running = False
+        self.scheduler = None
+        self.last_run = None
+        self.controller = ClosedLoopController(drone.writer, drone.tracker, rate_hz)
+
+    def run_job(self, job):
+        """Fly a queued program (JobQueue worker); returns the scheduler stats"""
+        return self.execute_commands(job.commands, job.mode, job)
+
+    def execute_commands(self, commands, mode=CONTROL_MODE, job=None):
+        """Execute command sequence on Arduino"""
+        drone = self.drone
+        job_id = job.id if job else None
+        self.running = True
+        closed_loop = mode == "closed_loop"
+        timeline = build_timeline(commands, self.rate_hz, drone.armed,
+                                  drone.tracker.profile if closed_loop else None)
+        gates = self.controller.gates() if closed_loop else {}
+        if drone.vision:
+            gates["marker"] = drone.vision.wait_for_marker
+            if hasattr(drone.video_source, "open") and any(step['type'] == 'wait_marker' for step in commands):
+                # Marker waits need the camera even when nobody watches the stream
+                threading.Thread(target=drone.video_source.open, daemon=True).start()
+        self.scheduler = TimelineScheduler(self.link, self.rate_hz, gates,
+                                           cancelled=job.cancelled if job else None)
+        if job:
+            job.start(timeline[-1][0], [event[0] for event in timeline if event[1] is None and event[3] is None])
+        current = [None, 0.0]  # step type, start time
+
+        def report_step(i):
+            now = time.monotonic()
+            if current[0]:
+                PROGRAM_STEP_SECONDS.observe(now - current[1], drone.id, current[0])
+            current[:] = [commands[i]['type'] if i < len(commands) else None, now]
+            if i < len(commands):
+                cmd = commands[i]
+                if job:
+                    job.on_step(i)
+                print(f"[CMD] {drone.id}: executing command {i+1}/{len(commands)}: "
+                      f"{cmd['type']} (line {cmd['line']})")
+                drone.events.publish_program("step", job=job_id, step=i + 1, total=len(commands),
+                                             type=cmd['type'], line=cmd['line'],
+                                             eta=job.eta() if job else None)
+
+        drone.events.publish_program("started", job=job_id, total=len(commands),
+                                     duration=round(timeline[-1][0], 2))
+        try:
+            stats = self.scheduler.run(timeline, on_step=report_step)
+        finally:
+            self.running = False
+        stats["mode"] = mode
+        self.last_run = stats
+
+        if stats["cancelled"]:
+            print(f"[X] {drone.id}: command execution stopped")
+            drone.events.publish_program("stopped", job=job_id, reason=job.reason if job else None,
+                                         stats=stats)
+        else:
+            drone.events.publish_program("completed", job=job_id, stats=stats)
+            print(f"[OK] {drone.id}: command sequence completed "
+                  f"(jitter avg {stats['jitter_ms']['avg']}ms, max {stats['jitter_ms']['max']}ms, "
+                  f"{stats['missed_deadlines']} missed)")
+        return stats
+
+    def stop(self):
+        """Cancel the running sequence within one control tick"""
+        self.running = False
+        if self.scheduler:
+            self.scheduler.cancel()
+
+# -------------------------
+# Control channel
+# -------------------------
+class ControlSession:
+    """State of one persistent control connection (WebSocket)"""
+
+    def __init__(self):
+        self.last_seq = -1
+
+# -------------------------
+# One drone
+# -------------------------
+class Drone:
+    """A flight controller link and all state that belongs to it"""
+
+    def __init__(self, drone_id, port, airframe=AIRFRAME, video_source=None):
+        self.id = drone_id
+        self.port = port
+        self.airframe = airframe
+        self.link = None
+        self.link_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.protocol_accepted = threading.Event()
+        self.mux = None
+        self.recorder = None
+        self.reader = None
+        # Stick-to-motor latency of inputs the client asked to trace (GET /trace)
+        self.tracer = LatencyTracer()
+        # Lines are dropped until the link is up (see _bring_up)
+        self.writer = SerialWriter(None, max_bytes_per_sec=SERIAL_MAX_BYTES_PER_SEC,
+                                   on_trace=self.tracer.written)
+        self.writer.start()
+
+        self.armed = False
+        self.autonomous_mode = False  # Flag for autonomous flight
+
+        # Immutable, versioned snapshots: read telemetry.current, change with
+        # telemetry.update(...) (see snapshot.py)
+        self.telemetry = TelemetryState(
+            roll=0.0,
+            pitch=0.0,
+            yaw_rate=0.0,
+            battery_voltage=0.0,
+            battery_percent=0,
+            armed=False,
+            altitude=0.0,
+            connection="disconnected",
+            vision=None
+        )
+        # Push channel for telemetry and program state (GET /events)
+        self.events = EventHub()
+
+        self.arm_response = None  # Future resolved by the serial reader during /arm
+        self.arm_response_lock = threading.Lock()
+
+        self.joystick_state = {
+            "roll": 0.0,
+            "pitch": 0.0,
+            "yaw": 0.0,
+            "throttle": -1.0
+        }
+        self.last_command_time = time.time()
+
+        # Control link statistics (shared by HTTP and WebSocket inputs)
+        self.control_link = {
+            "transport": "http",
+            "clients": 0,
+            "rtt_ms": None,
+            "stale_dropped": 0
+        }
+
+        self.tracker = MotionTracker(CalibrationProfile.load(PROFILE_DIR, airframe))
+        print(f"[OK] {self.id}: calibration profile '{airframe}' "
+              f"({'tuned' if self.tracker.profile.tuned else 'defaults'})")
+        self.executor = DroneCommandExecutor(self)
+        # Submitted programs, flown one at a time (POST /run, /jobs)
+        self.jobs = JobQueue(self.executor.run_job, self._program_busy, self._program_idle,
+                             self.events.publish_program)
+
+        # Serial bring-up progress, reported on /status
+        self.init = {
+            "state": "idle",        # idle, connecting, ready, retrying
+            "attempts": 0,
+            "reconnects": 0,
+            "took_s": None,         # duration of the last successful bring-up
+            "ready_at": None,
+            "last_error": None,
+            "retry_in_s": None
+        }
+
+        self.video_source = video_source or PlaceholderSource()
+        self.video = FrameBroadcaster(self.video_source, fps=VIDEO_TARGET_FPS, quality=VIDEO_JPEG_QUALITY)
+        self.vision = None
+        self.video_recorder = None
+        if not isinstance(self.video_source, PlaceholderSource):
+            self.video_recorder = VideoRecorder(VIDEO_DIR, self.video, self.telemetry, VIDEO_QUOTA_BYTES,
+                                                segment_seconds=VIDEO_SEGMENT_SECONDS)
+
+    # Hardware
+    def start(self, mux):
+        """Bring the serial link up in the background; returns immediately"""
+        self.mux = mux
+        threading.Thread(target=self._bring_up, daemon=True).start()
+
+    def _bring_up(self):
+        """Open the port, retrying with exponential backoff until it works"""
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            self.init.update(state="connecting", retry_in_s=None)
+            self.init["attempts"] += 1
+            started = time.monotonic()
+            try:
+                link = open_transport(self.port, 250000, timeout=1)
+                if not self.port.startswith("sim"):
+                    time.sleep(ARDUINO_RESET_DELAY)
+                link.reset_input_buffer()
+                break
+            except Exception as e:
+                print(f"[ERROR] {self.id}: Arduino connection failed, retrying in {delay:.0f}s:", e)
+                self.init.update(state="retrying", last_error=str(e), retry_in_s=delay)
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+        if RECORD_FLIGHTS and self.recorder is None:
+            try:
+                self.recorder = FlightRecorder(LOG_DIR, session=f"{time.strftime('%Y%m%d-%H%M%S')}-{self.id}")
+                self.writer.on_write = self.recorder.record_output
+                print(f"[OK] {self.id}: recording flight log {self.recorder.session}")
+            except OSError as e:
+                print(f"[WARN] {self.id}: flight recorder disabled:", e)
+
+        with self.link_lock:
+            self.link = link
+            self.writer.attach(link)
+            self.reader = SerialReader(link, self.handle_telemetry, self.handle_serial_line,
+                                       self.handle_serial_error, negotiate=SERIAL_PROTOCOL == "auto")
+        self.mux.add(self.reader)
+        if SERIAL_PROTOCOL == "auto":
+            self._negotiate_protocol()
+        self.ready.set()
+        self.init.update(state="ready", took_s=round(time.monotonic() - started, 3), ready_at=time.time())
+        print(f"[OK] {self.id}: Arduino connected on {self.port} ({self.init['took_s']}s)")
+
+    def _negotiate_protocol(self):
+        """Offer the binary protocol; the link stays on text without an answer"""
+        self.protocol_accepted.clear()
+        self.writer.send(HANDSHAKE, PRIORITY_CONTROL)
+        if self.protocol_accepted.wait(PROTOCOL_TIMEOUT):
+            print(f"[OK] {self.id}: binary serial protocol accepted")
+        else:
+            print(f"[WARN] {self.id}: no answer to the binary protocol handshake, using text lines")
+
+    def wait_ready(self, timeout=None):
+        """Block until the serial link is up; returns False on timeout"""
+        return self.ready.wait(timeout)
+
+    def _link_lost(self, error):
+        """Drop a failed link and reconnect it in the background"""
+        with self.link_lock:
+            link, self.link = self.link, None
+            if link is None:
+                return
+            self.ready.clear()
+            self.reader.stop()
+            self.writer.attach(None)
+        # A program can't continue without its link
+        self.jobs.stop_all("serial link lost")
+        try:
+            link.close()
+        except Exception:
+            pass
+        self.init["reconnects"] += 1
+        self.init["last_error"] = str(error)
+        print(f"[WARN] {self.id}: serial link lost, reconnecting")
+        threading.Thread(target=self._bring_up, daemon=True).start()
+
+    def start_vision(self):
+        """Create the vision stage; it starts once something opened the camera"""
+        if VISION_ENABLED and vision_stage and not isinstance(self.video_source, PlaceholderSource):
+            self.vision = vision_stage.VisionStage(fps=VISION_FPS, blob_color=VISION_BLOB_COLOR,
+                                                   on_result=self.handle_vision)
+            if hasattr(self.video_source, "when_open"):
+                # Grab from the opened camera so vision never opens it itself
+                self.video_source.when_open(lambda source: self.vision.start(source.raw))
+            else:
+                self.vision.start(self.video_source.raw)
+
+    def handle_vision(self, result):
+        """Fold the latest detection into telemetry"""
+        snapshot = self.telemetry.update_if_changed(vision=vision_stage.summarize(result))
+        if snapshot:
+            self.events.publish_telemetry(snapshot)
+
+    # Manual control
+    def begin_trace(self, data, transport, received):
+        """Trace for an input that carries a "trace" field, or None (see tracing.py)"""
+        if not isinstance(data, dict) or "trace" not in data:
+            return None
+        trace = self.tracer.begin(data["trace"], transport, received)
+        if trace:
+            self.tracer.parsed(trace)
+        return trace
+
+    def apply_joystick_input(self, data, trace=None):
+        """Update joystick state from client input and forward it as a CMD line"""
+        self.last_command_time = time.time()
+        joystick_state = self.joystick_state
+
+        for key in data:
+            if key in joystick_state:
+                joystick_state[key] = float(data[key])
+
+        roll = joystick_state["roll"] * 45
+        pitch = joystick_state["pitch"] * 45
+        yaw = joystick_state["yaw"] * 45
+        # Map joystick throttle (-1.0 to +1.0) to PWM (1000 to 2000)
+        # When joystick released: throttle = -1.0 → PWM = 1000 (minimum)
+        # When joystick pushed up: throttle = +1.0 → PWM = 2000 (maximum)
+        throttle_input = joystick_state["throttle"]
+        throttle = 1000 + ((throttle_input + 1) * 500)
+
+        if self.link:
+            command = f"CMD,{roll:.2f},{pitch:.2f},{throttle:.0f},{yaw:.2f}\n"
+            if trace:
+                self.tracer.queued(trace)
+            self.writer.send(command.encode("utf-8"), key="cmd", trace=trace)
+
+        return {
+            "roll": roll,
+            "pitch": pitch,
+            "yaw": yaw,
+            "throttle": throttle
+        }
+
+    def joystick_reply(self, sent, trace=None):
+        """/joystick success body, embedding the snapshot's cached JSON"""
+        echo = b', "trace": ' + json.dumps(self.tracer.echo(trace)).encode("utf-8") if trace else b''
+        return (b'{"status": "ok", "sent": ' + json.dumps(sent).encode("utf-8") + echo
+                + b', "telemetry": ' + self.telemetry.current.json + b'}')
+
+    def manual_control_error(self):
+        """Return a reason manual input is refused, or None if it is accepted"""
+        # Don't accept manual control during autonomous flight
+        if self.autonomous_mode:
+            return "Autonomous mode active"
+        if not self.armed:
+            return "Motors are disarmed"
+        return None
+
+    def control_message(self, session, message):
+        """Handle one control-channel message; return the reply dict or None
+
+        Client messages (JSON text):
+          {"t": "stick", "seq": n, "roll": .., "pitch": .., "yaw": .., "throttle": ..,
+           "trace": {..} (optional, see tracing.py)}
+          {"t": "ping", "ts": client_time}
+          {"t": "rtt", "ms": measured_round_trip}
+        Inputs with a sequence number not newer than the last one seen are
+        stale (reordered or delayed) and are dropped without touching serial.
+        """
+        received = time.perf_counter()
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return None
+        kind = data.get("t")
+
+        if kind == "stick":
+            seq = int(data.get("seq", -1))
+            if seq <= session.last_seq:
+                self.control_link["stale_dropped"] += 1
+                return None
+            session.last_seq = seq
+            trace = self.begin_trace(data, "ws", received)
+
+            error = self.manual_control_error()
+            if error:
+                return {"t": "ack", "seq": seq, "status": "error", "message": error}
+
+            stick = {k: data[k] for k in self.joystick_state if k in data}
+            try:
+                sent = self.apply_joystick_input(stick, trace)
+            except (TypeError, ValueError) as e:
+                return {"t": "ack", "seq": seq, "status": "error", "message": str(e)}
+            reply = {"t": "ack", "seq": seq, "status": "ok", "sent": sent}
+            if trace:
+                reply["trace"] = self.tracer.echo(trace)
+            return reply
+
+        elif kind == "ping":
+            return {"t": "pong", "ts": data.get("ts")}
+
+        elif kind == "rtt":
+            try:
+                self.control_link["rtt_ms"] = round(float(data.get("ms")), 1)
+            except (TypeError, ValueError):
+                pass
+        return None
+
+    def control_connected(self):
+        self.control_link["clients"] += 1
+        self.control_link["transport"] = "ws"
+        print(f"[WS] {self.id}: control client connected")
+
+    def control_disconnected(self):
+        self.control_link["clients"] = max(0, self.control_link["clients"] - 1)
+        if self.control_link["clients"] == 0:
+            self.control_link["transport"] = "http"
+        print(f"[WS] {self.id}: control client disconnected")
+
+    # Arm / disarm
+    def arm_precheck(self):
+        """Return an (error payload, status) tuple if arming is refused, else None"""
+        if self.autonomous_mode:
+            return {
+                "status": "error",
+                "message": "Cannot arm during autonomous flight"
+            }, 403
+
+        if self.joystick_state["throttle"] > -0.9:
+            return {
+                "status": "error",
+                "message": "⚠️ Throttle must be at MINIMUM before arming!"
+            }, 400
+
+        if not self.link:
+            return {
+                "status": "error",
+                "message": "❌ Arduino not connected"
+            }, 500
+        return None
+
+    def start_arm(self):
+        """Send ARM and return a Future the serial reader resolves"""
+        future = Future()
+        with self.arm_response_lock:
+            self.arm_response = future
+        self.writer.send(b"ARM\n", PRIORITY_CONTROL)
+        return future
+
+    def resolve_arm(self, result):
+        """Called by the serial reader with 'success' or 'failed'"""
+        with self.arm_response_lock:
+            if self.arm_response is not None and not self.arm_response.done():
+                self.arm_response.set_result(result)
+
+    def finish_arm(self, result):
+        """Turn the handshake result (None on timeout) into (payload, status)"""
+        if result == "success":
+            self.armed = True
+            self.events.publish_telemetry(self.telemetry.update(armed=True))
+            if RECORD_VIDEO:
+                self.start_video_recording()
+            return {
+                "status": "ok",
+                "message": "🟢 Motors ARMED - BE CAREFUL!"
+            }, 200
+        elif result == "failed":
+            return {
+                "status": "error",
+                "message": "❌ Pre-arm checks FAILED!"
+            }, 400
+        return {
+            "status": "error",
+            "message": "⚠️ No response from flight controller"
+        }, 500
+
+    def disarm_now(self):
+        """Disarm immediately (DISARM jumps the serial queue)"""
+        self.armed = False
+        self.autonomous_mode = False
+        self.events.publish_telemetry(self.telemetry.update(armed=False))
+
+        if self.link:
+            self.writer.send(b"DISARM\n", PRIORITY_EMERGENCY, purge=True)
+        self.stop_video_recording()
+
+        return {
+            "status": "ok",
+            "message": "🔴 Motors DISARMED"
+        }
+
+    # Video recording
+    def start_video_recording(self):
+        """Start recording this drone's camera; False if none or already recording"""
+        if not self.video_recorder:
+            return False
+        return self.video_recorder.start(f"{time.strftime('%Y%m%d-%H%M%S')}-{self.id}")
+
+    def stop_video_recording(self):
+        """Stop the current recording; returns its stats, or None"""
+        return self.video_recorder.stop() if self.video_recorder else None
+
+    # Programs
+    def _program_busy(self):
+        self.autonomous_mode = True
+
+    def _program_idle(self):
+        self.autonomous_mode = False
+
+    def stop_program(self):
+        """Emergency stop for autonomous flight"""
+        # The active job's scheduler wakes on its cancel Event at once
+        self.jobs.stop_all("emergency stop")
+
+        self.autonomous_mode = False
+
+        if self.link:
+            self.writer.send(b"DISARM\n", PRIORITY_EMERGENCY, purge=True)
+
+    # Status
+    def status_payload(self):
+        if self.link:
+            self.writer.send(b"STATUS\n", PRIORITY_STATUS, key="status")
+        snapshot = self.telemetry.current
+        return {
+            "id": self.id,
+            "armed": self.armed,
+            "autonomous": self.autonomous_mode,
+            "telemetry": dict(snapshot.as_dict(), version=snapshot.version),
+            "connection": "connected" if self.link else "disconnected",
+            "ready": self.ready.is_set(),
+            "init": {
+                "serial": self.init,
+                "camera": self.video_source.state() if hasattr(self.video_source, "state") else None
+            },
+            "control_link": self.control_link,
+            "serial": self.reader.stats() if self.reader else None,
+            "serial_writer": self.writer.stats(),
+            "last_run": self.executor.last_run,
+            "jobs": self.jobs.snapshot(),
+            "recorder": self.recorder.stats() if self.recorder else None,
+            "vision": self.vision.stats() if self.vision else None,
+            "video_recording": self.video_recorder.stats() if self.video_recorder else None
+        }
+
+    def summary(self):
+        """Short entry for the fleet listing"""
+        snapshot = self.telemetry.current
+        return {
+            "id": self.id,
+            "port": self.port,
+            "airframe": self.airframe,
+            "connected": self.link is not None,
+            "ready": self.ready.is_set(),
+            "connection": snapshot.connection,
+            "armed": self.armed,
+            "autonomous": self.autonomous_mode,
+            "battery_percent": snapshot.battery_percent,
+            "camera": not isinstance(self.video_source, PlaceholderSource)
+        }
+
+    # Serial input
+    def set_connection(self, state):
+        """Set the connection state; returns the new snapshot, or None if unchanged"""
+        snapshot = self.telemetry.update_if_changed(connection=state)
+        if snapshot and self.recorder:
+            self.recorder.record_connection(state)
+        return snapshot
+
+    def handle_telemetry(self, values):
+        """Apply one parsed TELEM sample"""
+        roll, pitch, yaw_rate, voltage, percent, fc_armed = values
+        if self.recorder:
+            self.recorder.record_telem(values)
+        self.tracker.feed(roll, pitch, yaw_rate)
+        # One swap per sample, so readers never see half an update
+        snapshot = self.telemetry.update(roll=roll, pitch=pitch, yaw_rate=yaw_rate,
+                                         battery_voltage=voltage, battery_percent=percent,
+                                         armed=fc_armed)
+        self.events.publish_telemetry(self.set_connection("connected") or snapshot)
+
+    def handle_serial_line(self, line):
+        """Dispatch a non-TELEM line from the flight controller"""
+        if line.startswith("ACK,"):
+            self.tracer.acked(time.perf_counter())
+            snapshot = self.set_connection("connected")
+            if snapshot:
+                self.events.publish_telemetry(snapshot)
+
+        elif line == HANDSHAKE_OK:
+            # The reader already frames what follows; CMD lines go out as frames from now on
+            self.writer.encoder = FrameEncoder()
+            self.protocol_accepted.set()
+
+        elif "Motors ARMED" in line:
+            print(f"[OK] {self.id}: {line}")
+            self.resolve_arm("success")
+
+        elif "Pre-arm checks FAILED" in line or ("❌" in line and "arm" in line.lower()):
+            print(f"[ERROR] {self.id}: {line}")
+            self.resolve_arm("failed")
+
+        elif line.startswith("🚨") or line.startswith("EMERGENCY"):
+            print(f"[WARN] {self.id}: {line}")
+            if self.recorder:
+                self.recorder.record_emergency()
+            self.armed = False
+            self.autonomous_mode = False
+            self.events.publish_telemetry(self.telemetry.update(armed=False))
+            self.stop_video_recording()
+
+        elif not line.startswith('\x00'):
+            print(f"[DATA] {self.id}: {line}")
+
+    def handle_serial_error(self, error):
+        self.events.publish_telemetry(self.set_connection("error") or self.telemetry.current)
+        self._link_lost(error)
+
+    def check_link(self, now):
+        """Watchdog tick: flag an armed drone that stopped getting stick input"""
+        if self.armed and not self.autonomous_mode and (now - self.last_command_time > COMMAND_TIMEOUT):
+            snapshot = self.set_connection("warning")
+            if snapshot:
+                self.events.publish_telemetry(snapshot)
+
+# -------------------------
+# Registry
+# -------------------------
+class Fleet:
+    """Drones by id, in configuration order; the first one is the default
+
+    Routes without a drone id act on the default drone, so a single-drone
+    setup works exactly as before.
+    """
+
+    def __init__(self):
+        self.drones = {}
+        self.default = None
+        self.mux = SerialMux()
+        self.watchdog = None
+
+    def add(self, drone):
+        self.drones[drone.id] = drone
+        if self.default is None:
+            self.default = drone
+        return drone
+
+    def get(self, drone_id=None):
+        if drone_id is None:
+            return self.default
+        return self.drones.get(drone_id)
+
+    def __iter__(self):
+        return iter(list(self.drones.values()))
+
+    def __len__(self):
+        return len(self.drones)
+
+    def start(self):
+        """Start every drone's bring-up in parallel; returns immediately"""
+        if RECORD_FLIGHTS:
+            # Once, before any drone opens its session - leave room for all of them
+            prune_sessions(LOG_DIR, LOG_QUOTA_BYTES - len(self) * session_bytes())
+        for drone in self:
+            drone.start(self.mux)
+            drone.start_vision()
+        self.watchdog = threading.Thread(target=self._watch, daemon=True)
+        self.watchdog.start()
+
+    def _watch(self):
+        """One connection watchdog for every drone"""
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            now = time.time()
+            for drone in self:
+                drone.check_link(now)
+
+    def disarm_all(self):
+        """Stop every program and disarm every drone"""
+        for drone in self:
+            drone.jobs.stop_all("fleet disarm")
+        return {drone.id: drone.disarm_now() for drone in self}
+
+    def summary(self):
+        return {
+            "default": self.default.id if self.default else None,
+            "drones": [drone.summary() for drone in self],
+            "serial_mux": self.mux.stats()
+        }
@@ -0,0 +1,746 @@
+import ast, math, time, numbers, hashlib, threading
+from collections import OrderedDict
+from serial_link import PRIORITY_EMERGENCY, PRIORITY_CONTROL, PRIORITY_COMMAND
+
+# -------------------------
+# Flight plan compiler
+# -------------------------
+# Blockly emits a small Python subset. Programs are compiled ahead of time
+# into a flat plan: a tuple of step dicts the executor walks in order.
+# Loops, procedures and arithmetic are evaluated at compile time, so the
+# executor only ever sees concrete numbers.
+#
+# Step shapes:
+#   {'type': 'takeoff' | 'land' | 'hover', 'delay': s, 'line': n}
+#   {'type': 'emergency', 'delay': 0.0, 'line': n}
+#   {'type': 'move', 'roll', 'pitch', 'throttle', 'yaw', 'duration': s, 'line': n,
+#    'distance': cm (linear moves) | 'angle': signed deg (rotations)}
+#   {'type': 'wait', 'duration': s, 'line': n}
+#   {'type': 'wait_marker', 'marker': id or None, 'timeout': s, 'line': n}
+#   {'type': 'led', 'command': text, 'delay': s, 'line': n}
+
+DEFAULT_SPEED = 50.0       # cm/s
+ROTATION_SPEED = 90.0      # deg/s
+MAX_STEPS = 1000
+MAX_LOOP_ITERATIONS = 1000
+MAX_CALL_DEPTH = 16
+# Programs come from the network and are evaluated on the request thread
+MAX_SOURCE_LENGTH = 200000   # characters
+MAX_OPERATIONS = 500000      # statements, expressions and sequence items processed
+MAX_COMPILE_SECONDS = 1.0    # wall clock, whatever the operation count
+MAX_INT_BITS = 128           # integer values
+MAX_SEQUENCE_LENGTH = 1000   # strings and lists
+MAX_STEP_SECONDS = 60.0      # longest single command
+MAX_PLAN_SECONDS = 900.0     # longest whole program
+MARKER_TIMEOUT = 10.0      # default filo.wait_for_marker() timeout, s
+
+MOVES = {
+    # name: (roll, pitch, throttle, yaw)
+    'move_up': (0, 0, 1500, 0),
+    'move_down': (0, 0, 1300, 0),
+    'move_forward': (0, 15, 1400, 0),
+    'move_back': (0, -15, 1400, 0),
+    'move_left': (-15, 0, 1400, 0),
+    'move_right': (15, 0, 1400, 0),
+}
+
+ROTATIONS = {
+    'rotate_clockwise': 20,
+    'rotate_counter_clockwise': -20,
+}
+
+SIMPLE_COMMANDS = {
+    'takeoff': ('takeoff', 3.0),
+    'land': ('land', 3.0),
+    'stop': ('hover', 1.0),
+    'emergency': ('emergency', 0.0),
+}
+
+LED_COMMANDS = {
+    'led_set_color': 1,
+    'led_set_rgb': 3,
+    'led_breathe': 4,
+    'led_flash': 4,
+}
+
+# Toolbox blocks the flight controller can't fly yet; skipped with a warning
+SKIPPED_COMMANDS = {
+    'flip': "flips are not supported",
+    'take_picture': "use the video recording controls instead",
+    'start_recording': "video is recorded from arming to disarming",
+    'stop_recording': "video is recorded from arming to disarming",
+    'go': "position moves are not supported, use the move blocks",
+    'curve': "curves are not supported, use the move blocks",
+}
+
+BINARY_OPS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: lambda a, b: a % b,
+    ast.Pow: lambda a, b: a ** b,
+}
+
+COMPARE_OPS = {
+    ast.Eq: lambda a, b: a == b,
+    ast.NotEq: lambda a, b: a != b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+}
+
+BUILTINS = {
+    'abs': abs, 'round': round, 'min': min, 'max': max,
+    'int': int, 'float': float,
+}
+
+MATH_FUNCTIONS = {
+    'sqrt': math.sqrt, 'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+    'floor': math.floor, 'ceil': math.ceil, 'fabs': math.fabs,
+    'log': math.log, 'log10': math.log10, 'exp': math.exp,
+}
+
+MATH_CONSTANTS = {'pi': math.pi, 'e': math.e}
+
+# Types a program may test with isinstance(); Blockly's math_change block
+# emits `x = (x if isinstance(x, Number) else 0) + 1` after `from numbers import Number`
+ISINSTANCE_TYPES = {'Number': numbers.Number, 'int': int, 'float': float, 'str': str, 'bool': bool}
+
+class CompileError(Exception):
+    """Program cannot be turned into a flight plan"""
+
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+
+    def __str__(self):
+        if self.line:
+            return f"Line {self.line}: {self.message}"
+        return self.message
+
+class FlightPlan(tuple):
+    """Compiled steps; `warnings` lists the blocks that were skipped"""
+    warnings = ()
+
+class _Return(Exception):
+    """Unwinds a procedure at its `return` statement"""
+
+    def __init__(self, value):
+        self.value = value
+
+class PlanCompiler:
+    """Walk the AST of one program and emit its flat step list"""
+
+    def __init__(self):
+        self.steps = []
+        self.speed = DEFAULT_SPEED
+        self.functions = {}
+        self.depth = 0
+        self.operations = 0
+        self.deadline = None
+        self.seconds = 0.0
+        self.warnings = []
+
+    def compile(self, source):
+        if len(source) > MAX_SOURCE_LENGTH:
+            raise CompileError(f"Program is longer than {MAX_SOURCE_LENGTH} characters")
+        self.deadline = time.monotonic() + MAX_COMPILE_SECONDS
+        try:
+            tree = ast.parse(source)
+            self.block(tree.body, {})
+        except SyntaxError as e:
+            raise CompileError(f"Syntax error: {e.msg}", e.lineno)
+        except (RecursionError, MemoryError):
+            raise CompileError("Program is too deeply nested")
+        plan = FlightPlan(self.steps)
+        plan.warnings = tuple(self.warnings)
+        return plan
+
+    # Statements
+    def block(self, body, env):
+        for node in body:
+            self.statement(node, env)
+
+    def statement(self, node, env):
+        self.charge(1, node.lineno)
+
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.Pass, ast.Global, ast.Nonlocal)):
+            return
+
+        if isinstance(node, ast.Expr):
+            if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+                return  # docstring / comment string
+            if isinstance(node.value, ast.Call):
+                self.call(node.value, env)
+                return
+            raise CompileError("Expression has no effect", node.lineno)
+
+        if isinstance(node, ast.Assign):
+            value = self.evaluate(node.value, env)
+            for target in node.targets:
+                if not isinstance(target, ast.Name):
+                    raise CompileError("Only simple variable assignment is supported", node.lineno)
+                env[target.id] = value
+            return
+
+        if isinstance(node, ast.AugAssign):
+            if not isinstance(node.target, ast.Name):
+                raise CompileError("Only simple variable assignment is supported", node.lineno)
+            if type(node.op) not in BINARY_OPS:
+                raise CompileError("Unsupported operator", node.lineno)
+            current = self.lookup(node.target.id, env, node.lineno)
+            env[node.target.id] = self.arith(type(node.op), current, self.evaluate(node.value, env),
+                                             node.lineno)
+            return
+
+        if isinstance(node, ast.For):
+            if not isinstance(node.target, ast.Name):
+                raise CompileError("Loop variable must be a simple name", node.lineno)
+            values = self.iterate(node.iter, env)
+            for value in values:
+                env[node.target.id] = value
+                self.block(node.body, env)
+            return
+
+        if isinstance(node, ast.While):
+            iterations = 0
+            while self.truth(node.test, env):
+                iterations += 1
+                if iterations > MAX_LOOP_ITERATIONS:
+                    raise CompileError(f"Loop runs more than {MAX_LOOP_ITERATIONS} times", node.lineno)
+                self.block(node.body, env)
+            return
+
+        if isinstance(node, ast.If):
+            if self.truth(node.test, env):
+                self.block(node.body, env)
+            else:
+                self.block(node.orelse, env)
+            return
+
+        if isinstance(node, ast.FunctionDef):
+            self.functions[node.name] = node
+            return
+
+        if isinstance(node, ast.Return):
+            if not self.depth:
+                raise CompileError("return outside a procedure", node.lineno)
+            raise _Return(self.evaluate(node.value, env) if node.value is not None else None)
+
+        raise CompileError(f"Unsupported statement: {type(node).__name__}", node.lineno)
+
+    def iterate(self, node, env):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id == 'range' and not node.keywords):
+            args = [self.evaluate(arg, env) for arg in node.args]
+            if not 1 <= len(args) <= 3 or not all(isinstance(a, (int, float)) and float(a).is_integer() for a in args):
+                raise CompileError("range() needs 1-3 whole numbers", node.lineno)
+            values = range(*[int(a) for a in args])
+        else:
+            values = self.evaluate(node, env)
+            if not isinstance(values, (list, tuple)):
+                raise CompileError("Can only loop over range() or a list", node.lineno)
+        if len(values) > MAX_LOOP_ITERATIONS:
+            raise CompileError(f"Loop runs more than {MAX_LOOP_ITERATIONS} times", node.lineno)
+        return values
+
+    # Calls
+    def call(self, node, env):
+        func = node.func
+        line = node.lineno
+
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+            owner, name = func.value.id, func.attr
+            if owner == 'filo':
+                self.filo_call(name, node, env)
+                return
+            if owner == 'time' and name == 'sleep':
+                (seconds,) = self.arguments(node, env, 1)
+                self.emit({'type': 'wait', 'duration': self.non_negative(seconds, line)}, line)
+                return
+
+        if isinstance(func, ast.Name) and func.id in self.functions:
+            self.procedure(self.functions[func.id], node, env)
+            return
+
+        if isinstance(func, ast.Name) and func.id == 'print':
+            return
+
+        raise CompileError(f"Unknown command: {ast.unparse(func)}()", line)
+
+    def filo_call(self, name, node, env):
+        line = node.lineno
+
+        if name in SIMPLE_COMMANDS:
+            self.arguments(node, env, 0)
+            step_type, delay = SIMPLE_COMMANDS[name]
+            self.emit({'type': step_type, 'delay': delay}, line)
+
+        elif name in MOVES:
+            (dist,) = self.arguments(node, env, 1)
+            roll, pitch, throttle, yaw = MOVES[name]
+            distance = self.non_negative(dist, line)
+            self.emit({'type': 'move', 'roll': roll, 'pitch': pitch, 'throttle': throttle,
+                       'yaw': yaw, 'duration': distance / self.speed, 'distance': distance}, line)
+
+        elif name in ROTATIONS:
+            (angle,) = self.arguments(node, env, 1)
+            angle = self.non_negative(angle, line)
+            yaw = ROTATIONS[name]
+            self.emit({'type': 'move', 'roll': 0, 'pitch': 0, 'throttle': 1400, 'yaw': yaw,
+                       'duration': angle / ROTATION_SPEED, 'angle': math.copysign(angle, yaw)}, line)
+
+        elif name == 'set_speed':
+            (speed,) = self.arguments(node, env, 1)
+            if not math.isfinite(speed) or speed <= 0:
+                raise CompileError("Speed must be positive", line)
+            self.speed = float(speed)
+
+        elif name == 'wait_for_marker':
+            # wait_for_marker([marker_id[, timeout]]); marker_id -1 = any marker
+            if len(node.args) > 2:
+                raise CompileError("filo.wait_for_marker() takes at most 2 arguments", line)
+            args = self.arguments(node, env, len(node.args))
+            if not all(math.isfinite(a) for a in args):
+                raise CompileError("Value must be a finite number", line)
+            marker = int(args[0]) if args and args[0] >= 0 else None
+            timeout = self.non_negative(args[1], line) if len(args) > 1 else MARKER_TIMEOUT
+            self.emit({'type': 'wait_marker', 'marker': marker, 'timeout': timeout}, line)
+
+        elif name in LED_COMMANDS:
+            args = self.arguments(node, env, LED_COMMANDS[name], numeric=False)
+            command = f"filo.{name}({', '.join(repr(a) for a in args)})"
+            self.emit({'type': 'led', 'command': command, 'delay': 0.1}, line)
+
+        elif name in SKIPPED_COMMANDS:
+            for arg in node.args:
+                self.evaluate(arg, env)
+            self.warnings.append(f"Line {line}: filo.{name}() skipped - {SKIPPED_COMMANDS[name]}")
+
+        else:
+            raise CompileError(f"filo.{name}() is not supported in flight programs", line)
+
+    def procedure(self, func, node, env):
+        if self.depth >= MAX_CALL_DEPTH:
+            raise CompileError("Procedures nested too deeply", node.lineno)
+        params = [arg.arg for arg in func.args.args]
+        args = self.arguments(node, env, len(params), numeric=False)
+        shared = {name for statement in func.body if isinstance(statement, ast.Global)
+                  for name in statement.names}
+        local_env = dict(env)
+        local_env.update(zip(params, args))
+        self.depth += 1
+        result = None
+        try:
+            self.block(func.body, local_env)
+        except _Return as ret:
+            result = ret.value
+        finally:
+            self.depth -= 1
+        # Blockly declares workspace variables `global` inside procedures
+        for name in shared:
+            if name in local_env:
+                env[name] = local_env[name]
+        return result
+
+    def arguments(self, node, env, count, numeric=True):
+        if node.keywords or len(node.args) != count:
+            raise CompileError(f"{ast.unparse(node.func)}() takes {count} argument(s)", node.lineno)
+        values = [self.evaluate(arg, env) for arg in node.args]
+        if numeric:
+            for value in values:
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    raise CompileError(f"{ast.unparse(node.func)}() needs numeric arguments", node.lineno)
+        return values
+
+    def emit(self, step, line):
+        if len(self.steps) >= MAX_STEPS:
+            raise CompileError(f"Program is longer than {MAX_STEPS} steps", line)
+        seconds = step.get('duration', 0.0) + step.get('delay', 0.0) + step.get('timeout', 0.0)
+        if seconds > MAX_STEP_SECONDS:
+            raise CompileError(f"A single command can last at most {MAX_STEP_SECONDS:g} s "
+                               f"(this one takes {seconds:.3g} s)", line)
+        self.seconds += seconds
+        if self.seconds > MAX_PLAN_SECONDS:
+            raise CompileError(f"Program flies longer than {MAX_PLAN_SECONDS / 60:.0f} minutes", line)
+        step['line'] = line
+        self.steps.append(step)
+
+    # Expressions
+    def evaluate(self, node, env):
+        line = getattr(node, 'lineno', None)
+        self.charge(1, line)
+
+        if isinstance(node, ast.Constant):
+            # Blockly declares every variable as `name = None`
+            if node.value is None or isinstance(node.value, (int, float, str, bool)):
+                return self.bounded(node.value, line)
+            raise CompileError(f"Unsupported value: {node.value!r}", line)
+
+        if isinstance(node, ast.Name):
+            if node.id in ('True', 'False'):
+                return node.id == 'True'
+            return self.lookup(node.id, env, line)
+
+        if isinstance(node, ast.BinOp):
+            if type(node.op) not in BINARY_OPS:
+                raise CompileError("Unsupported operator", line)
+            return self.arith(type(node.op), self.evaluate(node.left, env), self.evaluate(node.right, env), line)
+
+        if isinstance(node, ast.UnaryOp):
+            value = self.evaluate(node.operand, env)
+            try:
+                if isinstance(node.op, ast.USub):
+                    return -value
+                if isinstance(node.op, ast.UAdd):
+                    return +value
+            except (TypeError, ValueError, OverflowError) as e:
+                raise CompileError(str(e), line)
+            if isinstance(node.op, ast.Not):
+                return not value
+            raise CompileError("Unsupported operator", line)
+
+        if isinstance(node, ast.Compare):
+            left = self.evaluate(node.left, env)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.evaluate(comparator, env)
+                compare = COMPARE_OPS.get(type(op))
+                if compare is None:
+                    raise CompileError("Unsupported comparison", line)
+                self.charge(cost(left) + cost(right), line)
+                try:
+                    if not compare(left, right):
+                        return False
+                except TypeError as e:
+                    raise CompileError(str(e), line)
+                left = right
+            return True
+
+        if isinstance(node, ast.BoolOp):
+            # Short-circuit like Python: `x != None and x > 3` must not evaluate x > 3
+            deciding = not isinstance(node.op, ast.And)   # and stops on falsy, or on truthy
+            for operand in node.values:
+                value = self.evaluate(operand, env)
+                if bool(value) == deciding:
+                    return value
+            return value
+
+        if isinstance(node, ast.IfExp):
+            return self.evaluate(node.body if self.truth(node.test, env) else node.orelse, env)
+
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return [self.evaluate(e, env) for e in node.elts]
+
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            if node.value.id == 'math' and node.attr in MATH_CONSTANTS:
+                return MATH_CONSTANTS[node.attr]
+
+        if isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Name) and func.id in BUILTINS:
+                return self.apply(BUILTINS[func.id], node, env)
+            if isinstance(func, ast.Name) and func.id == 'isinstance':
+                return self.isinstance_check(node, env)
+            if isinstance(func, ast.Name) and func.id in self.functions:
+                return self.procedure(self.functions[func.id], node, env)
+            if (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name)
+                    and func.value.id == 'math' and func.attr in MATH_FUNCTIONS):
+                return self.apply(MATH_FUNCTIONS[func.attr], node, env)
+            if (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name)
+                    and func.value.id == 'filo'):
+                raise CompileError(f"filo.{func.attr}() reads live sensor data and cannot be used in a plan", line)
+
+        raise CompileError(f"Unsupported expression: {ast.unparse(node)}", line)
+
+    def apply(self, function, node, env):
+        if node.keywords:
+            raise CompileError("Keyword arguments are not supported", node.lineno)
+        args = [self.evaluate(arg, env) for arg in node.args]
+        self.charge(sum(cost(arg) for arg in args), node.lineno)
+        try:
+            return self.bounded(function(*args), node.lineno)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise CompileError(str(e), node.lineno)
+
+    def isinstance_check(self, node, env):
+        if node.keywords or len(node.args) != 2:
+            raise CompileError("isinstance() takes 2 arguments", node.lineno)
+        kinds = node.args[1]
+        names = kinds.elts if isinstance(kinds, ast.Tuple) else [kinds]
+        if not all(isinstance(name, ast.Name) and name.id in ISINSTANCE_TYPES for name in names):
+            raise CompileError(f"isinstance() supports only {', '.join(ISINSTANCE_TYPES)}", node.lineno)
+        value = self.evaluate(node.args[0], env)
+        return isinstance(value, tuple(ISINSTANCE_TYPES[name.id] for name in names))
+
+    def arith(self, op_type, left, right, line):
+        # Refuse results too big to compute quickly before computing them
+        if op_type is ast.Pow and isinstance(left, int) and isinstance(right, int) and right > 0:
+            if left.bit_length() * right > MAX_INT_BITS * 2 and abs(left) > 1:
+                raise CompileError("Number is too large", line)
+        if op_type is ast.Mult:
+            for sequence, count in ((left, right), (right, left)):
+                if (isinstance(sequence, (str, list)) and isinstance(count, int)
+                        and len(sequence) * count > MAX_SEQUENCE_LENGTH):
+                    raise CompileError(f"Text or list longer than {MAX_SEQUENCE_LENGTH}", line)
+                if isinstance(sequence, (str, list)) and isinstance(count, int):
+                    self.charge(cost(sequence) * max(count, 0), line)
+        self.charge(cost(left) + cost(right), line)
+        try:
+            return self.bounded(BINARY_OPS[op_type](left, right), line)
+        except ZeroDivisionError:
+            raise CompileError("Division by zero", line)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise CompileError(str(e), line)
+
+    def charge(self, units, line):
+        """Count work against the compile budget; raise once it is spent"""
+        self.operations += units
+        if self.operations > MAX_OPERATIONS or time.monotonic() > self.deadline:
+            raise CompileError("Program takes too long to compile", line)
+
+    def bounded(self, value, line):
+        if isinstance(value, int) and value.bit_length() > MAX_INT_BITS:
+            raise CompileError("Number is too large", line)
+        if isinstance(value, (str, list)) and len(value) > MAX_SEQUENCE_LENGTH:
+            raise CompileError(f"Text or list longer than {MAX_SEQUENCE_LENGTH}", line)
+        return value
+
+    def truth(self, node, env):
+        return bool(self.evaluate(node, env))
+
+    def lookup(self, name, env, line):
+        if name not in env:
+            raise CompileError(f"Variable '{name}' is used before it is set", line)
+        return env[name]
+
+    def non_negative(self, value, line):
+        if not math.isfinite(value):
+            raise CompileError("Value must be a finite number", line)
+        if value < 0:
+            raise CompileError("Value must not be negative", line)
+        return float(value)
+
+def cost(value):
+    """Work units to copy or compare `value`: its items, recursively"""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, list):
+        return len(value) + sum(cost(item) for item in value if isinstance(item, (str, list)))
+    return 0
+
+def compile_program(source):
+    """Compile Blockly-generated Python into a FlightPlan (tuple of steps)"""
+    return PlanCompiler().compile(source)
+
+# -------------------------
+# Plan cache
+# -------------------------
+class PlanCache:
+    """LRU cache of compiled plans keyed by the SHA-256 of the source"""
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, source):
+        """Return (plan_id, plan, cached); raises CompileError"""
+        plan_id = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        with self.lock:
+            plan = self.plans.get(plan_id)
+            if plan is not None:
+                self.plans.move_to_end(plan_id)
+                self.hits += 1
+                return plan_id, plan, True
+            self.misses += 1
+
+        plan = compile_program(source)
+
+        with self.lock:
+            self.plans[plan_id] = plan
+            self.plans.move_to_end(plan_id)
+            while len(self.plans) > self.capacity:
+                self.plans.popitem(last=False)
+        return plan_id, plan, False
+
+    def stats(self):
+        return {"size": len(self.plans), "hits": self.hits, "misses": self.misses}
+
+# -------------------------
+# Timeline
+# -------------------------
+# A plan is expanded into absolute-offset events before a run starts:
+#   (offset_s, data, priority, key, step_index)
+# `data` is the pre-encoded serial line, or None for a step-start marker
+# (key None) or a gate (key = (name, *args)): the scheduler holds the
+# timeline on a gate until its wait function returns, shifting every later
+# deadline by the time spent waiting.
+TAKEOFF_ARM_DELAY = 2.0
+RAMP_INTERVAL = 0.1
+
+def build_timeline(plan, rate_hz=50, armed=False, profile=None):
+    """Expand a flight plan into a sorted list of timed serial events
+
+    With a calibration `profile` (closed_loop.CalibrationProfile) the plan
+    runs closed loop: rotations and horizontal moves become 'rotate' and
+    'move' gates that end on integrated telemetry, and vertical moves are
+    timed from the profile's climb speeds.
+    """
+    period = 1.0 / rate_hz
+    encoded = {}
+    events = []
+    t = 0.0
+
+    def cmd(roll, pitch, throttle, yaw):
+        key = (roll, pitch, throttle, yaw)
+        data = encoded.get(key)
+        if data is None:
+            data = f"CMD,{roll:.2f},{pitch:.2f},{throttle:.0f},{yaw:.2f}\n".encode("utf-8")
+            encoded[key] = data
+        return data
+
+    for index, step in enumerate(plan):
+        events.append((t, None, None, None, index))
+        kind = step['type']
+
+        if kind == 'takeoff':
+            if not armed:
+                events.append((t, b"ARM\n", PRIORITY_CONTROL, None, index))
+                t += TAKEOFF_ARM_DELAY
+                armed = True
+            for throttle in range(1000, 1500, 50):
+                events.append((t, cmd(0, 0, throttle, 0), PRIORITY_COMMAND, "cmd", index))
+                t += RAMP_INTERVAL
+            t += step['delay']
+
+        elif kind == 'land':
+            for throttle in range(1400, 1000, -50):
+                events.append((t, cmd(0, 0, throttle, 0), PRIORITY_COMMAND, "cmd", index))
+                t += RAMP_INTERVAL
+            # Queued behind the last landing setpoint
+            events.append((t, b"DISARM\n", PRIORITY_COMMAND, None, index))
+            armed = False
+            t += step['delay']
+
+        elif kind == 'move' and profile and ('angle' in step or step['roll'] or step['pitch']):
+            if 'angle' in step:
+                gate = ('rotate', step['angle'], step['yaw'], profile.timeout(step))
+            else:
+                gate = ('move', step['roll'], step['pitch'], step['throttle'],
+                        step['distance'], profile.timeout(step))
+            events.append((t, None, None, gate, index))
+            events.append((t, cmd(0, 0, step['throttle'], 0), PRIORITY_COMMAND, "cmd", index))
+
+        elif kind == 'move':
+            data = cmd(step['roll'], step['pitch'], step['throttle'], step['yaw'])
+            duration = profile.duration(step) if profile else step['duration']
+            ticks = max(1, int(duration * rate_hz))
+            for tick in range(ticks):
+                events.append((t + tick * period, data, PRIORITY_COMMAND, "cmd", index))
+            t += ticks * period
+            # Return to hover
+            events.append((t, cmd(0, 0, step['throttle'], 0), PRIORITY_COMMAND, "cmd", index))
+
+        elif kind == 'hover':
+            events.append((t, cmd(0, 0, 1400, 0), PRIORITY_COMMAND, "cmd", index))
+            t += step['delay']
+
+        elif kind == 'emergency':
+            events.append((t, b"DISARM\n", PRIORITY_EMERGENCY, None, index))
+            break
+
+        elif kind == 'wait':
+            t += step['duration']
+
+        elif kind == 'wait_marker':
+            events.append((t, cmd(0, 0, 1400, 0), PRIORITY_COMMAND, "cmd", index))
+            events.append((t, None, None, ('marker', step['marker'], step['timeout']), index))
+
+        elif kind == 'led':
+            # LED commands are not implemented on the flight controller yet
+            t += step['delay']
+
+    events.append((t, None, None, None, len(plan)))
+    return events
+
+class TimelineScheduler:
+    """Play a timeline against absolute time.monotonic() deadlines
+
+    Deadlines are offsets from the run start, so sleep overshoot never
+    accumulates. Waiting is done on an Event, which makes `cancel()` take
+    effect immediately rather than at the end of the current sleep. The
+    Event can be passed in (`cancelled`) so it can be set before the run.
+    """
+
+    def __init__(self, link, rate_hz=50, gates=None, cancelled=None):
+        self.link = link
+        self.period = 1.0 / rate_hz
+        self.gates = gates or {}  # name -> wait(*args, cancelled=Event)
+        self.cancelled = cancelled or threading.Event()
+        self.stats = None
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self, timeline, on_step=None):
+        lateness = []
+        missed = 0
+        held_total = 0.0
+        run_start = start = time.monotonic()
+
+        for offset, data, priority, key, step in timeline:
+            deadline = start + offset
+            delay = deadline - time.monotonic()
+            if delay > 0 and self.cancelled.wait(delay):
+                break
+            if self.cancelled.is_set():
+                break
+
+            late = time.monotonic() - deadline
+            lateness.append(late)
+            if late > self.period:
+                missed += 1
+
+            if data is None:
+                if key is not None:
+                    held = time.monotonic()
+                    self.hold(key)
+                    held = time.monotonic() - held
+                    start += held
+                    held_total += held
+                elif on_step:
+                    on_step(step)
+                continue
+            self.link.send(data, priority, key=key, purge=priority == PRIORITY_EMERGENCY)
+
+        lateness.sort()
+        count = len(lateness)
+        self.stats = {
+            "events": count,
+            "planned_s": round(timeline[-1][0], 3) if timeline else 0.0,
+            "elapsed_s": round(time.monotonic() - run_start, 3),
+            "held_s": round(held_total, 3),
+            "jitter_ms": {
+                "avg": round(sum(lateness) / count * 1000, 3) if count else 0.0,
+                "p99": round(lateness[min(count - 1, int(count * 0.99))] * 1000, 3) if count else 0.0,
+                "max": round(lateness[-1] * 1000, 3) if count else 0.0
+            },
+            "missed_deadlines": missed,
+            "cancelled": self.cancelled.is_set()
+        }
+        return self.stats
+
+    def hold(self, gate):
+        """Wait on a gate event; an unknown gate (e.g. no camera) passes at once"""
+        name, *args = gate
+        wait = self.gates.get(name)
+        if wait is None:
+            print(f"[WARN] No '{name}' gate available, continuing")
+            return
+        wait(*args, cancelled=self.cancelled)
@@ -0,0 +1,233 @@
+"""Program jobs: a bounded queue per drone and one worker that runs them
+
+/run submits a compiled flight plan as a job instead of starting a thread,
+so programs never overlap on the serial link. Each job has its own cancel
+Event, handed to the timeline scheduler, so cancelling, preempting or an
+emergency stop reaches the running job within one control tick - even if
+it is set before the job got to its first step.
+"""
+import time, itertools, threading
+from collections import deque, OrderedDict
+
+MAX_QUEUED = 8       # programs waiting behind the running one
+KEEP_FINISHED = 32   # finished jobs kept for GET /jobs/<id>
+
+class QueueFull(Exception):
+    """The drone's program queue has no room for another job"""
+
+class ProgramJob:
+    """One submitted program and its progress"""
+
+    def __init__(self, job_id, commands, mode, plan_id=None):
+        self.id = job_id
+        self.commands = commands
+        self.mode = mode
+        self.plan_id = plan_id
+        self.status = "queued"   # queued, running, completed, stopped, cancelled, preempted, failed
+        self.reason = None       # why a job did not complete
+        self.step = 0            # 1-based step being flown, 0 before the first
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.duration = None     # planned seconds, known once the timeline is built
+        self.step_offsets = []   # planned start of each step, seconds into the run
+        self.step_started = None
+        self.stats = None
+        self.cancelled = threading.Event()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def cancel(self, reason):
+        if not self.finished:
+            self.reason = reason
+            self.cancelled.set()
+
+    def start(self, duration, step_offsets):
+        """Called by the executor once the timeline is built"""
+        self.duration = duration
+        self.step_offsets = step_offsets
+
+    def on_step(self, index):
+        """Called by the executor as step `index` (0-based) begins"""
+        self.step = min(index + 1, len(self.commands))
+        self.step_started = time.monotonic()
+
+    def eta(self):
+        """Seconds until the job should finish, from the plan and the current step
+
+        Closed-loop steps end on telemetry, so time inside a step is capped at
+        its planned length rather than trusted to keep the plan's pace.
+        """
+        if self.status != "running" or self.duration is None or not self.step_offsets:
+            return None
+        if self.step == 0 or self.step_started is None:
+            return round(self.duration, 2)
+        offset = self.step_offsets[self.step - 1]
+        step_end = self.step_offsets[self.step] if self.step < len(self.step_offsets) else self.duration
+        in_step = min(time.monotonic() - self.step_started, step_end - offset)
+        return round(max(0.0, self.duration - offset - in_step), 2)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "reason": self.reason,
+            "mode": self.mode,
+            "plan_id": self.plan_id,
+            "step": self.step,
+            "total": len(self.commands),
+            "duration_s": round(self.duration, 2) if self.duration is not None else None,
+            "eta_s": self.eta(),
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "stats": self.stats
+        }
+
+class JobQueue:
+    """Bounded FIFO of programs for one drone, run one at a time by a worker thread
+
+    `run(job)` flies a job and returns its scheduler stats. `on_busy()` is
+    called when a job is submitted and `on_idle()` when the worker has
+    nothing left to run, both under the queue lock so they can't cross.
+    """
+
+    def __init__(self, run, on_busy, on_idle, publish, max_queued=MAX_QUEUED, keep=KEEP_FINISHED):
+        self.run = run
+        self.on_busy = on_busy
+        self.on_idle = on_idle
+        self.publish = publish   # publish(state, **fields) for program events
+        self.max_queued = max_queued
+        self.keep = keep
+        self.queue = deque()
+        self.active = None
+        self.jobs = OrderedDict()   # id -> job, queued, running and recent
+        self.ids = itertools.count(1)
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    @property
+    def busy(self):
+        return self.active is not None or bool(self.queue)
+
+    def submit(self, commands, mode, plan_id=None, preempt=False):
+        """Queue a program; with `preempt` it runs next and the active job is stopped"""
+        with self.cond:
+            if len(self.queue) >= self.max_queued and not preempt:
+                raise QueueFull(f"Program queue is full ({self.max_queued} waiting)")
+            job = ProgramJob(next(self.ids), commands, mode, plan_id)
+            self.jobs[job.id] = job
+            self._trim()
+            if preempt:
+                self.queue.appendleft(job)
+                self._preempt_active(job)
+            else:
+                self.queue.append(job)
+            position = self.queue.index(job)
+            self.on_busy()
+            self.cond.notify()
+        self.publish("queued", job=job.id, position=position, total=len(commands))
+        return job
+
+    def cancel(self, job_id, reason="cancelled"):
+        """Cancel a queued or running job; returns it, or None if unknown"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            if job in self.queue:
+                self.queue.remove(job)
+                self._finish(job, "cancelled", reason)
+                self._idle_if_empty()
+                return job
+        job.cancel(reason)   # the worker finishes it within one tick
+        return job
+
+    def preempt(self, job_id):
+        """Move a queued job to the front and stop the active one for it"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job not in self.queue:
+                return job
+            self.queue.remove(job)
+            self.queue.appendleft(job)
+            self._preempt_active(job)
+            self.cond.notify()
+        return job
+
+    def stop_all(self, reason):
+        """Emergency: drop everything queued and stop the active job"""
+        with self.cond:
+            queued, self.queue = list(self.queue), deque()
+            for job in queued:
+                self._finish(job, "cancelled", reason)
+            if queued:
+                self._idle_if_empty()
+            active = self.active
+        if active:
+            active.cancel(reason)
+        return active
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def snapshot(self):
+        with self.cond:
+            return {
+                "active": self.active.to_dict() if self.active else None,
+                "queued": [job.to_dict() for job in self.queue],
+                "recent": [job.to_dict() for job in reversed(self.jobs.values()) if job.finished],
+                "max_queued": self.max_queued
+            }
+
+    def _preempt_active(self, job):
+        if self.active:
+            self.active.cancel(f"preempted by job {job.id}")
+
+    def _finish(self, job, status, reason=None):
+        job.status = status
+        job.reason = reason if status != "completed" else None
+        job.finished_at = time.time()
+        if status in ("cancelled", "failed") and job.started_at is None:
+            self.publish(status, job=job.id, reason=reason)
+
+    def _idle_if_empty(self):
+        """Report idle once nothing is queued or running; call under self.cond"""
+        if not self.queue and self.active is None:
+            self.on_idle()
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue)
+                job = self.queue.popleft()
+                self.active = job
+                job.status = "running"
+                job.started_at = time.time()
+
+            try:
+                job.stats = self.run(job)
+                if not job.cancelled.is_set():
+                    status = "completed"
+                elif job.reason and job.reason.startswith("preempted"):
+                    status = "preempted"
+                else:
+                    status = "stopped"
+            except Exception as e:
+                print(f"[ERROR] Program job {job.id} failed: {e}")
+                job.reason = str(e)
+                status = "failed"
+                self.publish("failed", job=job.id, reason=job.reason)
+
+            with self.cond:
+                self._finish(job, status, job.reason)
+                self.active = None
+                self._idle_if_empty()
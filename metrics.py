@@ -0,0 +1,271 @@
+"""Prometheus metrics and an on-demand sampling profiler
+
+/metrics renders everything in the Prometheus text format: request latency
+histograms for the hot routes, plus gauges and counters read from the stats
+the serial link, video broadcaster, executor and recorder already keep.
+Nothing is scraped in the background; values are collected per request.
+
+The profiler samples every thread's stack with sys._current_frames() and
+returns collapsed stacks ("frame;frame;frame count" per line), which
+flamegraph.pl, speedscope and inferno read directly.
+"""
+import re, sys, time, bisect, threading
+from collections import Counter
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STEP_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+# -------------------------
+# Metric types
+# -------------------------
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """Cumulative-bucket histogram family with one series per label set"""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def time(self, *label_values):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, label_values)
+
+    def render(self, out):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} histogram")
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                out.append(f"{self.name}_bucket{format_labels(dict(labels, le=bound))} {cumulative}")
+            out.append(f"{self.name}_bucket{format_labels(dict(labels, le='+Inf'))} {values[-2]}")
+            out.append(f"{self.name}_count{format_labels(labels)} {values[-2]}")
+            out.append(f"{self.name}_sum{format_labels(labels)} {format_value(values[-1])}")
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+class MetricsText:
+    """Builder for gauges and counters; groups samples under one HELP/TYPE"""
+
+    def __init__(self):
+        self.families = {}  # name -> (type, help, [(labels, value)])
+
+    def add(self, kind, name, help, value, **labels):
+        family = self.families.setdefault(name, (kind, help, []))
+        family[2].append((labels, value))
+
+    def gauge(self, name, help, value, **labels):
+        self.add("gauge", name, help, value, **labels)
+
+    def counter(self, name, help, value, **labels):
+        self.add("counter", name, help, value, **labels)
+
+    def render(self, out):
+        for name, (kind, help, samples) in self.families.items():
+            out.append(f"# HELP {name} {help}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                out.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+class RateTracker:
+    """Per-second rates of ever-growing totals, measured between scrapes
+
+    A rate is recomputed once at least `window` seconds have passed since
+    the last sample; a total that went backwards (a reopened link starts
+    its counters again) counts from zero.
+    """
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.samples = {}  # key -> (time, total, rate)
+        self.lock = threading.Lock()
+
+    def rate(self, key, total):
+        now = time.monotonic()
+        with self.lock:
+            previous = self.samples.get(key)
+            if previous is None:
+                self.samples[key] = (now, total, None)
+                return None
+            then, last_total, rate = previous
+            if now - then >= self.window:
+                rate = (total - (last_total if total >= last_total else 0)) / (now - then)
+                self.samples[key] = (now, total, rate)
+            return rate
+
+# -------------------------
+# Collection
+# -------------------------
+THREAD_NAME_RE = re.compile(r"\((\w+)\)$")
+
+def thread_groups():
+    """Live threads counted by their target function (or name)"""
+    groups = Counter()
+    for thread in threading.enumerate():
+        match = THREAD_NAME_RE.search(thread.name)
+        groups[match.group(1) if match else thread.name] += 1
+    return groups
+
+def collect_fleet(metrics, fleet, rates):
+    """Serial link, telemetry, video, executor and recorder metrics per drone"""
+    now = time.monotonic()
+    for drone in fleet:
+        d = drone.id
+        metrics.gauge("filo_serial_connected", "Serial link to the flight controller is up",
+                      drone.ready.is_set(), drone=d)
+        metrics.counter("filo_serial_reconnects_total", "Serial link reconnects", drone.init["reconnects"], drone=d)
+
+        reader = drone.reader
+        if reader:
+            stats = reader.stats()
+            metrics.counter("filo_serial_bytes_in_total", "Bytes read from the current link",
+                            stats["bytes_in"], drone=d)
+            metrics.gauge("filo_serial_bytes_in_per_second", "Bytes read per second",
+                          rates.rate((d, "bytes_in"), stats["bytes_in"]), drone=d)
+            metrics.counter("filo_telem_lines_total", "TELEM lines parsed on the current link",
+                            stats["telem_lines"], drone=d)
+            metrics.gauge("filo_telem_per_second", "TELEM lines parsed per second",
+                          rates.rate((d, "telem"), stats["telem_lines"]), drone=d)
+            metrics.counter("filo_telem_parse_failures_total", "TELEM lines that failed to parse",
+                            stats["parse_failures"], drone=d)
+            metrics.gauge("filo_serial_binary_protocol", "Link negotiated binary CMD/TELEM frames",
+                          stats["protocol"] == "binary", drone=d)
+            metrics.counter("filo_serial_crc_errors_total", "Binary frames dropped for a bad CRC or header",
+                            stats["crc_errors"], drone=d)
+            metrics.counter("filo_telem_frames_lost_total", "Binary TELEM frames missing from the sequence",
+                            stats["seq_gaps"], drone=d)
+            metrics.gauge("filo_telem_age_seconds", "Time since the last TELEM line",
+                          now - reader.last_telem if reader.last_telem else None, drone=d)
+
+        stats = drone.writer.stats()
+        metrics.counter("filo_serial_bytes_out_total", "Bytes written to the flight controller",
+                        stats["bytes_out"], drone=d)
+        metrics.gauge("filo_serial_bytes_out_per_second", "Bytes written per second",
+                      rates.rate((d, "bytes_out"), stats["bytes_out"]), drone=d)
+        metrics.counter("filo_serial_lines_written_total", "Lines written", stats["written"], drone=d)
+        metrics.counter("filo_serial_lines_coalesced_total", "Queued lines replaced by a newer one",
+                        stats["coalesced"], drone=d)
+        metrics.counter("filo_serial_lines_dropped_total", "Lines dropped while the link was down",
+                        stats["dropped"], drone=d)
+        metrics.gauge("filo_serial_write_queue_depth", "Lines waiting for the writer", stats["queue_depth"], drone=d)
+        metrics.gauge("filo_serial_write_latency_p99_seconds", "Queue-to-port latency, p99 of recent lines",
+                      stats["write_latency_ms"]["p99"] / 1000, drone=d)
+
+        stats = drone.video.stats()
+        metrics.gauge("filo_video_subscribers", "Active /video_feed clients", stats["subscribers"], drone=d)
+        metrics.counter("filo_video_frames_total", "Frames published", stats["frames"], drone=d)
+        metrics.gauge("filo_video_fps", "Frames published per second",
+                      rates.rate((d, "frames"), stats["frames"]), drone=d)
+        metrics.gauge("filo_video_jpeg_quality", "Current adaptive JPEG quality", stats["quality"], drone=d)
+        metrics.gauge("filo_video_capture_seconds", "Capture and encode time, average of recent frames",
+                      stats["capture_ms"] / 1000 if stats["capture_ms"] is not None else None, drone=d)
+
+        run = drone.executor.last_run
+        metrics.gauge("filo_program_running", "An autonomous program is running", drone.executor.running, drone=d)
+        if run:
+            metrics.gauge("filo_program_last_jitter_seconds", "Deadline lateness of the last program, p99",
+                          run["jitter_ms"]["p99"] / 1000, drone=d)
+            metrics.gauge("filo_program_last_missed_deadlines", "Events of the last program later than one tick",
+                          run["missed_deadlines"], drone=d)
+            metrics.gauge("filo_program_last_elapsed_seconds", "Wall time of the last program",
+                          run["elapsed_s"], drone=d)
+
+        if drone.recorder:
+            stats = drone.recorder.stats()
+            metrics.counter("filo_recorder_records_total", "Flight log records written",
+                            stats["records"], drone=d)
+
+def collect_process(metrics):
+    metrics.gauge("filo_threads", "Live threads", threading.active_count())
+    for name, count in sorted(thread_groups().items()):
+        metrics.gauge("filo_threads_by_target", "Live threads by target function", count, target=name)
+
+# -------------------------
+# Sampling profiler
+# -------------------------
+class SamplingProfiler:
+    """Samples every thread's Python stack at a fixed interval
+
+    Only one profile runs at a time; `profile()` returns None while another
+    is in progress.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    def profile(self, seconds):
+        """Collapsed stacks for `seconds` of sampling, one "stack count" per line"""
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            stacks = Counter()
+            names = {}
+            me = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            next_due = time.monotonic()
+            while next_due < deadline:
+                for thread in threading.enumerate():
+                    names[thread.ident] = thread.name
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        stacks[self._collapse(names.get(ident, str(ident)), frame)] += 1
+                next_due += self.interval
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        frames.append(thread_name.replace(";", ":"))
+        return ";".join(reversed(frames))
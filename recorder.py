@@ -0,0 +1,228 @@
+import os, mmap, time, shutil, struct, threading
+
+# -------------------------
+# Binary flight log format
+# -------------------------
+# Each segment file is a fixed header followed by fixed-width records,
+# preallocated and memory-mapped so appending is a single pack_into.
+#
+# Header (32 bytes): magic, version, record size, capacity, count, start time
+# Record (32 bytes): kind, flags, reserved, time, five float32 values
+#   TELEM   roll, pitch, yaw_rate, battery_voltage, battery_percent  (flags bit0 = armed)
+#   CMD     roll, pitch, throttle, yaw, 0
+#   ARM / DISARM / EMERGENCY  no values
+#   CONNECTION  no values, flags = index into CONNECTION_STATES
+MAGIC = b"FILOLOG1"
+HEADER = struct.Struct("<8sHHIId4x")
+RECORD = struct.Struct("<BBHd5f")
+
+KIND_TELEM = 1
+KIND_CMD = 2
+KIND_ARM = 3
+KIND_DISARM = 4
+KIND_EMERGENCY = 5
+KIND_CONNECTION = 6
+
+CONNECTION_STATES = ("disconnected", "connected", "warning", "error")
+
+LINE_KINDS = {b"ARM": KIND_ARM, b"DISARM": KIND_DISARM}
+
+SEGMENT_RECORDS = 65536
+MAX_SEGMENTS = 8
+
+class LogSegment:
+    """One preallocated, memory-mapped segment file"""
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        size = HEADER.size + capacity * RECORD.size
+        with open(path, "wb") as f:
+            f.truncate(size)
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.start = time.time()
+        HEADER.pack_into(self.map, 0, MAGIC, 1, RECORD.size, capacity, 0, self.start)
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, kind, flags, t, values):
+        RECORD.pack_into(self.map, HEADER.size + self.count * RECORD.size, kind, flags, 0, t, *values)
+        self.count += 1
+        # Count is in the header so a crash leaves a readable file
+        struct.pack_into("<I", self.map, 16, self.count)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+# -------------------------
+# Recorder
+# -------------------------
+class FlightRecorder:
+    """Append every TELEM sample and outgoing command to a binary log
+
+    Records go to `<log_dir>/<session>/NNNN.flog` segments of
+    `segment_records` records each; once `max_segments` exist the oldest is
+    deleted, bounding disk and mapped memory (see `session_bytes()`).
+    """
+
+    def __init__(self, log_dir="logs", segment_records=SEGMENT_RECORDS, max_segments=MAX_SEGMENTS,
+                 session=None):
+        self.session = session or time.strftime("%Y%m%d-%H%M%S")
+        self.directory = os.path.join(log_dir, self.session)
+        os.makedirs(self.directory, exist_ok=True)
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        self.segment = None
+        self.segment_index = 0
+        self.records = 0
+        self._rotate()
+
+    def _rotate(self):
+        if self.segment:
+            self.segment.close()
+            self.segment_index += 1
+        path = os.path.join(self.directory, f"{self.segment_index:04d}.flog")
+        self.segment = LogSegment(path, self.segment_records)
+
+        old = self.segment_index - self.max_segments
+        if old >= 0:
+            try:
+                os.remove(os.path.join(self.directory, f"{old:04d}.flog"))
+            except OSError:
+                pass
+
+    def _append(self, kind, flags, values):
+        t = time.time()
+        with self.lock:
+            if self.segment is None:
+                return
+            if self.segment.full:
+                self._rotate()
+            self.segment.append(kind, flags, t, values)
+            self.records += 1
+
+    def record_telem(self, values):
+        """Record a parsed TELEM tuple (see serial_link.parse_telem)"""
+        roll, pitch, yaw_rate, voltage, percent, armed = values
+        self._append(KIND_TELEM, 1 if armed else 0, (roll, pitch, yaw_rate, voltage, percent))
+
+    def record_output(self, data):
+        """Record a line written to the flight controller"""
+        if data.startswith(b"CMD,"):
+            parts = data.split(b",")
+            try:
+                values = (float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4]), 0.0)
+            except (IndexError, ValueError):
+                return
+            self._append(KIND_CMD, 0, values)
+        else:
+            kind = LINE_KINDS.get(data.strip())
+            if kind:
+                self._append(kind, 0, (0.0, 0.0, 0.0, 0.0, 0.0))
+
+    def record_emergency(self):
+        self._append(KIND_EMERGENCY, 0, (0.0, 0.0, 0.0, 0.0, 0.0))
+
+    def record_connection(self, state):
+        """Record a change of the telemetry "connection" state"""
+        if state in CONNECTION_STATES:
+            self._append(KIND_CONNECTION, CONNECTION_STATES.index(state), (0.0, 0.0, 0.0, 0.0, 0.0))
+
+    def close(self):
+        with self.lock:
+            if self.segment:
+                self.segment.close()
+                self.segment = None
+
+    def stats(self):
+        return {
+            "session": self.session,
+            "records": self.records,
+            "segment": self.segment_index
+        }
+
+# -------------------------
+# Reading and replay
+# -------------------------
+def session_bytes(segment_records=SEGMENT_RECORDS, max_segments=MAX_SEGMENTS):
+    """Most disk one recorder session can use"""
+    return max_segments * (HEADER.size + segment_records * RECORD.size)
+
+def prune_sessions(log_dir, quota_bytes):
+    """Delete the oldest sessions until `log_dir` fits in `quota_bytes`
+
+    Run it before any recorder opens a session: it can't tell a finished
+    session from one that is still being written.
+    """
+    if not os.path.isdir(log_dir):
+        return
+    sessions = []
+    total = 0
+    for name in sorted(os.listdir(log_dir)):
+        path = os.path.join(log_dir, name)
+        if os.path.isdir(path):
+            size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            sessions.append((path, size))
+            total += size
+    for path, size in sessions:
+        if total <= quota_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        print(f"[OK] Flight log {os.path.basename(path)} deleted to stay under the log quota")
+
+def session_segments(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(".flog"))
+
+def read_segment(path):
+    """Return (start_time, raw record bytes) for one segment file"""
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        magic, version, record_size, capacity, count, start = HEADER.unpack(header)
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a flight log")
+        return start, f.read(count * RECORD.size)
+
+def iter_records(directory):
+    """Yield (kind, flags, time, values) for every record of a session"""
+    for path in session_segments(directory):
+        start, data = read_segment(path)
+        for kind, flags, _, t, *values in RECORD.iter_unpack(data):
+            yield kind, flags, t, values
+
+def telem_line(flags, values):
+    """Rebuild the TELEM line a record was parsed from"""
+    roll, pitch, yaw_rate, voltage, percent = values
+    return (f"TELEM,{roll:.2f},{pitch:.2f},{yaw_rate:.2f},0,{voltage:.2f},"
+            f"{int(percent)},{flags & 1}").encode("utf-8")
+
+def replay(directory, reader, speed=None):
+    """Feed a recorded session's TELEM stream back through a SerialReader
+
+    `reader.handle()` is the same path live serial lines take. With
+    `speed` set (1.0 = real time) the original spacing is reproduced,
+    otherwise lines are replayed as fast as possible.
+    """
+    first = None
+    wall_start = time.monotonic()
+    replayed = 0
+    for kind, flags, t, values in iter_records(directory):
+        if kind != KIND_TELEM:
+            continue
+        if speed:
+            if first is None:
+                first = t
+            delay = (t - first) / speed - (time.monotonic() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        reader.handle(telem_line(flags, values))
+        replayed += 1
+    return replayed
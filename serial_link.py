@@ -0,0 +1,435 @@
+import os, re, io, time, heapq, struct, itertools, threading, selectors
+from collections import deque
+from binary_protocol import FrameDecoder, FRAME_TELEM, HANDSHAKE_OK, decode_telem
+
+# -------------------------
+# Transport
+# -------------------------
+def open_transport(port, baudrate=250000, timeout=1):
+    """Open the flight controller link
+
+    `port` is a device path, any pyserial URL (loop://, socket://, ...), or
+    sim:// for the built-in simulated flight controller.
+    """
+    if port == "sim" or port.startswith("sim://"):
+        from simulator import open_simulated
+        return open_simulated(port)
+    import serial
+    if "://" in port:
+        return serial.serial_for_url(port, baudrate, timeout=timeout)
+    return serial.Serial(port, baudrate, timeout=timeout)
+
+# -------------------------
+# Line framing
+# -------------------------
+class LineFramer:
+    """Split a byte stream into lines using a single growing bytearray
+
+    Complete lines are sliced out in one pass and the consumed prefix is
+    dropped once per feed, so bursts of many lines stay linear.
+    """
+
+    def __init__(self, max_line=1024):
+        self.buffer = bytearray()
+        self.max_line = max_line
+
+    def feed(self, data):
+        self.buffer += data
+        lines = []
+        start = 0
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end < 0:
+                break
+            line = bytes(self.buffer[start:end]).strip()
+            if line:
+                lines.append(line)
+            start = end + 1
+        if start:
+            del self.buffer[:start]
+        if len(self.buffer) > self.max_line:
+            # Garbage without newlines (baud mismatch, noise) - resync
+            self.buffer.clear()
+        return lines
+
+    def reset(self):
+        self.buffer.clear()
+
+# -------------------------
+# TELEM parsing
+# -------------------------
+# TELEM,roll,pitch,yaw_rate,<unused>,voltage,battery_percent,armed[,...]
+_NUM = rb'\s*(-?(?:\d+\.?\d*|\.\d+))\s*'
+TELEM_RE = re.compile(
+    rb'TELEM,' + _NUM + rb',' + _NUM + rb',' + _NUM + rb',[^,]*,' + _NUM +
+    rb',\s*(\d+(?:\.\d*)?)\s*,\s*([^,]*?)\s*(?:,|$)'
+)
+
+def parse_telem(line):
+    """Parse a TELEM line; return (roll, pitch, yaw_rate, voltage, percent, armed) or None"""
+    match = TELEM_RE.match(line)
+    if not match:
+        return None
+    roll, pitch, yaw, volt, bat, arm_flag = match.groups()
+    return (float(roll), float(pitch), float(yaw), float(volt),
+            int(float(bat)), arm_flag == b"1")
+
+# -------------------------
+# Serial reader
+# -------------------------
+class SerialReader:
+    """Blocking reader thread delivering each line as soon as it arrives
+
+    `port.read()` blocks until at least one byte is available (up to the
+    port timeout), then everything already buffered is drained in one call.
+    TELEM lines go to `on_telem` with parsed values, every other line is
+    decoded and passed to `on_line`.
+
+    With `negotiate` the stream is framed by binary_protocol.FrameDecoder,
+    which switches to binary TELEM frames right after the firmware's
+    handshake answer; frames are decoded to the same values as TELEM lines.
+    """
+
+    def __init__(self, port, on_telem, on_line, on_error=None, negotiate=False):
+        self.port = port
+        self.on_telem = on_telem
+        self.on_line = on_line
+        self.on_error = on_error
+        self.framer = FrameDecoder() if negotiate else LineFramer()
+        self.protocol = "text"
+        self.lines = 0
+        self.telem_lines = 0
+        self.parse_failures = 0
+        self.seq_gaps = 0       # binary TELEM frames lost, from sequence numbers
+        self._telem_seq = None
+        self.bytes_in = 0
+        self.last_telem = None  # monotonic time of the last TELEM line
+        self.lines_per_sec = 0.0
+        self._window_start = time.monotonic()
+        self._window_lines = 0
+        self.running = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        """Stop after the current read; the port itself is left to the caller"""
+        self.running = False
+
+    def run(self):
+        while self.running:
+            try:
+                self.feed(self.port.read(self.port.in_waiting or 1))
+            except Exception as e:
+                self.fail(e)
+                if self.running:
+                    time.sleep(1)
+
+    def feed(self, data):
+        """Frame and dispatch one chunk read from the port"""
+        if data:
+            self.bytes_in += len(data)
+            for item in self.framer.feed(data):
+                if isinstance(item, tuple):
+                    self.handle_frame(*item)
+                else:
+                    self.handle(item)
+        self._update_rate()
+
+    def fail(self, error):
+        print(f"[WARN] Serial read error: {error}")
+        self.framer.reset()
+        if self.on_error:
+            self.on_error(error)
+
+    def handle(self, line):
+        self.lines += 1
+        self._window_lines += 1
+
+        if line.startswith(b"TELEM,"):
+            values = parse_telem(line)
+            if values is None:
+                self.parse_failures += 1
+                print(f"[WARN] Telemetry parse error: {line[:60]!r}")
+                return
+            self.telem_lines += 1
+            self.last_telem = time.monotonic()
+            self.on_telem(values)
+        else:
+            line = line.decode("utf-8", errors="ignore")
+            if line == HANDSHAKE_OK and isinstance(self.framer, FrameDecoder):
+                # The firmware's next byte may already be a frame
+                self.framer.binary = True
+                self.protocol = "binary"
+            self.on_line(line)
+
+    def handle_frame(self, frame_type, seq, payload):
+        if frame_type != FRAME_TELEM:
+            self.parse_failures += 1
+            return
+        try:
+            values = decode_telem(payload)
+        except struct.error:
+            self.parse_failures += 1
+            return
+        if self._telem_seq is not None:
+            self.seq_gaps += (seq - self._telem_seq - 1) & 0xFF
+        self._telem_seq = seq
+        self.lines += 1
+        self._window_lines += 1
+        self.telem_lines += 1
+        self.last_telem = time.monotonic()
+        self.on_telem(values)
+
+    def _update_rate(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.lines_per_sec = round(self._window_lines / elapsed, 1)
+            self._window_lines = 0
+            self._window_start = now
+
+    def stats(self):
+        self._update_rate()
+        return {
+            "lines": self.lines,
+            "telem_lines": self.telem_lines,
+            "lines_per_sec": self.lines_per_sec,
+            "parse_failures": self.parse_failures,
+            "bytes_in": self.bytes_in,
+            "protocol": self.protocol,
+            "frames": getattr(self.framer, "frames", 0),
+            "crc_errors": getattr(self.framer, "crc_errors", 0),
+            "seq_gaps": self.seq_gaps
+        }
+
+# -------------------------
+# Shared reader thread
+# -------------------------
+class SerialMux:
+    """One thread reading every port that has a file descriptor
+
+    Ports are registered with a selector and only read when the OS reports
+    data, so any number of links costs a single blocked thread instead of a
+    polling loop each. Ports without a usable fileno() (sim://, socket://
+    and other pyserial URLs, Windows COM ports) get their reader's own
+    blocking thread instead.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+        self.readers = 0
+        self.thread = None
+
+    def add(self, reader):
+        """Serve `reader` from the shared thread; returns False if it got its own"""
+        try:
+            fd = reader.port.fileno()
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            fd = None
+        if fd is None or os.name == "nt":
+            reader.start()
+            return False
+        with self.lock:
+            self.pending.append((fd, reader))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        # The selector is only touched by the mux thread; wake it to register
+        os.write(self.wake_w, b"\0")
+        return True
+
+    def _register(self):
+        try:
+            os.read(self.wake_r, 512)
+        except BlockingIOError:
+            pass
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for fd, reader in pending:
+            if fd in self.selector.get_map():
+                # A reopened port can reuse the fd of a stopped reader
+                self.selector.unregister(fd)
+                self.readers -= 1
+            self.selector.register(fd, selectors.EVENT_READ, reader)
+            self.readers += 1
+
+    def run(self):
+        while True:
+            for key, _ in self.selector.select():
+                reader = key.data
+                if reader is None:
+                    self._register()
+                    continue
+                if not reader.running:
+                    self.selector.unregister(key.fd)
+                    self.readers -= 1
+                    continue
+                try:
+                    data = reader.port.read(reader.port.in_waiting or 1)
+                    if not data:
+                        raise OSError("port readable but returned no data (disconnected?)")
+                    reader.feed(data)
+                except Exception as e:
+                    # A port that errors while readable would spin; drop it
+                    self.selector.unregister(key.fd)
+                    self.readers -= 1
+                    reader.fail(e)
+
+    def stats(self):
+        return {"shared_readers": self.readers}
+
+# -------------------------
+# Serial writer
+# -------------------------
+PRIORITY_EMERGENCY = 0   # DISARM / emergency stop
+PRIORITY_CONTROL = 1     # ARM and other one-shot control lines
+PRIORITY_COMMAND = 2     # CMD setpoints
+PRIORITY_STATUS = 3      # STATUS polls
+
+class SerialWriter:
+    """Single thread that owns writes to the serial port
+
+    Lines are queued by priority (lowest value first, FIFO within a level).
+    Lines sent with a `key` coalesce: a newer line replaces a queued one with
+    the same key that has not been written yet. Emergency lines skip the
+    throughput cap and can purge everything still queued. While no port is
+    attached (link down, reconnecting) lines are dropped.
+
+    A line sent with a `trace` (see tracing.py) is reported to `on_trace`
+    with the perf_counter() time it was written.
+
+    Once the link negotiated the binary protocol, `encoder` (a
+    binary_protocol.FrameEncoder) turns CMD lines into frames as they are
+    written, so sequence numbers follow write order; `on_write` still sees
+    the text line.
+    """
+
+    def __init__(self, port, max_bytes_per_sec=20000, on_write=None, on_trace=None):
+        self.port = port
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.on_write = on_write
+        self.on_trace = on_trace
+        self.encoder = None
+        self.queue = []
+        self.pending = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.bytes_out = 0
+        self.latencies = deque(maxlen=256)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def attach(self, port):
+        """Write to `port` from now on (None to drop lines); clears the queue
+
+        A new link starts on the text protocol until it negotiates again.
+        """
+        with self.cond:
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.pending.clear()
+            self.port = port
+            self.encoder = None
+
+    def send(self, data, priority=PRIORITY_COMMAND, key=None, purge=False, trace=None):
+        """Queue a line for the writer thread"""
+        now = time.monotonic()
+        with self.cond:
+            if purge:
+                self.queue.clear()
+                self.pending.clear()
+            if key is not None and key in self.pending:
+                entry = self.pending[key]
+                entry[3] = data
+                entry[4] = now
+                entry[5] = trace
+                self.coalesced += 1
+                return
+            entry = [priority, next(self.counter), key, data, now, trace]
+            heapq.heappush(self.queue, entry)
+            if key is not None:
+                self.pending[key] = entry
+            self.cond.notify()
+
+    def write(self, data):
+        """File-like helper so the writer can stand in for the port"""
+        self.send(data)
+
+    def run(self):
+        budget = float(self.max_bytes_per_sec)
+        last = time.monotonic()
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue)
+                entry = heapq.heappop(self.queue)
+                if entry[2] is not None:
+                    self.pending.pop(entry[2], None)
+            priority, _, _, data, queued_at, trace = entry
+            encoder = self.encoder
+            out = encoder.encode_line(data) if encoder else data
+
+            # Token bucket throughput cap (emergency lines bypass it)
+            if self.max_bytes_per_sec:
+                now = time.monotonic()
+                budget = min(self.max_bytes_per_sec, budget + (now - last) * self.max_bytes_per_sec)
+                last = now
+                if priority != PRIORITY_EMERGENCY and budget < len(out):
+                    time.sleep((len(out) - budget) / self.max_bytes_per_sec)
+                    budget = len(out)
+                    last = time.monotonic()
+                budget -= len(out)
+
+            port = self.port
+            if port is None:
+                self.dropped += 1
+                continue
+            try:
+                port.write(out)
+            except Exception as e:
+                print(f"[WARN] Serial write error: {e}")
+                continue
+            self.written += 1
+            self.bytes_out += len(out)
+            self.latencies.append(time.monotonic() - queued_at)
+            if self.on_write:
+                self.on_write(data)
+            if trace is not None and self.on_trace:
+                self.on_trace(trace, time.perf_counter())
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        if latencies:
+            avg_ms = sum(latencies) / len(latencies) * 1000
+            p99_ms = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            max_ms = latencies[-1] * 1000
+        else:
+            avg_ms = p99_ms = max_ms = 0.0
+        return {
+            "queue_depth": len(self.queue),
+            "written": self.written,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "bytes_out": self.bytes_out,
+            "frames": self.encoder.frames if self.encoder else 0,
+            "write_latency_ms": {
+                "avg": round(avg_ms, 2),
+                "p99": round(p99_ms, 2),
+                "max": round(max_ms, 2)
+            }
+        }
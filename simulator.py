@@ -0,0 +1,301 @@
+import math, os, time, threading
+from urllib.parse import urlparse, parse_qs
+from binary_protocol import (FrameDecoder, FRAME_CMD, PROTOCOL_VERSION, HANDSHAKE_OK, decode_cmd,
+                             encode_telem)
+
+# -------------------------
+# Virtual flight controller
+# -------------------------
+class SimulatedFlightController:
+    """Very small quadcopter model speaking the Arduino's line protocol
+
+    Consumes ARM / DISARM / STATUS / CMD,roll,pitch,throttle,yaw lines and
+    produces the same replies and TELEM lines as the real firmware. With
+    `ack_commands` every CMD line is answered with "ACK,CMD". With
+    `binary_protocol` it accepts the binary protocol handshake, after which
+    the transport exchanges CMD and TELEM as frames. Attitude
+    follows the setpoint with a first-order lag, tilt accelerates the body
+    in the horizontal plane, and throttle above hover lifts it.
+    """
+
+    ATTITUDE_TAU = 0.15     # s, attitude response time constant
+    YAW_TAU = 0.1           # s
+    YAW_RATE_GAIN = 4.5     # deg/s per CMD yaw unit
+    HOVER_THROTTLE = 1400   # PWM that holds altitude
+    CLIMB_GAIN = 0.5        # cm/s^2 per PWM above hover
+    DRAG = 5.0              # 1/s, horizontal velocity damping
+    VERTICAL_DRAG = 1.5     # 1/s
+    GRAVITY = 981.0         # cm/s^2
+    CELL_FULL = 4.2
+    CELL_EMPTY = 3.3
+    CELLS = 2
+
+    def __init__(self, ack_commands=False, binary_protocol=True):
+        self.ack_commands = ack_commands
+        self.binary_protocol = binary_protocol
+        self.binary = False    # handshake accepted; TELEM goes out as frames
+        self.armed = False
+        self.setpoint = (0.0, 0.0, 1000.0, 0.0)   # roll, pitch, throttle, yaw
+        self.roll = 0.0
+        self.pitch = 0.0
+        self.yaw_rate = 0.0
+        self.heading = 0.0
+        self.x = self.y = self.z = 0.0            # cm, z up
+        self.vx = self.vy = self.vz = 0.0
+        self.charge = 1.0
+        self.voltage = self.CELL_FULL * self.CELLS
+        self.sim_time = 0.0
+        self.commands = 0
+
+    def handle_line(self, line):
+        """Apply one command line; return reply lines (str, no newline)"""
+        line = line.strip()
+        if line.startswith("CMD,"):
+            parts = line.split(',')
+            if len(parts) >= 5:
+                try:
+                    self.setpoint = tuple(float(p) for p in parts[1:5])
+                    self.commands += 1
+                except ValueError:
+                    pass
+            return ["ACK,CMD"] if self.ack_commands else []
+        if line == f"PROTO,{PROTOCOL_VERSION}" and self.binary_protocol:
+            self.binary = True
+            return [HANDSHAKE_OK]
+        if line == "ARM":
+            if self.setpoint[2] > 1100:
+                return ["❌ Pre-arm checks FAILED: throttle not at minimum"]
+            self.armed = True
+            return ["✅ Motors ARMED"]
+        if line == "DISARM":
+            self.armed = False
+            self.setpoint = (0.0, 0.0, 1000.0, 0.0)
+            return ["Motors DISARMED"]
+        if line == "STATUS":
+            return [self.telem_line()]
+        return []
+
+    def handle_cmd(self, roll, pitch, throttle, yaw):
+        """Apply a decoded binary CMD frame; returns reply lines like handle_line"""
+        self.setpoint = (roll, pitch, throttle, yaw)
+        self.commands += 1
+        return ["ACK,CMD"] if self.ack_commands else []
+
+    def step(self, dt):
+        """Advance the model by `dt` simulated seconds"""
+        self.sim_time += dt
+        roll_sp, pitch_sp, throttle, yaw_sp = self.setpoint
+        if not self.armed:
+            roll_sp = pitch_sp = yaw_sp = 0.0
+            throttle = 1000.0
+
+        a = 1.0 - math.exp(-dt / self.ATTITUDE_TAU)
+        self.roll += (roll_sp - self.roll) * a
+        self.pitch += (pitch_sp - self.pitch) * a
+        yaw_sp *= self.YAW_RATE_GAIN
+        self.yaw_rate += (yaw_sp - self.yaw_rate) * (1.0 - math.exp(-dt / self.YAW_TAU))
+        self.heading = (self.heading + self.yaw_rate * dt) % 360.0
+
+        airborne = self.z > 0.0 or throttle > self.HOVER_THROTTLE
+        if airborne:
+            h = math.radians(self.heading)
+            fwd = self.GRAVITY * math.tan(math.radians(self.pitch))
+            side = self.GRAVITY * math.tan(math.radians(self.roll))
+            ax = fwd * math.cos(h) - side * math.sin(h) - self.DRAG * self.vx
+            ay = fwd * math.sin(h) + side * math.cos(h) - self.DRAG * self.vy
+            az = (throttle - self.HOVER_THROTTLE) * self.CLIMB_GAIN - self.VERTICAL_DRAG * self.vz
+            self.vx += ax * dt
+            self.vy += ay * dt
+            self.vz += az * dt
+            self.x += self.vx * dt
+            self.y += self.vy * dt
+            self.z += self.vz * dt
+        if self.z <= 0.0:
+            self.z = 0.0
+            self.vx = self.vy = self.vz = 0.0
+
+        # Battery: slow drain with throttle, voltage sags under load
+        load = max(0.0, throttle - 1000.0) / 1000.0 if self.armed else 0.0
+        self.charge = max(0.0, self.charge - dt * (0.0002 + 0.002 * load))
+        cell = self.CELL_EMPTY + (self.CELL_FULL - self.CELL_EMPTY) * self.charge
+        self.voltage = self.CELLS * (cell - 0.25 * load)
+
+    def telem_frame(self, seq):
+        return encode_telem(seq, self.roll, self.pitch, self.yaw_rate, self.voltage,
+                            int(self.charge * 100), self.armed)
+
+    def telem_line(self):
+        return (f"TELEM,{self.roll:.2f},{self.pitch:.2f},{self.yaw_rate:.2f},{self.z:.1f},"
+                f"{self.voltage:.2f},{int(self.charge * 100)},{1 if self.armed else 0}")
+
+    def state(self):
+        return {
+            "time": round(self.sim_time, 3),
+            "armed": self.armed,
+            "position_cm": [round(self.x, 1), round(self.y, 1), round(self.z, 1)],
+            "heading": round(self.heading, 1),
+            "battery_voltage": round(self.voltage, 2),
+            "commands": self.commands
+        }
+
+# -------------------------
+# Serial transport
+# -------------------------
+class SimulatedSerial:
+    """pyserial-compatible port backed by a SimulatedFlightController
+
+    A background thread steps the model and emits TELEM lines at
+    `telem_hz`; `time_scale` > 1 runs the model faster than real time.
+    Input is framed like the firmware does it: text lines, plus binary CMD
+    frames once the model accepted the handshake.
+    """
+
+    def __init__(self, fc=None, telem_hz=50, time_scale=1.0, timeout=1.0):
+        self.fc = fc or SimulatedFlightController()
+        self.telem_hz = telem_hz
+        self.time_scale = time_scale
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.decoder = FrameDecoder()
+        self.telem_seq = 0
+        self.cond = threading.Condition()
+        self.is_open = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def read(self, size=1):
+        with self.cond:
+            self.cond.wait_for(lambda: self.buffer or not self.is_open, self.timeout)
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+    def write(self, data):
+        replies = []
+        with self.cond:
+            self.decoder.binary = self.fc.binary
+            for item in self.decoder.feed(data):
+                if isinstance(item, tuple):
+                    frame_type, _, payload = item
+                    if frame_type == FRAME_CMD and len(payload) == 8:
+                        replies.extend(self.fc.handle_cmd(*decode_cmd(payload)))
+                else:
+                    replies.extend(self.fc.handle_line(item.decode("utf-8", errors="ignore")))
+                self.decoder.binary = self.fc.binary
+            self._emit(replies)
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self.cond:
+            self.buffer.clear()
+
+    def close(self):
+        with self.cond:
+            self.is_open = False
+            self.cond.notify_all()
+
+    MAX_BUFFER = 65536   # like a UART overflow, oldest bytes are lost
+
+    def _emit(self, lines, frame=None):
+        if lines or frame:
+            self.buffer += "".join(line + "\n" for line in lines).encode("utf-8")
+            if frame:
+                self.buffer += frame
+            if len(self.buffer) > self.MAX_BUFFER:
+                del self.buffer[:len(self.buffer) - self.MAX_BUFFER]
+            self.cond.notify_all()
+
+    def _run(self):
+        period = 1.0 / self.telem_hz
+        next_due = time.monotonic()
+        while self.is_open:
+            next_due += period
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self.cond:
+                self.fc.step(period * self.time_scale)
+                if self.fc.binary:
+                    self._emit([], self.fc.telem_frame(self.telem_seq))
+                    self.telem_seq = (self.telem_seq + 1) & 0xFF
+                else:
+                    self._emit([self.fc.telem_line()])
+
+def open_simulated(url):
+    """Open a SimulatedSerial from a `sim://?telem_hz=50&time_scale=1&ack=0&binary=1` spec
+
+    binary=0 simulates firmware that only speaks the text protocol.
+    """
+    query = parse_qs(urlparse(url).query)
+    return SimulatedSerial(
+        fc=SimulatedFlightController(ack_commands=query.get("ack", ["0"])[0] == "1",
+                                     binary_protocol=query.get("binary", ["1"])[0] == "1"),
+        telem_hz=float(query.get("telem_hz", [50])[0]),
+        time_scale=float(query.get("time_scale", [1.0])[0])
+    )
+
+# -------------------------
+# Faster-than-real-time plan runs
+# -------------------------
+def simulate_plan(plan, rate_hz=50, dt=0.01):
+    """Fly a compiled plan against a fresh virtual FC without sleeping
+
+    Returns the final model state plus the number of serial lines the plan
+    produced, so plans and throughput can be checked in CI.
+    """
+    from flight_plan import build_timeline
+
+    fc = SimulatedFlightController()
+    lines = 0
+    bytes_out = 0
+    max_altitude = 0.0
+    for offset, data, priority, key, step in build_timeline(plan, rate_hz):
+        while fc.sim_time + dt <= offset:
+            fc.step(dt)
+            max_altitude = max(max_altitude, fc.z)
+        if data is not None:
+            lines += 1
+            bytes_out += len(data)
+            fc.handle_line(data.decode("utf-8"))
+
+    result = fc.state()
+    result.update({
+        "lines": lines,
+        "bytes_out": bytes_out,
+        "max_altitude_cm": round(max_altitude, 1)
+    })
+    return result
+
+def run_pty(telem_hz=50, time_scale=1.0):
+    """Serve the simulator on a pseudo-terminal for an out-of-process app"""
+    import pty, tty
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    print(f"[SIM] Simulated flight controller on {os.ttyname(slave)}")
+    print(f"[SIM] Start the server with FILO_SERIAL={os.ttyname(slave)}")
+
+    port = SimulatedSerial(telem_hz=telem_hz, time_scale=time_scale)
+
+    def pump_out():
+        while True:
+            data = port.read(port.in_waiting or 1)
+            if data:
+                os.write(master, data)
+
+    threading.Thread(target=pump_out, daemon=True).start()
+    while True:
+        port.write(os.read(master, 1024))
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulated Filo flight controller")
+    parser.add_argument("--telem-hz", type=float, default=50)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    args = parser.parse_args()
+    run_pty(args.telem_hz, args.time_scale)
@@ -0,0 +1,93 @@
+import os, json, time, threading
+
+# Versions restart at 0 with the process; the boot id keeps a cached body
+# from before a restart from matching a new snapshot's ETag
+BOOT_ID = f"{time.time_ns():x}-{os.getpid():x}"
+
+# -------------------------
+# Immutable telemetry snapshots
+# -------------------------
+class TelemetrySnapshot:
+    """One consistent telemetry state; never modified after creation
+
+    Every change produces a new snapshot with the next `version`, so a
+    reader holding one always sees roll, pitch and armed from the same
+    update. The JSON encoding is computed once on first use and shared by
+    every response, stream and socket that sends this version.
+    """
+
+    FIELDS = ("roll", "pitch", "yaw_rate", "battery_voltage", "battery_percent",
+              "armed", "altitude", "connection", "vision")
+    __slots__ = FIELDS + ("version", "timestamp", "_json")
+
+    def __init__(self, version, timestamp, values):
+        set_field = object.__setattr__
+        for name in self.FIELDS:
+            set_field(self, name, values[name])
+        set_field(self, "version", version)
+        set_field(self, "timestamp", timestamp)
+        set_field(self, "_json", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TelemetrySnapshot is immutable")
+
+    def __getitem__(self, name):
+        # Lets existing telemetry["roll"] style reads keep working
+        if name not in self.FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self.FIELDS else default
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @property
+    def json(self):
+        """Encoded JSON bytes (cached); includes version and timestamp"""
+        encoded = self._json
+        if encoded is None:
+            payload = self.as_dict()
+            payload["version"] = self.version
+            payload["timestamp"] = self.timestamp
+            encoded = json.dumps(payload).encode("utf-8")
+            # Racing readers compute identical bytes, so no lock is needed
+            object.__setattr__(self, "_json", encoded)
+        return encoded
+
+    @property
+    def etag(self):
+        return f'"t{BOOT_ID}-{self.version}"'
+
+    def replace(self, **changes):
+        values = self.as_dict()
+        values.update(changes)
+        return TelemetrySnapshot(self.version + 1, time.time(), values)
+
+class TelemetryState:
+    """Holds the current snapshot; readers take `current` without locking
+
+    Writers swap in a new snapshot under a lock (the serial reader, request
+    threads and the watchdog all update it); rebinding one attribute is
+    atomic, so readers never wait and never see a partial update.
+    """
+
+    def __init__(self, **values):
+        self.lock = threading.Lock()
+        self.current = TelemetrySnapshot(0, time.time(), values)
+
+    def update(self, **changes):
+        """Swap in a snapshot with `changes` applied; returns it"""
+        with self.lock:
+            self.current = self.current.replace(**changes)
+            return self.current
+
+    def update_if_changed(self, **changes):
+        """Like `update`, but returns None (and keeps the version) if nothing differs"""
+        with self.lock:
+            current = self.current
+            if all(getattr(current, name) == value for name, value in changes.items()):
+                return None
+            self.current = current.replace(**changes)
+            return self.current
@@ -22,6 +22,14 @@ Blockly.defineBlocksWithJsonArray([
   { "type": "photo", "message0": "📸 Take Photo", "previousStatement": null, "nextStatement": null, "colour": "#9C27B0" },
   { "type": "record_start", "message0": "🎥 Start Recording", "previousStatement": null, "nextStatement": null, "colour": "#9C27B0" },
   { "type": "record_stop", "message0": "⏹️ Stop Recording", "previousStatement": null, "nextStatement": null, "colour": "#9C27B0" },
+  { "type": "wait_marker", "message0": "👁️ Wait for Marker %1 up to %2 s",
+    "args0": [
+      {"type":"field_number","name":"ID","value":0,"min":-1,"max":49},
+      {"type":"field_number","name":"TIMEOUT","value":10,"min":1,"max":60}
+    ],
+    "previousStatement": null, "nextStatement": null, "colour": "#9C27B0",
+    "tooltip": "Hover until the camera sees this ArUco marker (-1 = any marker)"
+  },
 
   { "type": "setspeed", "message0": "⚙️ Set Speed %1 cm/s", "args0": [{"type":"field_number","name":"SPD","value":50,"min":10,"max":100}], "previousStatement": null, "nextStatement": null, "colour": "#03A9F4" },
   { "type": "go", "message0": "📍 Go to X:%1 Y:%2 Z:%3 Speed:%4",
@@ -5,6 +5,9 @@
 // ============================================
 
 document.addEventListener('DOMContentLoaded', () => {
+    // API prefix of the drone this page controls (/drones/<id>)
+    const API = window.DRONE_BASE || '';
+
     // State management
     let armed = false;
     let connectionOk = false;
@@ -99,7 +102,7 @@ document.addEventListener('DOMContentLoaded', () => {
             updateConnectionStatus();
         }, 500);
 
-        fetch('/joystick', {
+        fetch(API + '/joystick', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(command)
@@ -120,6 +123,9 @@ document.addEventListener('DOMContentLoaded', () => {
                     const throttle = Math.round(data.sent.throttle);
                     document.getElementById('throttle-display').innerText = throttle;
                 }
+                if (data.trace) {
+                    traceReply(data.trace);
+                }
                 if (data.telemetry) {
                     updateTelemetry(data.telemetry);
                 }
@@ -132,17 +138,167 @@ document.addEventListener('DOMContentLoaded', () => {
             });
     }
 
+    // ============================================
+    // WEBSOCKET CONTROL CHANNEL (HTTP fallback)
+    // ============================================
+    let controlSocket = null;
+    let socketReady = false;
+    let commandSeq = 0;
+    let reconnectDelay = 500;
+    let pingInterval = null;
+
+    function connectControlSocket() {
+        if (!('WebSocket' in window)) return;
+
+        const scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+        const ws = new WebSocket(scheme + location.host + API + '/ws');
+
+        ws.onopen = () => {
+            controlSocket = ws;
+            socketReady = true;
+            reconnectDelay = 500;
+            connectionOk = true;
+            updateConnectionStatus();
+            console.log('🔌 Control WebSocket connected');
+            stopTelemetryStream();
+
+            // Measure round-trip latency once per second
+            if (pingInterval) clearInterval(pingInterval);
+            pingInterval = setInterval(() => {
+                if (socketReady) {
+                    ws.send(JSON.stringify({ t: 'ping', ts: performance.now() }));
+                }
+            }, 1000);
+        };
+
+        ws.onmessage = (event) => {
+            let msg;
+            try {
+                msg = JSON.parse(event.data);
+            } catch (err) {
+                return;
+            }
+
+            if (msg.t === 'telem') {
+                updateTelemetry(msg.telemetry);
+            } else if (msg.t === 'ack') {
+                if (msg.status === 'ok' && msg.sent) {
+                    document.getElementById('throttle-display').innerText = Math.round(msg.sent.throttle);
+                }
+                if (msg.trace) {
+                    traceReply(msg.trace);
+                }
+            } else if (msg.t === 'pong' && typeof msg.ts === 'number') {
+                const rtt = performance.now() - msg.ts;
+                updateLatency(rtt);
+                ws.send(JSON.stringify({ t: 'rtt', ms: rtt }));
+            }
+        };
+
+        ws.onclose = () => {
+            socketReady = false;
+            controlSocket = null;
+            if (pingInterval) clearInterval(pingInterval);
+            updateLatency(null);
+            startTelemetryStream();
+            // Keep retrying with backoff; HTTP /joystick is used meanwhile
+            setTimeout(connectControlSocket, reconnectDelay);
+            reconnectDelay = Math.min(reconnectDelay * 2, 5000);
+        };
+
+        ws.onerror = () => {
+            ws.close();
+        };
+    }
+
+    function sendStick(command) {
+        commandSeq++;
+        controlSocket.send(JSON.stringify({
+            t: 'stick',
+            seq: commandSeq,
+            roll: command.roll,
+            pitch: command.pitch,
+            yaw: command.yaw,
+            throttle: command.throttle,
+            trace: command.trace
+        }));
+    }
+
+    function updateLatency(rtt) {
+        const latencyDisplay = document.getElementById('latency-display');
+        if (!latencyDisplay) return;
+        latencyDisplay.textContent = rtt === null ? '--ms' : Math.round(rtt) + 'ms';
+    }
+
+    connectControlSocket();
+
+    // ============================================
+    // LATENCY TRACING (opt-in: /filo?trace=1)
+    // ============================================
+    // Each input carries an id and send time; the server echoes them, and the
+    // round trip is reported with the next input (see tracing.py)
+    const TRACE = !!window.LATENCY_TRACE;
+    const traceClient = Math.random().toString(36).slice(2, 10);
+    let traceSeq = 0;
+    let traceRtt = null;
+
+    function traceField(loopMs) {
+        const field = { c: traceClient, id: ++traceSeq, ts: performance.now(), loop_ms: loopMs };
+        if (traceRtt) {
+            field.prev = traceRtt.id;
+            field.rtt_ms = traceRtt.ms;
+            traceRtt = null;
+        }
+        return field;
+    }
+
+    function traceReply(trace) {
+        if (trace.c === traceClient && typeof trace.ts === 'number') {
+            traceRtt = { id: trace.id, ms: performance.now() - trace.ts };
+        }
+    }
+
+    function showTraceStats() {
+        fetch(API + '/trace')
+            .then(res => res.json())
+            .then(data => {
+                const p50 = (stage) => {
+                    const ms = data.stages[stage].p50_ms;
+                    return ms === null ? '--' : ms.toFixed(1);
+                };
+                document.getElementById('trace-display').textContent =
+                    `loop ${p50('client_loop')} · net ${p50('network')} · srv ${p50('server')} · fc ${p50('fc_ack')} ms`;
+            })
+            .catch(() => {});
+    }
+
+    if (TRACE) {
+        document.getElementById('trace-row').style.display = '';
+        setInterval(showTraceStats, 2000);
+    }
+
     // ============================================
     // CONTINUOUS COMMAND LOOP (20Hz)
     // ============================================
+    const COMMAND_PERIOD = 50;  // Send every 50ms = 20Hz
+
     function startCommandLoop() {
         if (commandInterval) clearInterval(commandInterval);
+        let lastTick = performance.now();
 
         commandInterval = setInterval(() => {
+            const now = performance.now();
+            const loopMs = Math.max(0, now - lastTick - COMMAND_PERIOD);
+            lastTick = now;
             if (armed) {
-                sendCommand(joystickState);
+                const command = TRACE ? Object.assign({ trace: traceField(loopMs) }, joystickState) : joystickState;
+                if (socketReady) {
+                    sendStick(command);
+                } else {
+                    sendCommand(command);
+                }
             }
-        }, 50);  // Send every 50ms = 20Hz
+        }, COMMAND_PERIOD);
     }
 
     // Start loop immediately
@@ -164,7 +320,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         if (confirm('⚠️ ARM MOTORS?\n\nMAKE SURE:\n- Drone is on flat surface\n- Area is clear\n- Props are secure\n- Battery is charged\n- Throttle is at MINIMUM')) {
-            fetch('/arm', { method: 'POST' })
+            fetch(API + '/arm', { method: 'POST' })
                 .then(res => res.json())
                 .then(data => {
                     if (data.status === 'ok') {
@@ -188,7 +344,7 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     disarmButton.addEventListener('click', () => {
-        fetch('/disarm', { method: 'POST' })
+        fetch(API + '/disarm', { method: 'POST' })
             .then(res => res.json())
             .then(data => {
                 armed = false;
@@ -316,25 +472,50 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // ============================================
-    // PERIODIC TELEMETRY REQUEST
+    // TELEMETRY STREAM (SSE while the WebSocket is down)
     // ============================================
-    setInterval(() => {
-        fetch('/telemetry')
-            .then(res => res.json())
-            .then(data => {
-                updateTelemetry(data);
+    let telemetryStream = null;
+
+    function startTelemetryStream() {
+        if (telemetryStream || !('EventSource' in window)) return;
+
+        telemetryStream = new EventSource(API + '/events?max_hz=10');
+        telemetryStream.addEventListener('telemetry', (event) => {
+            updateTelemetry(JSON.parse(event.data));
+        });
+        telemetryStream.onerror = () => {
+            connectionOk = false;
+            updateConnectionStatus();
+        };
+    }
+
+    function stopTelemetryStream() {
+        if (telemetryStream) {
+            telemetryStream.close();
+            telemetryStream = null;
+        }
+    }
 
-                // Check if telemetry is stale
-                if (Date.now() - lastTelemetryUpdate > 2000) {
+    startTelemetryStream();
+
+    setInterval(() => {
+        // Telemetry is pushed (WebSocket or SSE); poll only without EventSource
+        if (!socketReady && !('EventSource' in window)) {
+            fetch(API + '/telemetry')
+                .then(res => res.json())
+                .then(data => updateTelemetry(data))
+                .catch(err => {
+                    console.error('Telemetry fetch failed:', err);
                     connectionOk = false;
                     updateConnectionStatus();
-                }
-            })
-            .catch(err => {
-                console.error('Telemetry fetch failed:', err);
-                connectionOk = false;
-                updateConnectionStatus();
-            });
+                });
+        }
+
+        // Check if telemetry is stale
+        if (Date.now() - lastTelemetryUpdate > 2000) {
+            connectionOk = false;
+            updateConnectionStatus();
+        }
     }, 500);
 
     // ============================================
@@ -397,7 +578,7 @@ document.addEventListener('DOMContentLoaded', () => {
         // Check for triple tap
         if (tapCount === 3) {
             if (armed) {
-                fetch('/disarm', { method: 'POST' });
+                fetch(API + '/disarm', { method: 'POST' });
                 showAlert('🚨 EMERGENCY DISARM - TRIPLE TAP!', 'error');
 
                 // Visual feedback
@@ -430,7 +611,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // ============================================
     // INITIAL STATUS CHECK
     // ============================================
-    fetch('/status')
+    fetch(API + '/status')
         .then(res => res.json())
         .then(data => {
             armed = data.armed;
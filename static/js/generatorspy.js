@@ -25,6 +25,8 @@ python.pythonGenerator.forBlock['flip_right'] = (block, generator) => 'filo.flip
 python.pythonGenerator.forBlock['photo'] = (block, generator) => 'filo.take_picture()\n';
 python.pythonGenerator.forBlock['record_start'] = (block, generator) => 'filo.start_recording()\n';
 python.pythonGenerator.forBlock['record_stop'] = (block, generator) => 'filo.stop_recording()\n';
+python.pythonGenerator.forBlock['wait_marker'] = (block, generator) =>
+  `filo.wait_for_marker(${block.getFieldValue('ID')}, ${block.getFieldValue('TIMEOUT')})\n`;
 
 // Speed + Path
 python.pythonGenerator.forBlock['setspeed'] = (block, generator) => `filo.set_speed(${block.getFieldValue('SPD')})\n`;
@@ -3,17 +3,17 @@ var workspace = null;
 var editor = null;
 var python = window.python; // Access global python object if needed
 
-// Override Python generator finish to remove variable initialization
+// API prefix of the drone this page programs (/drones/<id>)
+const DRONE_BASE = window.DRONE_BASE || '';
+
+// Override Python generator finish to emit definitions without extra blank lines.
+// Variable declarations ('a = None', one line per variable) are kept: the
+// flight plan compiler needs them for math_change ('a = (a if isinstance(a, Number) else 0) + 1').
 if (python && python.pythonGenerator) {
   python.pythonGenerator.finish = function (code) {
     const definitions = [];
     for (const name in python.pythonGenerator.definitions_) {
-      const def = python.pythonGenerator.definitions_[name];
-      // Skip variable initializations like 'a = None'
-      if (def.match(/^[a-zA-Z_]\w*\s*=\s*None$/)) {
-        continue;
-      }
-      definitions.push(def);
+      definitions.push(python.pythonGenerator.definitions_[name]);
     }
 
     // Clean up
@@ -138,8 +138,8 @@ document.addEventListener('DOMContentLoaded', function () {
     updateStatus('executing', 'Executing...');
 
     const serverUrl = window.location.hostname === 'localhost'
-      ? 'http://127.0.0.1:5000'
-      : `http://${window.location.hostname}:5000`;
+      ? 'http://127.0.0.1:5000' + DRONE_BASE
+      : `http://${window.location.hostname}:5000${DRONE_BASE}`;
 
     fetch(`${serverUrl}/run`, {
       method: "POST",
@@ -150,8 +150,9 @@ document.addEventListener('DOMContentLoaded', function () {
       .then(data => {
         if (data.status === 'success') {
           logConsole(`✅ ${data.message}`, 'success');
+          (data.warnings || []).forEach(warning => logConsole(`⚠️ ${warning}`, 'warning'));
           updateStatus('executing', 'Program Running');
-          checkProgramStatus();
+          checkProgramStatus(data.events_since, data.job.id);
         } else {
           logConsole(`❌ Error: ${data.message}`, 'error');
           updateStatus('connected', 'Ready');
@@ -166,8 +167,8 @@ document.addEventListener('DOMContentLoaded', function () {
   // Stop button
   document.getElementById('stopBtn').addEventListener('click', () => {
     const serverUrl = window.location.hostname === 'localhost'
-      ? 'http://127.0.0.1:5000'
-      : `http://${window.location.hostname}:5000`;
+      ? 'http://127.0.0.1:5000' + DRONE_BASE
+      : `http://${window.location.hostname}:5000${DRONE_BASE}`;
 
     fetch(`${serverUrl}/stop_program`, { method: "POST" })
       .then(res => res.json())
@@ -183,8 +184,8 @@ document.addEventListener('DOMContentLoaded', function () {
   // Initial connection check
   setTimeout(() => {
     const serverUrl = window.location.hostname === 'localhost'
-      ? 'http://127.0.0.1:5000'
-      : `http://${window.location.hostname}:5000`;
+      ? 'http://127.0.0.1:5000' + DRONE_BASE
+      : `http://${window.location.hostname}:5000${DRONE_BASE}`;
 
     fetch(`${serverUrl}/status`)
       .then(res => res.json())
@@ -575,11 +576,51 @@ function updateStatus(status, text) {
   }
 }
 
-function checkProgramStatus() {
+function checkProgramStatus(since, jobId) {
   const serverUrl = window.location.hostname === 'localhost'
-    ? 'http://127.0.0.1:5000'
-    : `http://${window.location.hostname}:5000`;
+    ? 'http://127.0.0.1:5000' + DRONE_BASE
+    : `http://${window.location.hostname}:5000${DRONE_BASE}`;
+
+  if (!('EventSource' in window)) {
+    pollProgramStatus(serverUrl);
+    return;
+  }
+
+  // Program state is pushed by the server, no polling needed
+  const query = since === undefined ? '' : `&since=${since}`;
+  const source = new EventSource(`${serverUrl}/events?max_hz=1${query}`);
+
+  source.addEventListener('program', (event) => {
+    const data = JSON.parse(event.data);
+    // Other submitted programs share the stream; follow only ours
+    if (jobId !== undefined && data.job !== jobId) return;
+
+    if (data.state === 'queued' && data.position > 0) {
+      logConsole(`⏳ Job ${data.job} queued behind ${data.position} program(s)`, 'info');
+    } else if (data.state === 'step') {
+      const eta = typeof data.eta === 'number' ? ` - about ${Math.ceil(data.eta)}s left` : '';
+      logConsole(`▶ Step ${data.step}/${data.total}: ${data.type} (line ${data.line})${eta}`, 'info');
+    } else if (data.state === 'completed') {
+      source.close();
+      logConsole('✅ Program completed', 'success');
+      updateStatus('connected', 'Ready');
+    } else if (data.state === 'stopped' || data.state === 'cancelled' || data.state === 'failed') {
+      source.close();
+      if (data.reason) {
+        logConsole(`🛑 Program ${data.state}: ${data.reason}`, data.state === 'failed' ? 'error' : 'warning');
+      }
+      updateStatus('connected', 'Ready');
+    }
+  });
+
+  source.onerror = () => {
+    if (source.readyState === EventSource.CLOSED) {
+      updateStatus('disconnected', 'Connection Lost');
+    }
+  };
+}
 
+function pollProgramStatus(serverUrl) {
   const interval = setInterval(() => {
     fetch(`${serverUrl}/status`)
       .then(res => res.json())
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from flight_plan import CompileError, compile_program
+
+# Verbatim Blockly output for variables, math_change and procedures
+BLOCKLY_SAMPLES = {
+    "variables": (
+        "from numbers import Number\n\n"
+        "distance = None\nturns = None\n\n\n"
+        "filo.takeoff()\n"
+        "distance = 30\n"
+        "for count in range(3):\n"
+        "  filo.move_forward(distance)\n"
+        "  distance = (distance if isinstance(distance, Number) else 0) + 10\n"
+        "  turns = (turns if isinstance(turns, Number) else 0) + 1\n"
+        "filo.rotate_clockwise(turns * 30)\n"
+        "filo.land()\n",
+        6
+    ),
+    "functions": (
+        "from numbers import Number\n\n"
+        "side = None\n\n"
+        "def square(length):\n"
+        "  global side\n"
+        "  for count in range(4):\n"
+        "    filo.move_forward(length)\n"
+        "    filo.rotate_clockwise(90)\n"
+        "  side = (side if isinstance(side, Number) else 0) + 1\n\n"
+        "def clamp(value):\n"
+        "  global side\n"
+        "  if value > 100:\n"
+        "    return 100\n"
+        "  return value\n\n\n"
+        "filo.takeoff()\n"
+        "square(clamp(150))\n"
+        "filo.move_up(side * 10)\n"
+        "filo.land()\n",
+        11
+    ),
+}
+
+def distances(plan):
+    return [step["distance"] for step in plan if "distance" in step]
+
+# -------------------------
+# Blockly output
+# -------------------------
+@pytest.mark.parametrize("name", sorted(BLOCKLY_SAMPLES))
+def test_blockly_sample_compiles(name):
+    source, steps = BLOCKLY_SAMPLES[name]
+    assert len(compile_program(source)) == steps
+
+# -------------------------
+# and / or
+# -------------------------
+def test_and_short_circuits():
+    source = ("x = None\n"
+              "if x != None and x > 3:\n"
+              "  filo.move_up(50)\n"
+              "for i in [0, 4]:\n"
+              "  if i > 0 and 10 / i > 2:\n"
+              "    filo.move_up(i)\n")
+    assert distances(compile_program(source)) == [4]
+
+def test_or_short_circuits():
+    assert distances(compile_program("i = 0\nif i == 0 or 10 / i > 2:\n  filo.move_up(20)\n")) == [20]
+
+def test_bool_op_returns_deciding_operand():
+    assert distances(compile_program("filo.move_up(0 or 30)\nfilo.move_up(40 and 25)\n")) == [30, 25]
+    assert distances(compile_program("filo.move_up((0 and 1) + 15)\n")) == [15]
+
+# -------------------------
+# Compile bounds
+# -------------------------
+@pytest.mark.parametrize("source", [
+    "x = 9 ** 9 ** 8\n",
+    "x = [1] * 10 ** 9\n",
+    "x = -'a'\n",
+    "filo.move_up(1e400)\n",
+    "filo.move_up(float('nan'))\n",
+    "while True:\n  x = 1\n",
+    "def f(n):\n  return f(n)\nf(1)\n",
+    "x = " + "(" * 5000 + "1" + ")" * 5000 + "\n",
+])
+def test_rejects_unbounded_program(source):
+    with pytest.raises(CompileError):
+        compile_program(source)
+
+@pytest.mark.parametrize("source", [
+    # Expression work inside a small number of statements
+    "x = [1] * 1000\n"
+    "for i in range(1000):\n"
+    "  for j in range(1000):\n"
+    "    y = max(x * 1)\n",
+    # Long sequences compared item by item
+    "s = 'a' * 999\n"
+    "for i in range(1000):\n"
+    "  for j in range(1000):\n"
+    "    y = [s] * 60 == [s] * 32\n",
+])
+def test_expression_work_is_budgeted(source):
+    start = time.monotonic()
+    with pytest.raises(CompileError, match="too long to compile"):
+        compile_program(source)
+    assert time.monotonic() - start < 2
+
+def test_long_step_error_is_readable():
+    with pytest.raises(CompileError) as error:
+        compile_program("filo.move_up(1e308)\n")
+    assert len(str(error.value)) < 120
@@ -0,0 +1,43 @@
+import threading, time
+
+from jobs import JobQueue
+
+def make_queue(run):
+    calls = []
+    queue = JobQueue(run, lambda: calls.append("busy"), lambda: calls.append("idle"),
+                     lambda state, **fields: None)
+    return queue, calls
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+def test_cancelling_last_queued_job_reports_idle():
+    queue, calls = make_queue(lambda job: {})
+    with queue.cond:   # keep the worker from picking the job up
+        job = queue.submit([{"type": "land"}], "commands")
+        queue.cancel(job.id)
+    assert job.status == "cancelled"
+    assert calls == ["busy", "idle"]
+
+def test_stop_all_with_only_queued_jobs_reports_idle():
+    queue, calls = make_queue(lambda job: {})
+    with queue.cond:
+        queue.submit([{"type": "land"}], "commands")
+        queue.submit([{"type": "land"}], "commands")
+        queue.stop_all("emergency")
+    assert calls == ["busy", "busy", "idle"]
+
+def test_cancelling_queued_job_behind_active_one_stays_busy():
+    release = threading.Event()
+    queue, calls = make_queue(lambda job: release.wait(5) and {})
+    first = queue.submit([{"type": "land"}], "commands")
+    assert wait_until(lambda: queue.active is first)
+    with queue.cond:
+        second = queue.submit([{"type": "land"}], "commands")
+        queue.cancel(second.id)
+    assert "idle" not in calls
+    release.set()
+    assert wait_until(lambda: calls[-1] == "idle")
@@ -0,0 +1,159 @@
+import time, threading
+from collections import deque, OrderedDict
+
+# -------------------------
+# Stick-to-motor latency tracing
+# -------------------------
+# A traced input carries {"c": client id, "id": n, "ts": client time} in a
+# "trace" field (see filo.js). The server stamps it as it goes:
+#   received  request / WebSocket message arrived, before JSON decoding
+#   parsed    decoded and validated
+#   queued    CMD line handed to the serial writer
+#   written   the writer thread wrote it to the port
+#   acked     the flight controller's next ACK line
+# The reply echoes the trace so the client can measure the round trip; it
+# reports that, and how late its send timer fired, with its next input.
+#
+# ACK lines carry no id, so they are matched to traced CMD lines in write
+# order; a written line with no ACK within `ack_timeout` is given up on.
+# This assumes one ACK per CMD line, so untraced setpoints written in
+# between (a second pilot, a running program) skew the fc_ack stage.
+
+STAGES = {
+    "client_loop": "setInterval lateness in the browser",
+    "network": "round trip minus server time (browser, Wi-Fi, HTTP/WebSocket)",
+    "parse": "request arrival to decoded input",
+    "handle": "decoded input to CMD line queued",
+    "writer_queue": "queued to written on the serial port",
+    "fc_ack": "written to the flight controller's ACK",
+    "server": "request arrival to serial write",
+    "round_trip": "client send to reply, measured by the client",
+    "stick_to_ack": "request arrival to ACK"
+}
+
+class Trace:
+    __slots__ = ("key", "client_ts", "transport", "received", "parsed", "queued", "written",
+                 "acked", "round_trip")
+
+    def __init__(self, key, client_ts, transport, received):
+        self.key = key
+        self.client_ts = client_ts
+        self.transport = transport
+        self.received = received
+        self.parsed = self.queued = self.written = self.acked = self.round_trip = None
+
+    def as_dict(self):
+        def ms(start, end):
+            return round((end - start) * 1000, 3) if start is not None and end is not None else None
+        return {
+            "client": self.key[0],
+            "id": self.key[1],
+            "transport": self.transport,
+            "parse_ms": ms(self.received, self.parsed),
+            "handle_ms": ms(self.parsed, self.queued),
+            "writer_queue_ms": ms(self.queued, self.written),
+            "fc_ack_ms": ms(self.written, self.acked),
+            "round_trip_ms": self.round_trip
+        }
+
+class LatencyTracer:
+    """Per-stage latency distributions for traced control inputs"""
+
+    def __init__(self, window=1024, keep=256, ack_timeout=1.0):
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self.traces = OrderedDict()   # (client, id) -> Trace, most recent `keep`
+        self.keep = keep
+        self.unacked = deque()        # traces written, waiting for an ACK
+        self.ack_timeout = ack_timeout
+        self.lock = threading.Lock()
+        self.traced = 0
+
+    def begin(self, trace, transport, received):
+        """Start a trace from an input's "trace" field; returns the Trace or None"""
+        if not isinstance(trace, dict):
+            return None
+        try:
+            key = (str(trace["c"])[:32], int(trace["id"]))
+        except (KeyError, TypeError, ValueError):
+            return None
+        record = Trace(key, trace.get("ts"), transport, received)
+        with self.lock:
+            self.traced += 1
+            self.traces[key] = record
+            while len(self.traces) > self.keep:
+                self.traces.popitem(last=False)
+        self._client_report(key[0], trace)
+        return record
+
+    def _client_report(self, client, trace):
+        """The client's measurements for its previous input"""
+        loop_ms = trace.get("loop_ms")
+        if isinstance(loop_ms, (int, float)) and loop_ms >= 0:
+            self.samples["client_loop"].append(loop_ms / 1000)
+        rtt_ms = trace.get("rtt_ms")
+        if not isinstance(rtt_ms, (int, float)) or rtt_ms < 0:
+            return
+        try:
+            previous = self.traces.get((client, int(trace.get("prev"))))
+        except (TypeError, ValueError):
+            return
+        if previous is None or previous.round_trip is not None:
+            return
+        previous.round_trip = rtt_ms
+        self.samples["round_trip"].append(rtt_ms / 1000)
+        if previous.queued is not None:
+            self.samples["network"].append(max(0.0, rtt_ms / 1000 - (previous.queued - previous.received)))
+
+    def parsed(self, record):
+        record.parsed = time.perf_counter()
+        self.samples["parse"].append(record.parsed - record.received)
+
+    def queued(self, record):
+        record.queued = time.perf_counter()
+        if record.parsed is not None:
+            self.samples["handle"].append(record.queued - record.parsed)
+
+    def written(self, record, now):
+        """Called by the serial writer thread after the traced line hit the port"""
+        record.written = now
+        self.samples["writer_queue"].append(now - record.queued)
+        self.samples["server"].append(now - record.received)
+        with self.lock:
+            self.unacked.append(record)
+
+    def acked(self, now):
+        """Called by the serial reader for each ACK line"""
+        with self.lock:
+            while self.unacked and now - self.unacked[0].written > self.ack_timeout:
+                self.unacked.popleft()
+            if not self.unacked:
+                return
+            record = self.unacked.popleft()
+        record.acked = now
+        self.samples["fc_ack"].append(now - record.written)
+        self.samples["stick_to_ack"].append(now - record.received)
+
+    def echo(self, record):
+        """Trace field for the reply to a traced input"""
+        return {"c": record.key[0], "id": record.key[1], "ts": record.client_ts}
+
+    def stats(self):
+        stages = {}
+        for stage, description in STAGES.items():
+            samples = sorted(self.samples[stage])
+            count = len(samples)
+            stages[stage] = {
+                "description": description,
+                "count": count,
+                "p50_ms": round(samples[count // 2] * 1000, 3) if count else None,
+                "p90_ms": round(samples[min(count - 1, int(count * 0.9))] * 1000, 3) if count else None,
+                "p99_ms": round(samples[min(count - 1, int(count * 0.99))] * 1000, 3) if count else None,
+                "max_ms": round(samples[-1] * 1000, 3) if count else None
+            }
+        return {"traced": self.traced, "stages": stages}
+
+    def export(self):
+        """Recent traces, oldest first"""
+        with self.lock:
+            records = list(self.traces.values())
+        return [record.as_dict() for record in records]
@@ -0,0 +1,298 @@
+import os, json, time, queue, shutil, struct, bisect, threading
+
+# -------------------------
+# Flight video recording
+# -------------------------
+# A recording is a directory of time-segmented video files plus an index
+# with one fixed-width record per frame:
+#
+#   <video_dir>/<session>/meta.json      codec, start time, segment length
+#   <video_dir>/<session>/NNNN.h264      hardware H.264 (PiCamera2), or
+#   <video_dir>/<session>/NNNN.mjpeg     the stream's JPEG frames back to back
+#   <video_dir>/<session>/index.vidx     frame records (below)
+#
+# Frames are never re-encoded: H.264 comes from a second PiCamera2 encoder,
+# MJPEG segments store the frames the live stream already encoded.
+#
+# Index record (44 bytes): time, telemetry version, segment, offset, size,
+# roll, pitch, yaw_rate, battery_voltage, flags (bit0 keyframe, bit1 armed).
+# The telemetry is the snapshot current when the frame arrived, so finding
+# "the moment roll exceeded 30 degrees" is a scan of the index, not a decode.
+INDEX = struct.Struct("<dIIIIffffB3x")
+FLAG_KEYFRAME = 1
+FLAG_ARMED = 2
+SEEK_FIELDS = ("roll", "pitch", "yaw_rate", "battery_voltage")
+
+class VideoRecording:
+    """Writes one recording; frames are queued and written by its own thread
+
+    `add_frame()` never blocks: when the bounded queue is full the frame is
+    dropped (for H.264, every frame up to the next keyframe, which the
+    decoder would need). Segments roll over every `segment_seconds` (on a
+    keyframe), and once `max_segments` exist the oldest is deleted.
+    """
+
+    def __init__(self, directory, codec, telemetry, segment_seconds=10.0, max_segments=60,
+                 max_queue=64):
+        self.directory = directory
+        self.session = os.path.basename(directory)
+        self.codec = codec
+        self.extension = "h264" if codec == "h264" else "mjpeg"
+        self.telemetry = telemetry  # TelemetryState
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.started_at = time.time()
+        self.frames = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.skip_to_keyframe = False
+        self.segment_index = -1
+        self.segment_file = None
+        self.segment_started = None
+        self.offset = 0
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"codec": codec, "started_at": self.started_at,
+                       "segment_seconds": segment_seconds}, f)
+        self.index_file = open(os.path.join(directory, "index.vidx"), "ab")
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def add_frame(self, data, keyframe=True):
+        """Queue an encoded frame (capture or encoder thread); never blocks"""
+        if self.codec == "h264" and self.skip_to_keyframe:
+            if not keyframe:
+                self.dropped += 1
+                return
+            self.skip_to_keyframe = False
+        try:
+            self.queue.put_nowait((time.time(), self.telemetry.current, bytes(data), keyframe))
+        except queue.Full:
+            self.dropped += 1
+            self.skip_to_keyframe = True
+
+    def close(self):
+        """Flush what is queued and close the files (returns once written)"""
+        self.queue.put(None)
+        self.thread.join(timeout=10)
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            t, snapshot, data, keyframe = item
+            try:
+                self._append(t, snapshot, data, keyframe)
+            except OSError as e:
+                print(f"[WARN] Video recording {self.session} write error:", e)
+                self.dropped += 1
+        if self.segment_file:
+            self.segment_file.close()
+        self.index_file.close()
+
+    def _append(self, t, snapshot, data, keyframe):
+        if self.segment_file is None or (keyframe and t - self.segment_started >= self.segment_seconds):
+            self._rotate(t)
+        self.segment_file.write(data)
+        flags = (FLAG_KEYFRAME if keyframe else 0) | (FLAG_ARMED if snapshot.armed else 0)
+        self.index_file.write(INDEX.pack(t, snapshot.version, self.segment_index, self.offset, len(data),
+                                         snapshot.roll, snapshot.pitch, snapshot.yaw_rate,
+                                         snapshot.battery_voltage, flags))
+        self.offset += len(data)
+        self.frames += 1
+        self.bytes_written += len(data)
+        if self.frames % 30 == 0:
+            self.index_file.flush()
+
+    def _rotate(self, t):
+        if self.segment_file:
+            self.segment_file.close()
+            self.index_file.flush()
+        self.segment_index += 1
+        self.segment_file = open(segment_path(self.directory, self.segment_index, self.extension), "wb")
+        self.segment_started = t
+        self.offset = 0
+
+        old = self.segment_index - self.max_segments
+        if old >= 0:
+            try:
+                os.remove(segment_path(self.directory, old, self.extension))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "session": self.session,
+            "codec": self.codec,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+            "bytes": self.bytes_written,
+            "segment": self.segment_index,
+            "seconds": round(time.time() - self.started_at, 1)
+        }
+
+class VideoRecorder:
+    """Starts and stops recordings of one drone's camera
+
+    Uses the source's hardware H.264 encoder when it has one
+    (`start_recording`), otherwise records the broadcaster's JPEG frames,
+    holding a subscription so capture keeps running while nobody watches.
+    Old recordings are deleted to keep `video_dir` under `quota_bytes`.
+    """
+
+    def __init__(self, video_dir, broadcaster, telemetry, quota_bytes=2 * 1024 ** 3, **options):
+        self.video_dir = video_dir
+        self.broadcaster = broadcaster
+        self.telemetry = telemetry
+        self.quota_bytes = quota_bytes
+        self.options = options
+        self.recording = None
+        self.source = None
+        self.lock = threading.Lock()
+
+    def start(self, session):
+        """Begin a recording in the background; False if one is running"""
+        with self.lock:
+            if self.recording is not None:
+                return False
+            self.recording = "starting"
+        threading.Thread(target=self._start, args=(session,), daemon=True).start()
+        return True
+
+    def _start(self, session):
+        # Opening a lazy camera can take seconds; never on the caller's thread
+        source = self.broadcaster.source
+        opener = getattr(source, "open", None)
+        camera = opener() if opener else source
+        try:
+            prune(self.video_dir, self.quota_bytes)
+            directory = os.path.join(self.video_dir, session)
+            if camera is not None and hasattr(camera, "start_recording"):
+                recording = VideoRecording(directory, "h264", self.telemetry, **self.options)
+                camera.start_recording(recording.add_frame)
+                self.source = camera
+            else:
+                recording = VideoRecording(directory, "mjpeg", self.telemetry, **self.options)
+                self.broadcaster.add_sink(recording.add_frame)
+                self.broadcaster.subscribe()
+                self.source = None
+        except Exception as e:
+            print(f"[WARN] Video recording {session} failed to start:", e)
+            with self.lock:
+                self.recording = None
+            return
+        with self.lock:
+            stopped = self.recording is None
+            self.recording = recording
+        print(f"[OK] Recording video {session} ({recording.codec})")
+        if stopped:
+            self.stop()  # stop() arrived while the camera was opening
+
+    def stop(self):
+        """Stop the current recording; returns its stats, or None"""
+        with self.lock:
+            recording, self.recording = self.recording, None
+        if not isinstance(recording, VideoRecording):
+            return None
+        if self.source is not None:
+            self.source.stop_recording()
+            self.source = None
+        else:
+            self.broadcaster.remove_sink(recording.add_frame)
+            self.broadcaster.unsubscribe()
+        threading.Thread(target=recording.close, daemon=True).start()
+        print(f"[OK] Video recording {recording.session} stopped ({recording.frames} frames)")
+        return recording.stats()
+
+    def stats(self):
+        recording = self.recording
+        return recording.stats() if isinstance(recording, VideoRecording) else None
+
+def segment_path(directory, index, extension):
+    return os.path.join(directory, f"{index:04d}.{extension}")
+
+def prune(video_dir, quota_bytes):
+    """Delete the oldest recordings until `video_dir` fits in `quota_bytes`"""
+    if not os.path.isdir(video_dir):
+        return
+    sessions = []
+    total = 0
+    for name in sorted(os.listdir(video_dir)):
+        path = os.path.join(video_dir, name)
+        if os.path.isdir(path):
+            size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            sessions.append((path, size))
+            total += size
+    for path, size in sessions:
+        if total <= quota_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+# -------------------------
+# Reading and seeking
+# -------------------------
+def list_recordings(video_dir):
+    recordings = []
+    if not os.path.isdir(video_dir):
+        return recordings
+    for name in sorted(os.listdir(video_dir)):
+        try:
+            with open(os.path.join(video_dir, name, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        index_path = os.path.join(video_dir, name, "index.vidx")
+        frames = os.path.getsize(index_path) // INDEX.size if os.path.exists(index_path) else 0
+        recordings.append(dict(meta, id=name, frames=frames))
+    return recordings
+
+def read_index(directory):
+    """Every frame record of a recording, in time order"""
+    with open(os.path.join(directory, "index.vidx"), "rb") as f:
+        data = f.read()
+    data = data[:len(data) - len(data) % INDEX.size]  # a recording still being written
+    return list(INDEX.iter_unpack(data))
+
+def frame_info(directory, records, i):
+    """JSON description of frame `i`, with the keyframe a decoder would start from"""
+    t, version, segment, offset, size, roll, pitch, yaw_rate, voltage, flags = records[i]
+    key = i
+    while key > 0 and not records[key][9] & FLAG_KEYFRAME and records[key - 1][2] == segment:
+        key -= 1
+    return {
+        "frame": i,
+        "time": t,
+        "telemetry_version": version,
+        "segment": segment,
+        "offset": offset,
+        "size": size,
+        "keyframe_offset": records[key][3],
+        "telemetry": {"roll": roll, "pitch": pitch, "yaw_rate": yaw_rate,
+                      "battery_voltage": voltage, "armed": bool(flags & FLAG_ARMED)}
+    }
+
+def seek(records, field, above=None, below=None, after=None):
+    """Index of the first frame whose telemetry `field` is above/below a value, or None"""
+    column = 5 + SEEK_FIELDS.index(field)
+    start = bisect.bisect_left(records, (after,)) if after is not None else 0
+    for i in range(start, len(records)):
+        value = records[i][column]
+        if (above is None or value > above) and (below is None or value < below):
+            return i
+    return None
+
+def frame_at(records, t):
+    """Index of the last frame at or before time `t`"""
+    i = bisect.bisect_right(records, (t, float("inf")))
+    return max(0, i - 1) if records else None
+
+def read_frame(directory, codec, record):
+    """Raw bytes of one frame (a whole JPEG for MJPEG recordings)"""
+    _, _, segment, offset, size = record[:5]
+    with open(segment_path(directory, segment, "h264" if codec == "h264" else "mjpeg"), "rb") as f:
+        f.seek(offset)
+        return f.read(size)
@@ -0,0 +1,455 @@
+import io, time, asyncio, threading
+from collections import deque
+from events import AsyncWaiters
+
+PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+PART_TRAILER = b'\r\n'
+
+def build_part(jpeg):
+    """Wrap an encoded frame (any buffer object) in a multipart chunk with one copy"""
+    return b''.join((PART_HEADER % len(jpeg), jpeg, PART_TRAILER))
+
+# -------------------------
+# Capture sources
+# -------------------------
+# Besides encoded frames for streaming, each source's raw() returns an
+# unencoded HxWxC uint8 frame for the vision stage (or None).
+class Picamera2MJPEGSource:
+    """PiCamera2 hardware MJPEG encoder pushing frames into the broadcaster
+
+    The encoder output is published as-is, so frames never pass through
+    Python-side JPEG encoding.
+    """
+    push = True
+
+    def __init__(self, picam2):
+        self.picam2 = picam2
+        self.encoder = None
+        self.recorder = None
+
+    def start(self, publish, fps, quality):
+        from picamera2.encoders import MJPEGEncoder, Quality
+        from picamera2.outputs import Output
+
+        class PublishOutput(Output):
+            def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+                publish(frame)
+
+        levels = [Quality.VERY_LOW, Quality.LOW, Quality.MEDIUM, Quality.HIGH, Quality.VERY_HIGH]
+        level = levels[min(len(levels) - 1, max(0, (quality - 50) // 10))]
+        self.picam2.set_controls({"FrameRate": fps})
+        self.encoder = MJPEGEncoder()
+        self.picam2.start_encoder(self.encoder, PublishOutput(), quality=level)
+        print(f"[CAM] MJPEG encoder started ({fps} fps, {level.name})")
+
+    def stop(self):
+        if self.encoder:
+            self.picam2.stop_encoder(self.encoder)
+            self.encoder = None
+            print("[CAM] MJPEG encoder stopped")
+
+    def start_recording(self, on_frame, bitrate=2000000):
+        """Run the hardware H.264 encoder alongside MJPEG; on_frame(data, keyframe)"""
+        from picamera2.encoders import H264Encoder
+        from picamera2.outputs import Output
+
+        class RecordOutput(Output):
+            def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+                on_frame(frame, keyframe)
+
+        self.recorder = H264Encoder(bitrate=bitrate, repeat=True)  # SPS/PPS on every keyframe
+        self.picam2.start_encoder(self.recorder, RecordOutput())
+        print("[CAM] H.264 recording encoder started")
+
+    def stop_recording(self):
+        if self.recorder:
+            self.picam2.stop_encoder(self.recorder)
+            self.recorder = None
+            print("[CAM] H.264 recording encoder stopped")
+
+    def raw(self):
+        return self.picam2.capture_array()
+
+class Picamera2StillSource:
+    """PiCamera2 still capture, used when the MJPEG encoder is unavailable"""
+    push = False
+    max_fps = None
+
+    def __init__(self, picam2):
+        self.picam2 = picam2
+
+    def capture(self, quality):
+        self.picam2.options["quality"] = quality
+        stream = io.BytesIO()
+        self.picam2.capture_file(stream, format="jpeg")
+        return stream.getbuffer()
+
+    def raw(self):
+        return self.picam2.capture_array()
+
+class OpenCVSource:
+    """Webcam frames encoded with cv2.imencode"""
+    push = False
+    max_fps = None
+
+    def __init__(self, camera):
+        import cv2
+        self.cv2 = cv2
+        self.camera = camera
+        self.lock = threading.Lock()  # VideoCapture is not thread-safe
+
+    def raw(self):
+        with self.lock:
+            success, frame = self.camera.read()
+        return frame if success else None
+
+    def capture(self, quality):
+        frame = self.raw()
+        if frame is None:
+            return None
+        ret, buffer = self.cv2.imencode('.jpg', frame, [self.cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ret:
+            return None
+        return buffer
+
+class PlaceholderSource:
+    """Plain grey frame, encoded once and republished at 1 fps"""
+    push = False
+    max_fps = 1
+
+    def __init__(self, size=(320, 240)):
+        from PIL import Image
+        stream = io.BytesIO()
+        Image.new("RGB", size, (100, 100, 100)).save(stream, format="JPEG")
+        self.jpeg = stream.getvalue()
+
+    def capture(self, quality):
+        return self.jpeg
+
+    def raw(self):
+        return None
+
+class LazySource:
+    """Camera opened on first use instead of at startup
+
+    `opener` builds the real source (opening and warming up the camera) and
+    raises if it can't. It runs in whichever thread first wants a frame: the
+    capture thread of the first /video_feed subscriber, or a recording.
+    Until it succeeds the placeholder frame is served, and a failed open is
+    retried with exponential backoff. Consumers that shouldn't open the
+    camera themselves (the vision stage) register with `when_open()`.
+    """
+
+    def __init__(self, opener, retry_min=2.0, retry_max=60.0):
+        self.opener = opener
+        self.source = None
+        self.placeholder = None
+        self.lock = threading.Lock()
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.retry_delay = retry_min
+        self.retry_at = 0.0
+        self.open_callbacks = []
+        self.info = {
+            "state": "idle",        # idle, opening, ready, retrying
+            "attempts": 0,
+            "took_s": None,
+            "last_error": None
+        }
+
+    @property
+    def push(self):
+        return self.source.push if self.source else False
+
+    @property
+    def max_fps(self):
+        return self.source.max_fps if self.source else PlaceholderSource.max_fps
+
+    def open(self):
+        """The real source, opening it if due; None while unavailable"""
+        with self.lock:
+            if self.source is not None or time.monotonic() < self.retry_at:
+                return self.source
+            self.info["state"] = "opening"
+            self.info["attempts"] += 1
+            started = time.monotonic()
+            try:
+                source = self.opener()
+            except Exception as e:
+                print(f"[WARN] Camera unavailable, retrying in {self.retry_delay:.0f}s:", e)
+                self.info.update(state="retrying", last_error=str(e))
+                self.retry_at = time.monotonic() + self.retry_delay
+                self.retry_delay = min(self.retry_delay * 2, self.retry_max)
+                return None
+            self.source = source
+            self.info.update(state="ready", took_s=round(time.monotonic() - started, 3))
+            callbacks, self.open_callbacks = self.open_callbacks, []
+        for callback in callbacks:
+            callback(source)
+        return source
+
+    def when_open(self, callback):
+        """Call `callback(source)` once the camera is open (now, if it already is)"""
+        with self.lock:
+            source = self.source
+            if source is None:
+                self.open_callbacks.append(callback)
+                return
+        callback(source)
+
+    def state(self):
+        return dict(self.info)
+
+    def start(self, publish, fps, quality):
+        self.source.start(publish, fps, quality)
+
+    def stop(self):
+        self.source.stop()
+
+    def capture(self, quality):
+        source = self.open()
+        if source is None:
+            if self.placeholder is None:
+                self.placeholder = PlaceholderSource()
+            return self.placeholder.capture(quality)
+        if source.push:
+            return None  # the broadcaster switches to the encoder
+        return source.capture(quality)
+
+    def raw(self):
+        source = self.open()
+        return source.raw() if source else None
+
+# -------------------------
+# Frame broadcaster
+# -------------------------
+class FrameBroadcaster:
+    """Single capture/encode thread shared by every /video_feed client
+
+    The capture thread publishes each frame, already wrapped as a multipart
+    chunk, into a small ring buffer tagged with a sequence number. Clients
+    always take the newest chunk, so a slow client skips frames instead of
+    building up a backlog, and no per-client copies are made. The thread
+    starts with the first subscriber and stops after `idle_timeout` seconds
+    with nobody watching.
+
+    Each client paces itself from how long the server takes to drain its
+    socket; capture runs no faster than the fastest client wants, and JPEG
+    quality steps down while every client is lagging.
+    """
+
+    MIN_FPS = 1
+    MIN_QUALITY = 40
+
+    def __init__(self, source, fps=15, quality=80, ring_size=4, idle_timeout=5.0):
+        self.source = source
+        self.target_fps = fps
+        self.target_quality = quality
+        self.quality = quality
+        self.ring = deque(maxlen=ring_size)
+        self.seq = 0
+        self.subscribers = 0
+        self.client_intervals = {}
+        self.capture_times = deque(maxlen=32)
+        self.sinks = []  # called with every encoded frame (e.g. a video recording)
+        self.idle_timeout = idle_timeout
+        self.cond = threading.Condition()
+        self.async_waiters = AsyncWaiters()
+        self.thread = None
+        self.run_lock = threading.Lock()   # one capture thread owns the source at a time
+        self.last_seen = time.monotonic()
+
+    def subscribe(self):
+        with self.cond:
+            self.subscribers += 1
+            self.last_seen = time.monotonic()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+                print("[CAM] Capture thread started")
+
+    def unsubscribe(self):
+        with self.cond:
+            self.subscribers = max(0, self.subscribers - 1)
+            self.last_seen = time.monotonic()
+
+    def add_sink(self, sink):
+        with self.cond:
+            self.sinks = self.sinks + [sink]
+
+    def remove_sink(self, sink):
+        with self.cond:
+            self.sinks = [s for s in self.sinks if s != sink]
+
+    def publish(self, jpeg):
+        """Make an encoded frame the newest one in the ring"""
+        for sink in self.sinks:
+            sink(jpeg)
+        part = build_part(jpeg)
+        with self.cond:
+            self.seq += 1
+            self.ring.append(part)
+            self.cond.notify_all()
+        self.async_waiters.notify()
+
+    def latest(self, after_seq, timeout=1.0):
+        """Wait for a chunk newer than `after_seq`; return (seq, chunk) or None"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > after_seq, timeout):
+                return None
+            return self.seq, self.ring[-1]
+
+    def _adapt(self, interval, min_interval, drained):
+        """Next per-client frame interval given how long the last send took"""
+        # Back off while the socket drains slower than our frame interval,
+        # creep back up once it keeps up comfortably
+        if drained > interval * 0.8:
+            return min(interval * 1.25, 1.0 / self.MIN_FPS)
+        if drained < interval * 0.3:
+            return max(interval * 0.9, min_interval)
+        return interval
+
+    def frames(self):
+        """Multipart MJPEG generator for one HTTP client"""
+        client = object()
+        min_interval = 1.0 / self.target_fps
+        interval = min_interval
+        self.subscribe()
+        last_seq = 0
+        next_due = time.monotonic()
+        try:
+            while True:
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                result = self.latest(last_seq)
+                if result is None:
+                    continue
+                last_seq, part = result
+
+                sent_at = time.monotonic()
+                yield part
+                interval = self._adapt(interval, min_interval, time.monotonic() - sent_at)
+                next_due = sent_at + interval
+                self.client_intervals[client] = interval
+        finally:
+            self.client_intervals.pop(client, None)
+            self.unsubscribe()
+
+    async def async_frames(self):
+        """Same as `frames` for an asyncio server; holds no thread while waiting"""
+        client = object()
+        min_interval = 1.0 / self.target_fps
+        interval = min_interval
+        waiter = self.async_waiters.add()
+        self.subscribe()
+        last_seq = 0
+        next_due = time.monotonic()
+        try:
+            while True:
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                if self.seq <= last_seq:
+                    await self.async_waiters.wait(waiter, 1.0)
+                    continue
+                with self.cond:
+                    last_seq, part = self.seq, self.ring[-1]
+
+                sent_at = time.monotonic()
+                yield part
+                interval = self._adapt(interval, min_interval, time.monotonic() - sent_at)
+                next_due = sent_at + interval
+                self.client_intervals[client] = interval
+        finally:
+            self.async_waiters.discard(waiter)
+            self.client_intervals.pop(client, None)
+            self.unsubscribe()
+
+    def stats(self):
+        intervals = list(self.client_intervals.values())
+        times = list(self.capture_times)
+        return {
+            "subscribers": self.subscribers,
+            "quality": self.quality,
+            "client_fps": [round(1.0 / i, 1) for i in intervals],
+            "frames": self.seq,
+            # Capture + encode, pull sources only (push sources encode in hardware)
+            "capture_ms": round(sum(times) / len(times) * 1000, 2) if times else None
+        }
+
+    def _capture_interval(self):
+        """Pace capture to the fastest client and adapt JPEG quality"""
+        intervals = list(self.client_intervals.values())
+        min_interval = 1.0 / self.target_fps
+        if getattr(self.source, "max_fps", None):
+            min_interval = max(min_interval, 1.0 / self.source.max_fps)
+        if not intervals:
+            return min_interval
+
+        if min(intervals) > min_interval * 1.5:
+            self.quality = max(self.MIN_QUALITY, self.quality - 5)
+        elif max(intervals) <= min_interval * 1.1:
+            self.quality = min(self.target_quality, self.quality + 5)
+        return max(min_interval, min(intervals))
+
+    def _idle(self):
+        with self.cond:
+            if self.subscribers == 0 and time.monotonic() - self.last_seen > self.idle_timeout:
+                self.thread = None
+                return True
+        return False
+
+    def _run(self):
+        # A thread that just went idle may still be stopping the encoder;
+        # wait for it so its stop() can't land after our start(). Not under
+        # self.cond: stopping the encoder waits for publish(), which takes it.
+        with self.run_lock:
+            opener = getattr(self.source, "open", None)
+            if opener:
+                opener()
+            if self.source.push:
+                self._run_push()
+            else:
+                self._run_pull()
+        print("[CAM] No viewers, capture thread stopped")
+
+    def _run_push(self):
+        try:
+            self.source.start(self.publish, self.target_fps, self.target_quality)
+        except Exception as e:
+            print("[WARN] Camera encoder error:", e)
+            with self.cond:
+                self.thread = None
+            return
+        try:
+            while not self._idle():
+                time.sleep(0.5)
+        finally:
+            self.source.stop()
+
+    def _run_pull(self):
+        next_due = time.monotonic()
+        while not self._idle():
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_due = max(next_due + self._capture_interval(), time.monotonic())
+
+            try:
+                started = time.perf_counter()
+                jpeg = self.source.capture(self.quality)
+                self.capture_times.append(time.perf_counter() - started)
+            except Exception as e:
+                print("[WARN] Camera capture error:", e)
+                time.sleep(0.5)
+                continue
+
+            if jpeg is None:
+                if self.source.push:
+                    # A lazily opened camera turned out to have an encoder
+                    return self._run_push()
+                continue
+            self.publish(jpeg)
@@ -0,0 +1,333 @@
+"""Onboard vision stage: marker and colour-blob detection on camera frames
+
+Detection runs in a separate worker process so OpenCV never competes with
+the Flask threads for the GIL. Raw frames are handed over through shared
+memory; only a short JSON line per frame crosses the pipe. One frame is in
+flight at a time - while the worker is busy new frames are dropped rather
+than queued, so a slow detector can never hold up the video stream.
+
+The worker is this file run as a script:
+
+    python vision.py --worker [--width 320] [--blob red]
+"""
+import os, sys, json, time, argparse, threading, subprocess
+from multiprocessing import shared_memory
+import numpy as np
+
+BLOB_COLORS = {
+    # name: HSV ranges (OpenCV hue is 0-179)
+    "red": [((0, 120, 70), (10, 255, 255)), ((170, 120, 70), (179, 255, 255))],
+    "green": [((40, 70, 70), (80, 255, 255))],
+    "blue": [((100, 150, 50), (130, 255, 255))],
+    "yellow": [((20, 100, 100), (35, 255, 255))],
+}
+
+MIN_BLOB_AREA = 0.002       # fraction of the frame
+WORKER_RESTART_DELAY = 5.0  # after a crash; a worker that can't run at all is not restarted
+WORKER_STALL_TIMEOUT = 5.0  # a frame taking longer than this restarts the worker
+RESULT_MAX_AGE = 1.0        # older results don't count as "seeing" a marker
+
+# -------------------------
+# Parent side
+# -------------------------
+class VisionStage:
+    """Feed camera frames to the detection worker and keep its latest result
+
+    `grab()` returns a raw HxWxC uint8 frame (or None). Results arrive as
+    dicts:
+        {"seq", "time", "latency_ms",
+         "markers": [{"id", "x", "y", "size"}],   # x, y in -1..1 from centre
+         "blob": {"x", "y", "area"} or None}
+    """
+
+    def __init__(self, fps=10, width=320, blob_color="red", on_result=None):
+        self.fps = fps
+        self.width = width
+        self.blob_color = blob_color
+        self.on_result = on_result
+        self.cond = threading.Condition()
+        self.result = None
+        self.proc = None
+        self.shm = None
+        self.frame = None
+        self.busy_since = None
+        self.seq = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.error = None
+        self.failed = None          # why the stage gave up for good
+        self.running = False
+
+    def start(self, grab):
+        self.running = True
+        threading.Thread(target=self._feed, args=(grab,), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        if self.proc:
+            self.proc.terminate()
+        if self.shm:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    # Worker process
+    def _spawn(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker",
+             "--width", str(self.width), "--blob", self.blob_color or ""],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        self.busy_since = None
+        threading.Thread(target=self._read_results, args=(self.proc,), daemon=True).start()
+        print(f"[VISION] Worker started (pid {self.proc.pid})")
+
+    def _read_results(self, proc):
+        for line in proc.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if message.get("fatal"):
+                # Missing OpenCV and the like: restarting won't help
+                self.failed = self.error = message["error"]
+                self.running = False
+                print("[ERROR] Vision stage disabled:", message["error"])
+            elif "error" in message:
+                self.errors += 1
+                self.error = message["error"]
+                print("[WARN] Vision worker:", message["error"])
+            if "seq" in message:
+                self._accept(message)
+            with self.cond:
+                self.busy_since = None
+        with self.cond:
+            if proc is self.proc:
+                self.busy_since = None
+        print("[VISION] Worker exited")
+
+    def _accept(self, result):
+        with self.cond:
+            self.result = result
+            self.processed += 1
+            self.cond.notify_all()
+        if self.on_result:
+            self.on_result(result)
+
+    # Frame hand-off
+    def _share(self, frame):
+        """Copy a frame into the shared buffer, resizing it if the shape changed"""
+        if self.frame is None or self.frame.shape != frame.shape:
+            if self.shm:
+                self.shm.close()
+                self.shm.unlink()
+            self.shm = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+            self.frame = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf)
+        np.copyto(self.frame, frame)
+
+    def _feed(self, grab):
+        interval = 1.0 / self.fps
+        next_due = time.monotonic()
+        restart_at = 0.0
+        while self.running:
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_due = max(next_due + interval, time.monotonic())
+
+            if self.proc is None or self.proc.poll() is not None:
+                if time.monotonic() < restart_at:
+                    continue
+                restart_at = time.monotonic() + WORKER_RESTART_DELAY
+                try:
+                    self._spawn()
+                except OSError as e:
+                    self.failed = self.error = f"cannot start worker: {e}"
+                    self.running = False
+                    print("[ERROR] Vision stage disabled:", self.error)
+                    break
+
+            # Drop, don't queue, while the worker is still on the last frame
+            with self.cond:
+                busy_since = self.busy_since
+            if busy_since is not None:
+                self.dropped += 1
+                if time.monotonic() - busy_since > WORKER_STALL_TIMEOUT:
+                    print("[WARN] Vision worker stalled, restarting")
+                    self.proc.kill()
+                continue
+
+            try:
+                frame = grab()
+            except Exception as e:
+                print("[WARN] Vision frame grab failed:", e)
+                continue
+            if frame is None or frame.dtype != np.uint8 or frame.ndim != 3:
+                continue
+
+            self._share(frame)
+            self.seq += 1
+            message = {"seq": self.seq, "time": time.time(), "shm": self.shm.name,
+                       "shape": list(frame.shape)}
+            with self.cond:
+                self.busy_since = time.monotonic()
+            try:
+                self.proc.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+            except OSError:
+                with self.cond:
+                    self.busy_since = None
+
+    # Queries
+    def wait_for_marker(self, marker_id=None, timeout=10.0, cancelled=None):
+        """Block until `marker_id` (any marker if None) is seen; False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                result = self.result
+                if (result and time.time() - result["time"] < RESULT_MAX_AGE
+                        and any(marker_id is None or m["id"] == marker_id for m in result["markers"])):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (cancelled is not None and cancelled.is_set()):
+                    return False
+                self.cond.wait(min(remaining, 0.1))
+
+    def stats(self):
+        return {
+            "running": self.proc is not None and self.proc.poll() is None,
+            "failed": self.failed,
+            "frames": self.seq,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_error": self.error,
+            "latency_ms": self.result["latency_ms"] if self.result else None
+        }
+
+def summarize(result):
+    """Compact form of a result for the telemetry feed"""
+    return {
+        "markers": [m["id"] for m in result["markers"]],
+        "blob": [result["blob"]["x"], result["blob"]["y"]] if result["blob"] else None
+    }
+
+# -------------------------
+# Worker side
+# -------------------------
+def attach(name):
+    """Attach to the parent's buffer without this process taking ownership"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+class Detector:
+    def __init__(self, cv2, width, blob_color):
+        self.cv2 = cv2
+        self.width = width
+        self.ranges = BLOB_COLORS.get(blob_color)
+        self.aruco = None
+        if hasattr(cv2, "aruco"):
+            dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+            if hasattr(cv2.aruco, "ArucoDetector"):
+                detector = cv2.aruco.ArucoDetector(dictionary, cv2.aruco.DetectorParameters())
+                self.aruco = detector.detectMarkers
+            else:
+                self.aruco = lambda gray: cv2.aruco.detectMarkers(gray, dictionary)
+
+    def process(self, frame):
+        cv2 = self.cv2
+        if frame.shape[2] == 4:
+            frame = frame[:, :, :3]
+        h, w = frame.shape[:2]
+        if w > self.width:
+            frame = cv2.resize(frame, (self.width, int(h * self.width / w)),
+                               interpolation=cv2.INTER_AREA)
+            h, w = frame.shape[:2]
+        return {"markers": self.markers(frame, w, h), "blob": self.blob(frame, w, h)}
+
+    def markers(self, frame, w, h):
+        if not self.aruco:
+            return []
+        gray = self.cv2.cvtColor(frame, self.cv2.COLOR_BGR2GRAY)
+        corners, ids, _ = self.aruco(gray)
+        if ids is None:
+            return []
+        found = []
+        for quad, marker_id in zip(corners, ids.flatten()):
+            points = quad.reshape(-1, 2)
+            cx, cy = points.mean(axis=0)
+            found.append({
+                "id": int(marker_id),
+                "x": round(float(cx / w * 2 - 1), 3),
+                "y": round(float(cy / h * 2 - 1), 3),
+                "size": round(float(np.ptp(points[:, 0]) / w), 3)
+            })
+        return found
+
+    def blob(self, frame, w, h):
+        if not self.ranges:
+            return None
+        cv2 = self.cv2
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        mask = None
+        for low, high in self.ranges:
+            part = cv2.inRange(hsv, low, high)
+            mask = part if mask is None else mask | part
+        moments = cv2.moments(mask, binaryImage=True)
+        area = moments["m00"] / (w * h)
+        if area < MIN_BLOB_AREA:
+            return None
+        return {
+            "x": round(moments["m10"] / moments["m00"] / w * 2 - 1, 3),
+            "y": round(moments["m01"] / moments["m00"] / h * 2 - 1, 3),
+            "area": round(area, 4)
+        }
+
+def worker(width, blob_color):
+    """Read frame notices on stdin, write one JSON result line per frame"""
+    out = sys.stdout.buffer
+
+    def reply(message):
+        out.write(json.dumps(message).encode("utf-8") + b"\n")
+        out.flush()
+
+    try:
+        import cv2
+    except ImportError as e:
+        reply({"error": f"OpenCV not available: {e}", "fatal": True})
+        return 1
+    detector = Detector(cv2, width, blob_color)
+    attached = {}
+
+    for line in sys.stdin.buffer:
+        notice = json.loads(line)
+        try:
+            shm = attached.get(notice["shm"])
+            if shm is None:
+                for old in attached.values():
+                    old.close()
+                attached = {notice["shm"]: attach(notice["shm"])}
+                shm = attached[notice["shm"]]
+            frame = np.ndarray(tuple(notice["shape"]), dtype=np.uint8, buffer=shm.buf)
+            result = detector.process(frame)
+            del frame
+        except Exception as e:
+            reply({"error": str(e)})
+            continue
+        result["seq"] = notice["seq"]
+        result["time"] = notice["time"]
+        result["latency_ms"] = round((time.time() - notice["time"]) * 1000, 1)
+        reply(result)
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Vision detection worker")
+    parser.add_argument("--worker", action="store_true", required=True)
+    parser.add_argument("--width", type=int, default=320, help="downscale frames to this width")
+    parser.add_argument("--blob", default="red", help="blob colour: " + ", ".join(BLOB_COLORS))
+    args = parser.parse_args()
+    sys.exit(worker(args.width, args.blob))